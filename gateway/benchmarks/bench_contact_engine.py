@@ -0,0 +1,110 @@
+"""
+Benchmark of the overlap of the reservations used by the contact tracing:
+the nested loop used before the ContactEngine, the groups by
+(restaurant, day) and the numpy columns.
+
+Run it from the gateway folder:
+    python benchmarks/bench_contact_engine.py
+"""
+
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.services.contact_engine import ContactEngine, DATE_FORMAT  # noqa: E402
+
+REPEAT = 3
+SIZES = (1000, 10000, 100000)
+CUSTOMER_VISITS = 10
+
+
+def reservations(size: int, restaurants: int = 200) -> list:
+    rnd = random.Random(size)
+    first_day = datetime(2020, 11, 1, 12, 0)
+    result = []
+    for i in range(size):
+        start = first_day + timedelta(
+            days=rnd.randint(0, 13), minutes=rnd.randint(0, 600)
+        )
+        end = start + timedelta(minutes=rnd.choice([30, 60, 90, 120]))
+        result.append(
+            {
+                "id": i,
+                "customer_id": rnd.randint(1, size // 5 + 1),
+                "people": [],
+                "table": {
+                    "id": i % 50,
+                    "restaurant": {"id": rnd.randint(1, restaurants)},
+                },
+                "reservation_date": start.strftime(DATE_FORMAT),
+                "reservation_end": end.strftime(DATE_FORMAT),
+            }
+        )
+    return result
+
+
+def nested_loop(customer_reservations: list, all_reservations: list) -> list:
+    """
+    The loop of HealthyServices.search_contacts before the ContactEngine
+    """
+    result = []
+    for reservation in customer_reservations:
+        start = datetime.strptime(reservation["reservation_date"], DATE_FORMAT)
+        end = datetime.strptime(reservation["reservation_end"], DATE_FORMAT)
+        restaurant_id = reservation["table"]["restaurant"]["id"]
+        contacts = []
+        for one_reservation in all_reservations:
+            if one_reservation["table"]["restaurant"]["id"] != restaurant_id:
+                continue
+            start_contact = datetime.strptime(
+                one_reservation["reservation_date"], DATE_FORMAT
+            )
+            end_contact = datetime.strptime(
+                one_reservation["reservation_end"], DATE_FORMAT
+            )
+            if start.date() != start_contact.date():
+                continue
+            if not (end_contact < start or start_contact > end):
+                contacts.append(one_reservation)
+        result.append(contacts)
+    return result
+
+
+def main():
+    # sparse: the whole window of 200 restaurants, dense: the window already
+    # filtered by the restaurants and the days of the customer (2 restaurants)
+    print(
+        "{:<8} {:>8} {:>12} {:>12} {:>12}".format(
+            "window", "rows", "nested ms", "groups ms", "numpy ms"
+        )
+    )
+    for name, restaurants in (("sparse", 200), ("dense", 2)):
+        for size in SIZES:
+            window = reservations(size, restaurants)
+            customer = window[:CUSTOMER_VISITS]
+            nested_time = timeit.timeit(lambda: nested_loop(customer, window), number=1)
+            groups_time = timeit.timeit(
+                lambda: ContactEngine.find_contacts(customer, window), number=REPEAT
+            )
+            numpy_time = timeit.timeit(
+                lambda: ContactEngine.find_contacts_numpy(customer, window),
+                number=REPEAT,
+            )
+            print(
+                "{:<8} {:>8} {:>12.1f} {:>12.1f} {:>12.1f}".format(
+                    name,
+                    size,
+                    nested_time * 1000,
+                    groups_time * 1000 / REPEAT,
+                    numpy_time * 1000 / REPEAT,
+                )
+            )
+
+
+if __name__ == "__main__":
+    ContactEngine.configure({"CONTACT_ENGINE": "python"})
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark of the json backends and of the gzip compression on bodies
+similar to the ones sent by the microservices.
+
+Run it from the gateway folder:
+    python benchmarks/bench_json_codec.py
+"""
+
+import gzip
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.utils.json_codec import BACKENDS  # noqa: E402
+
+REPEAT = 200
+
+
+def restaurants(size: int = 200) -> list:
+    return [
+        {
+            "id": i,
+            "name": "Restaurant {}".format(i),
+            "lat": 43.7 + i / 1000,
+            "lon": 10.4 + i / 1000,
+            "phone": "050123{:04d}".format(i),
+            "covid_measures": "masks and distance",
+            "avg_time": 30,
+            "rating": 3.5,
+            "owner_email": "owner{}@gooutsafe.com".format(i),
+        }
+        for i in range(size)
+    ]
+
+
+def reservations(size: int = 2000) -> list:
+    return [
+        {
+            "id": i,
+            "reservation_date": "2020-11-{:02d}T20:00:00Z".format(1 + i % 14),
+            "customer_id": i % 300,
+            "people_number": 1 + i % 6,
+            "checkin": i % 2 == 0,
+            "table": {
+                "id": i % 50,
+                "name": "Table {}".format(i % 50),
+                "max_seats": 6,
+                "restaurant": {"id": i % 200, "name": "Restaurant {}".format(i % 200)},
+            },
+        }
+        for i in range(size)
+    ]
+
+
+def positive_users(size: int = 500) -> list:
+    return [
+        {
+            "id": i,
+            "email": "user{}@gooutsafe.com".format(i),
+            "firstname": "Name{}".format(i),
+            "lastname": "Surname{}".format(i),
+            "phone": "333000{:04d}".format(i),
+            "dateofbirth": "1990-01-01",
+            "is_positive": True,
+            "date_positive": "2020-11-10T00:00:00Z",
+        }
+        for i in range(size)
+    ]
+
+
+def main():
+    payloads = {
+        "restaurants": restaurants(),
+        "reservations 14 days": reservations(),
+        "positive users": positive_users(),
+    }
+    print("{:<22} {:>10} {:>10} {:>8}".format("payload", "bytes", "gzip", "ratio"))
+    for name, payload in payloads.items():
+        raw = BACKENDS["json"][1](payload)
+        compressed = gzip.compress(raw, compresslevel=4)
+        print(
+            "{:<22} {:>10} {:>10} {:>7.1f}x".format(
+                name, len(raw), len(compressed), len(raw) / len(compressed)
+            )
+        )
+
+    print()
+    print(
+        "{:<22} {:<8} {:>12} {:>12}".format(
+            "payload", "backend", "loads ms", "dumps ms"
+        )
+    )
+    for name, payload in payloads.items():
+        raw = BACKENDS["json"][1](payload)
+        for backend, (loads, dumps) in BACKENDS.items():
+            load_time = timeit.timeit(lambda: loads(raw), number=REPEAT)
+            dump_time = timeit.timeit(lambda: dumps(payload), number=REPEAT)
+            print(
+                "{:<22} {:<8} {:>12.3f} {:>12.3f}".format(
+                    name,
+                    backend,
+                    load_time * 1000 / REPEAT,
+                    dump_time * 1000 / REPEAT,
+                )
+            )
+        compressed = gzip.compress(raw, compresslevel=4)
+        unzip_time = timeit.timeit(lambda: gzip.decompress(compressed), number=REPEAT)
+        print(
+            "{:<22} {:<8} {:>12.3f}".format(name, "gunzip", unzip_time * 1000 / REPEAT)
+        )
+
+
+if __name__ == "__main__":
+    main()
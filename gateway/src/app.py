@@ -3,6 +3,20 @@ import logging
 from flask import Flask
 from src.views import blueprints
 from src.auth import login_manager
+from src.utils.http_pool import HttpPool
+from src.utils.fan_out import FanOut
+from src.utils.circuit_breaker import CircuitBreakers
+from src.utils.deadline import Deadline
+from src.utils.response_cache import UpstreamCache
+from src.utils.log_utils import StructuredLogger
+from src.utils.json_codec import JsonCodec
+from src.utils.retry import Retries
+from src.utils.load_balancer import LoadBalancer
+from src.utils.metrics import Metrics
+from src.utils.tracing import Tracer
+from src.utils.jobs import Jobs
+from src.services.contact_engine import ContactEngine
+from src.services.copresence_index import CoPresenceIndex
 
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
@@ -16,6 +30,101 @@ def create_app(tests=False):
     else:
         app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///tests/gooutsafe.db"
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # connection pool of each upstream microservice
+    app.config["HTTP_POOL_CONNECTIONS"] = 4
+    app.config["HTTP_POOL_MAXSIZE"] = 16
+    app.config["HTTP_POOL_BLOCK"] = False
+    app.config["HTTP_POOL_SIZES"] = {"restaurants": 32}
+    HttpPool.configure(app.config)
+    # threads used to call the microservices at the same time
+    app.config["FANOUT_MAX_WORKERS"] = 16
+    app.config["FANOUT_TIMEOUT"] = 10
+    FanOut.configure(app.config)
+    # circuit breaker of each upstream microservice
+    app.config["CIRCUIT_BREAKER_WINDOW"] = 20
+    app.config["CIRCUIT_BREAKER_MIN_CALLS"] = 5
+    app.config["CIRCUIT_BREAKER_FAILURE_RATE"] = 0.5
+    app.config["CIRCUIT_BREAKER_SLOW_CALL"] = 5.0
+    app.config["CIRCUIT_BREAKER_OPEN_SECONDS"] = 30
+    CircuitBreakers.configure(app.config)
+    # seconds that a request can use to call the microservices
+    # (a view can change it with the decorator request_budget)
+    app.config["REQUEST_BUDGET"] = 10
+    app.config["HTTP_TIMEOUT"] = 30
+    Deadline.init_app(app)
+    # cache of the GET requests to the restaurants microservice
+    # (RESPONSE_CACHE_TTL is a dict route name -> seconds, see UpstreamCache)
+    app.config["RESPONSE_CACHE_SIZE"] = 1024
+    app.config["RESPONSE_CACHE_TTL"] = {}
+    UpstreamCache.configure(app.config)
+    # rate (0-1) of the debug messages written for each logger, e.g. {"http": 0.1}
+    app.config["LOG_SAMPLING"] = {}
+    StructuredLogger.configure(app.config)
+    # decoder of the json responses ("orjson" or "json")
+    app.config["JSON_CODEC"] = "orjson"
+    JsonCodec.configure(app.config)
+    # retries and hedged requests of the GET requests without side effects
+    # (the extra requests are limited by a budget for each upstream, see Retries)
+    app.config["RETRY_ATTEMPTS"] = 3
+    app.config["RETRY_BACKOFF"] = 0.05
+    app.config["RETRY_BACKOFF_MAX"] = 1.0
+    app.config["RETRY_BUDGET_RATIO"] = 0.1
+    app.config["RETRY_BUDGET_MIN"] = 1.0
+    app.config["HEDGE_UPSTREAMS"] = ["restaurants"]
+    app.config["HEDGE_PERCENTILE"] = 95
+    app.config["HEDGE_MIN_SAMPLES"] = 20
+    app.config["HEDGE_MAX_WORKERS"] = 8
+    app.config["HEDGE_ATTEMPT_WORKERS"] = 32
+    Retries.configure(app.config)
+    # replicas called directly without nginx, dict upstream name -> base URLs
+    # e.g. {"restaurants": ["http://restaurants_api_2:5003/restaurants", ...]}
+    # (the upstreams that are not here are called through nginx)
+    app.config["UPSTREAM_ENDPOINTS"] = {}
+    app.config["LB_EJECT_FAILURES"] = 3
+    app.config["LB_EJECT_SECONDS"] = 10
+    LoadBalancer.configure(app.config)
+    # latency histograms of the views and of the microservices (see /metrics)
+    Metrics.init_app(app)
+    # spans of each request ("memory", "file" with TRACE_FILE, or None)
+    app.config["TRACE_EXPORTER"] = "memory"
+    app.config["TRACE_MEMORY_SIZE"] = 1000
+    Tracer.init_app(app)
+    # users asked at the same time and seconds they are kept in memory
+    # by UserService.get_users_by_ids (0 disable the memory)
+    app.config["USER_BATCH_CONCURRENCY"] = 8
+    app.config["USER_CACHE_TTL"] = 60
+    # seconds the parsed openings of a restaurant are kept in memory
+    # by RestaurantServices.get_schedule_restaurant (0 disable the memory)
+    app.config["OPENING_HOURS_TTL"] = 300
+    # (restaurant, day) visited by a positive customer whose reservations
+    # are asked at the same time by the contact tracing
+    app.config["TRACING_CONCURRENCY"] = 8
+    # max distance of the contacts of the contacts (/search_contacts?hops=2)
+    # and max customers found by one of these searches
+    app.config["TRACING_MAX_HOPS"] = 2
+    app.config["TRACING_MAX_CONTACTS"] = 500
+    # the reservations of a window are asked in shards of days, at the same
+    # time and the finished shards are kept in memory (0 send one request),
+    # a window with more than BOOKING_SHARD_MAX shards is asked with one request
+    app.config["BOOKING_SHARD_DAYS"] = 1
+    app.config["BOOKING_SHARD_CONCURRENCY"] = 4
+    app.config["BOOKING_SHARD_TTL"] = 300
+    app.config["BOOKING_SHARD_MAX"] = 31
+    # reservations of each (restaurant, day) kept inside the sqlite database
+    # for the contact tracing, read again by the sync (see CoPresenceIndex)
+    app.config["COPRESENCE_INDEX"] = tests is False
+    app.config["COPRESENCE_MAX_AGE"] = 900
+    app.config["COPRESENCE_SYNC_SECONDS"] = 600
+    app.config["COPRESENCE_DAYS"] = 14
+    CoPresenceIndex.init_app(app)
+    # overlap of the reservations of the contact tracing ("python" or "numpy")
+    app.config["CONTACT_ENGINE"] = "python"
+    ContactEngine.configure(app.config)
+    # background jobs of the views (e.g. the contact tracing of mark positive)
+    app.config["JOBS_MAX_WORKERS"] = 2
+    app.config["JOBS_BUDGET"] = 300
+    app.config["JOBS_KEEP"] = 100
+    Jobs.configure(app.config)
 
     for bp in blueprints:
         app.register_blueprint(bp)
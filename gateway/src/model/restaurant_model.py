@@ -14,6 +14,7 @@ class RestaurantModel:
         self.dishes = []
         self.opening_hours = []
         self.cusine = []
+        self.reviews = []
 
     def bind_menu(self, db_object):
         """
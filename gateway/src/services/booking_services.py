@@ -1,8 +1,32 @@
+from datetime import datetime, timedelta
+
+from flask import current_app
+
 from src.app_constant import BOOKING_MICROSERVICE_URL
+from src.services.copresence_index import CoPresenceIndex
 from src.utils import HttpUtils
+from src.utils.fan_out import FanOut
+from src.utils.response_cache import ResponseCache
+from src.utils.tracing import traced
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+EPOCH = datetime(1970, 1, 1)
 
 
+@traced
 class BookingServices:
+    """
+    The reservations of a time window can be asked in shards of
+    BOOKING_SHARD_DAYS days aligned to the days since 1970, so two windows
+    that overlap ask the same shards. The shards are asked at the same
+    time (BOOKING_SHARD_CONCURRENCY requests at most) and the shards that
+    are finished are kept in memory for BOOKING_SHARD_TTL seconds.
+    A window longer than BOOKING_SHARD_MAX shards is asked with one request.
+    """
+
+    # url of the shard -> reservations, used by get_reservation_by_constraint
+    _shards_cache = ResponseCache(max_size=1024)
+
     @staticmethod
     def book(
         restaurant_id,
@@ -22,6 +46,14 @@ class BookingServices:
         if is_debug is True:
             json["is_debug"] = True
         response, code = HttpUtils.make_post_request(BOOKING_MICROSERVICE_URL, json)
+        BookingServices.forget_shards(date=py_datetime)
+        if response is not None:
+            CoPresenceIndex.record(response, restaurant_id, py_datetime)
+        else:
+            # the booking can be stored also if the answer is an error
+            CoPresenceIndex.forget_bucket(
+                restaurant_id, py_datetime.strftime("%Y-%m-%d")
+            )
         return response
 
     @staticmethod
@@ -31,6 +63,11 @@ class BookingServices:
                 BOOKING_MICROSERVICE_URL, reservation_id, customer_id
             )
         )
+        BookingServices.forget_shards(reservation_id)
+        if response is not None:
+            CoPresenceIndex.forget(reservation_id)
+        else:
+            CoPresenceIndex.forget_bucket_of(reservation_id)
         return response
 
     @staticmethod
@@ -52,6 +89,17 @@ class BookingServices:
         response, code = HttpUtils.make_put_request(
             "{}/{}".format(BOOKING_MICROSERVICE_URL, reservation_id), json
         )
+        BookingServices.forget_shards(reservation_id, py_datetime)
+        if response is not None:
+            # the reservation can be moved in another restaurant or day
+            CoPresenceIndex.forget(reservation_id)
+            CoPresenceIndex.record(response, restaurant_id, py_datetime)
+        else:
+            # the change can be stored also if the answer is an error
+            CoPresenceIndex.forget_bucket_of(reservation_id)
+            CoPresenceIndex.forget_bucket(
+                restaurant_id, py_datetime.strftime("%Y-%m-%d")
+            )
         return response
 
     @staticmethod
@@ -66,11 +114,151 @@ class BookingServices:
         response = HttpUtils.make_get_request(BOOKING_MICROSERVICE_URL)
         return response
 
+    @staticmethod
+    def iter_all_booking():
+        """
+        Same of get_all_booking, but the reservations are decoded one
+        at a time while they are received
+        :return a generator of the reservations, or None if there is some error
+        """
+        return HttpUtils.make_get_list_stream(BOOKING_MICROSERVICE_URL)
+
     @staticmethod
     def get_reservation_by_constraint(
+        user_id: int = None,
+        from_data=None,
+        to_data=None,
+        restaurant_id: int = None,
+        sharded: bool = True,
+    ):
+        """
+        Return the reservations with the filters, if the window has a start
+        and an end and BOOKING_SHARD_DAYS is not 0 the window is asked in shards
+        :param sharded: False to ask the window with one request, e.g. when
+        the caller already runs inside the fan-out
+        :return the list of reservations or None if there is some error
+        """
+        shard_days = current_app.config.get("BOOKING_SHARD_DAYS", 0)
+        if sharded and shard_days > 0 and from_data and to_data:
+            shards = BookingServices._shards_of(from_data, to_data, shard_days)
+            if len(shards) <= current_app.config.get("BOOKING_SHARD_MAX", 31):
+                return BookingServices._get_sharded(
+                    user_id, from_data, to_data, restaurant_id, shards
+                )
+        url = BookingServices._constraint_url(
+            user_id, from_data, to_data, restaurant_id
+        )
+        response = HttpUtils.make_get_request(url)
+        return response
+
+    @staticmethod
+    def _get_sharded(user_id, from_data, to_data, restaurant_id, shards: list):
+        """
+        Ask the shards of the window at the same time and merge them in order
+        of time, the reservations out of the window are removed as the
+        booking microservice does when the window is asked with one request
+        :param shards: the shards of the window (see _shards_of)
+        :return the list of reservations or None if a shard is not available
+        """
+        concurrency = max(current_app.config.get("BOOKING_SHARD_CONCURRENCY", 4), 1)
+        ttl = current_app.config.get("BOOKING_SHARD_TTL", 300)
+        now = datetime.utcnow()
+        results = {}
+        missing = []
+        for shard in shards:
+            url = BookingServices._constraint_url(
+                user_id, shard[0], shard[1], restaurant_id
+            )
+            reservations = BookingServices._shards_cache.get(url)
+            if reservations is None:
+                missing.append((shard, url))
+            else:
+                results[shard] = reservations
+        for start in range(0, len(missing), concurrency):
+            urls = dict(missing[start : start + concurrency])
+            calls = {
+                shard: lambda url=url: HttpUtils.make_get_request(url)
+                for shard, url in urls.items()
+            }
+            for shard, reservations in FanOut.run(calls).items():
+                if reservations is None:
+                    return None
+                results[shard] = reservations
+                # the reservations of a finished shard do not change
+                # often, they are removed when a booking is changed
+                if ttl > 0 and shard[1] < now:
+                    BookingServices._shards_cache.set(
+                        urls[shard], reservations, ttl, tag=shard
+                    )
+
+        first = from_data.strftime(DATE_FORMAT)
+        last = to_data.strftime(DATE_FORMAT)
+        merged = []
+        for shard in shards:
+            merged += [
+                reservation
+                for reservation in results[shard]
+                if first <= reservation["reservation_date"] <= last
+            ]
+        return merged
+
+    @staticmethod
+    def _shards_of(from_data: datetime, to_data: datetime, shard_days: int) -> list:
+        """
+        :return the list of tuple (start, end) of the shards that cover the
+        window, each shard is shard_days days aligned to the days since 1970
+        """
+        days = (from_data - EPOCH).days
+        start = EPOCH + timedelta(days=days - days % shard_days)
+        shards = []
+        while start <= to_data:
+            end = start + timedelta(days=shard_days)
+            shards.append((start, end - timedelta(seconds=1)))
+            start = end
+        return shards
+
+    @staticmethod
+    def forget_shards(reservation_id=None, date: datetime = None):
+        """
+        Remove the shards changed by a booking from the memory,
+        without arguments all the shards are removed
+        :param reservation_id: the booking changed, the shards with it are removed
+        :param date: the date of the booking, the shards of the date are removed
+        """
+        if reservation_id is None and date is None:
+            BookingServices._shards_cache.invalidate(lambda key, entry: True)
+            return
+        reservation_id = str(reservation_id)
+
+        def _changed(key, entry) -> bool:
+            if date is not None and entry.tag[0] <= date <= entry.tag[1]:
+                return True
+            return any(
+                str(reservation.get("id")) == reservation_id
+                for reservation in entry.value
+            )
+
+        BookingServices._shards_cache.invalidate(_changed)
+
+    @staticmethod
+    def iter_reservation_by_constraint(
         user_id: int = None, from_data=None, to_data=None, restaurant_id: int = None
     ):
-        """"""
+        """
+        Same of get_reservation_by_constraint, but the reservations are decoded
+        one at a time while they are received, so a long time window does not
+        need to be all in memory
+        :return a generator of the reservations, or None if there is some error
+        """
+        url = BookingServices._constraint_url(
+            user_id, from_data, to_data, restaurant_id
+        )
+        return HttpUtils.make_get_list_stream(url)
+
+    @staticmethod
+    def _constraint_url(
+        user_id: int = None, from_data=None, to_data=None, restaurant_id: int = None
+    ) -> str:
         url = BOOKING_MICROSERVICE_URL
         # add filters...
         if from_data:
@@ -85,6 +273,4 @@ class BookingServices:
             url = HttpUtils.append_query(url, "user_id", user_id)
         if restaurant_id:
             url = HttpUtils.append_query(url, "restaurant_id", restaurant_id)
-
-        response = HttpUtils.make_get_request(url)
-        return response
+        return url
@@ -0,0 +1,237 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+SECONDS_IN_DAY = 24 * 60 * 60
+
+
+def parse_datetime(value: str) -> datetime:
+    """
+    Parse a date of the booking microservice (e.g. 2020-11-10T20:00:00Z)
+    """
+    if len(value) == 20 and value[-1] == "Z":
+        return datetime.fromisoformat(value[:-1])
+    return datetime.strptime(value, DATE_FORMAT)
+
+
+class Visit:
+    """
+    A reservation with the dates already parsed, the index is the
+    position of the reservation inside the list where it was read
+    """
+
+    __slots__ = ("reservation", "index", "restaurant_id", "start", "end")
+
+    def __init__(self, reservation: dict, index: int = 0):
+        self.reservation = reservation
+        self.index = index
+        self.restaurant_id = reservation["table"]["restaurant"]["id"]
+        self.start = parse_datetime(reservation["reservation_date"])
+        self.end = parse_datetime(reservation["reservation_end"])
+
+    @property
+    def key(self) -> tuple:
+        """
+        :return tuple (restaurant id, day) of the visit
+        """
+        return self.restaurant_id, self.start.date()
+
+
+class _VisitGroup:
+    """
+    The visits of a restaurant in a day sorted by start, with the longest
+    visit, so the visits that can overlap an interval are found with a
+    binary search and a scan of the visits started in the window
+    """
+
+    __slots__ = ("visits", "starts", "longest")
+
+    def __init__(self, visits: list):
+        self.visits = sorted(visits, key=lambda visit: (visit.start, visit.index))
+        self.starts = [visit.start for visit in self.visits]
+        self.longest = max(
+            [visit.end - visit.start for visit in self.visits] + [timedelta(0)]
+        )
+
+    def overlapping(self, start: datetime, end: datetime) -> list:
+        """
+        :return the visits that are inside the restaurant between start and end
+        """
+        first = bisect_left(self.starts, start - self.longest)
+        last = bisect_right(self.starts, end)
+        return [visit for visit in self.visits[first:last] if visit.end >= start]
+
+
+class _Columns:
+    """
+    The reservations as numpy columns sorted by (restaurant, start), the
+    dates are epoch seconds parsed by numpy all together
+    """
+
+    def __init__(self, reservations: list):
+        restaurants = numpy.fromiter(
+            (r["table"]["restaurant"]["id"] for r in reservations),
+            dtype=numpy.int64,
+            count=len(reservations),
+        )
+        starts = _epochs([r["reservation_date"] for r in reservations])
+        ends = _epochs([r["reservation_end"] for r in reservations])
+        order = numpy.lexsort((starts, restaurants))
+        self.reservations = reservations
+        self.index = order
+        self.restaurants = restaurants[order]
+        self.starts = starts[order]
+        self.ends = ends[order]
+
+    def overlapping(self, restaurant_id: int, start: int, end: int):
+        """
+        :param start: epoch seconds of the start of the visit
+        :param end: epoch seconds of the end of the visit
+        :return the sorted indexes of the reservations in the restaurant
+        that start in the same day of the visit and overlap it
+        """
+        first = numpy.searchsorted(self.restaurants, restaurant_id, "left")
+        last = numpy.searchsorted(self.restaurants, restaurant_id, "right")
+        starts = self.starts[first:last]
+        day = start - start % SECONDS_IN_DAY
+        low = numpy.searchsorted(starts, day, "left")
+        high = numpy.searchsorted(starts, min(end, day + SECONDS_IN_DAY - 1), "right")
+        ends = self.ends[first + low : first + high]
+        found = self.index[first + low : first + high][ends >= start]
+        found.sort()
+        return found
+
+
+def _epochs(values: list):
+    """
+    :return the epoch seconds of the dates (e.g. 2020-11-10T20:00:00Z)
+    """
+    return numpy.array([value[:19] for value in values], dtype="datetime64[s]").astype(
+        numpy.int64
+    )
+
+
+class ContactEngine:
+    """
+    This class finds the reservations that are in the same restaurant at
+    the same time of the reservations of a positive customer.
+    The reservations are grouped by (restaurant, day) and sorted by start,
+    so each reservation is parsed once and the contacts are found with a
+    sweep of the group, instead of comparing all the reservations with
+    each reservation of the customer.
+    The contacts can also be found converting the reservations in numpy
+    columns (see find_contacts_numpy), it is faster only when most of the
+    reservations are in the restaurants and days of the customer, because
+    the columns are built reading all the reservations
+    (see benchmarks/bench_contact_engine.py).
+
+    The engine can be changed with the following app config:
+    - CONTACT_ENGINE: "python" or "numpy" (used only if numpy is installed)
+    """
+
+    engine = "python"
+
+    @staticmethod
+    def configure(config):
+        """
+        Read the engine from the flask config
+        :param config: the flask app config (or a dict with the same keys)
+        """
+        ContactEngine.engine = config.get("CONTACT_ENGINE", "python")
+
+    @staticmethod
+    def group(reservations, days: set = None) -> dict:
+        """
+        :param reservations: iterable of reservations of the booking microservice
+        :param days: set of (restaurant id, day as YYYY-MM-DD), if it is not
+        None the other reservations are skipped without parsing their dates
+        :return dict (restaurant id, day) -> visits of the group
+        """
+        groups = {}
+        for index, reservation in enumerate(reservations):
+            if (
+                days is not None
+                and (
+                    reservation["table"]["restaurant"]["id"],
+                    reservation["reservation_date"][:10],
+                )
+                not in days
+            ):
+                continue
+            visit = Visit(reservation, index)
+            groups.setdefault(visit.key, []).append(visit)
+        return {key: _VisitGroup(visits) for key, visits in groups.items()}
+
+    @staticmethod
+    def find_contacts(customer_reservations, all_reservations) -> list:
+        """
+        Find the reservations that overlap the reservations of the customer
+        in the same restaurant and in the same day, two reservations overlap
+        if one does not end before the start of the other one.
+        :param customer_reservations: the reservations of the positive customer
+        :param all_reservations: the reservations of the same period
+        :return list of tuple (customer visit, list of contact visits), one
+        for each reservation of the customer with the same order, the contacts
+        keep the order of all_reservations
+        """
+        if not isinstance(all_reservations, list):
+            all_reservations = list(all_reservations)
+        if ContactEngine.engine == "numpy" and numpy is not None:
+            try:
+                return ContactEngine.find_contacts_numpy(
+                    customer_reservations, all_reservations
+                )
+            except ValueError:
+                # a date that numpy can not parse
+                pass
+        visits = [
+            Visit(reservation, index)
+            for index, reservation in enumerate(customer_reservations)
+        ]
+        groups = ContactEngine.group(
+            all_reservations,
+            {(visit.restaurant_id, visit.start.date().isoformat()) for visit in visits},
+        )
+        result = []
+        for visit in visits:
+            group = groups.get(visit.key)
+            if group is None:
+                result.append((visit, []))
+                continue
+            contacts = group.overlapping(visit.start, visit.end)
+            contacts.sort(key=lambda contact: contact.index)
+            result.append((visit, contacts))
+        return result
+
+    @staticmethod
+    def find_contacts_numpy(customer_reservations, all_reservations: list) -> list:
+        """
+        Same of find_contacts, but all_reservations are converted in numpy
+        columns, only the reservations in contact are read again
+        :raise ValueError if a date of the reservations is not valid
+        """
+        result = []
+        if len(all_reservations) == 0:
+            return [
+                (Visit(reservation, index), [])
+                for index, reservation in enumerate(customer_reservations)
+            ]
+        columns = _Columns(all_reservations)
+        epoch = datetime(1970, 1, 1)
+        for index, reservation in enumerate(customer_reservations):
+            visit = Visit(reservation, index)
+            found = columns.overlapping(
+                visit.restaurant_id,
+                int((visit.start - epoch).total_seconds()),
+                int((visit.end - epoch).total_seconds()),
+            )
+            contacts = [
+                Visit(all_reservations[position], int(position)) for position in found
+            ]
+            result.append((visit, contacts))
+        return result
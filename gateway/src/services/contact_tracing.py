@@ -0,0 +1,450 @@
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from src.services.user_service import UserService
+from src.services.booking_services import BookingServices
+from src.services.restaurant_services import RestaurantServices
+from src.services.contact_engine import ContactEngine, DATE_FORMAT, parse_datetime
+from src.services.opening_hours import OpeningHoursResolver
+from src.services.copresence_index import CoPresenceIndex
+from src.utils.fan_out import FanOut
+from src.utils.log_utils import get_logger
+from src.utils.tracing import traced
+
+log = get_logger("services.contact_tracing")
+
+# days before the marking where the reservations of the customer are traced
+TRACING_DAYS = 14
+
+# errors of the contact tracing
+NOT_POSITIVE = "not_positive"
+UPSTREAM_ERROR = "upstream_error"
+
+
+class ContactTrace:
+    """
+    The result of the contact tracing of a positive customer, the GUI and
+    the emails are projections of the same result (see gui_rows and email_contacts)
+    """
+
+    def __init__(self, user_id=None, date_marking: datetime = None, error=None):
+        self.user_id = user_id
+        self.date_marking = date_marking
+        # None, NOT_POSITIVE or UPSTREAM_ERROR
+        self.error = error
+        self.customer_email = None
+        # tuple (reservation, restaurant, start) of each reservation in contact,
+        # the restaurant is None if it is not available
+        self.contacts = []
+        # user id -> UserModel of the customers in contact
+        self.users = {}
+        # the people of the reservations of the positive customer
+        self.visit_friends = []
+        self.past_restaurants = []
+        self.future_restaurants = []
+        # hop distance -> tuple (reservation, start) of the first contact with
+        # each customer, filled by ContactTracing.trace_hops
+        self.hops = {}
+        # True if trace_hops stopped at TRACING_MAX_CONTACTS customers
+        self.truncated = False
+
+    def _user_rows(self, reservations) -> list:
+        rows = []
+        for reservation in reservations:
+            user = self.users.get(reservation["customer_id"])
+            if user is not None:
+                rows.append(
+                    [
+                        len(rows) + 1,
+                        user.firstname + " " + user.lastname,
+                        user.dateofbirth,
+                        user.email,
+                        user.phone,
+                    ]
+                )
+        return rows
+
+    def gui_rows(self) -> list:
+        """
+        :return the rows of the contacts shown by the health authority,
+        [number, name, date of birth, email, phone]
+        """
+        return self._user_rows(reservation for reservation, _, _ in self.contacts)
+
+    def hop_rows(self) -> dict:
+        """
+        :return hop distance -> rows of the customers at that distance
+        (see gui_rows), the distance 1 are the direct contacts
+        """
+        return {
+            hop: self._user_rows(reservation for reservation, _ in contacts)
+            for hop, contacts in sorted(self.hops.items())
+        }
+
+    def email_contacts(self) -> dict:
+        """
+        :return the json of the emails sent to the contacts, to the
+        restaurants visited and to the restaurants where the customer has a booking
+        """
+        friends = list(self.visit_friends)
+        contacts = []
+        for reservation, restaurant, start in self.contacts:
+            user = self.users.get(reservation["customer_id"])
+            if user is None or restaurant is None:
+                continue
+            contacts.append(
+                {
+                    "email": user.email,
+                    "name": user.firstname,
+                    "restaurant_name": restaurant.name,
+                    "date": start.strftime(DATE_FORMAT),
+                }
+            )
+            friends = friends + reservation["people"]
+        return {
+            "friends": friends,
+            "contacts": contacts,
+            "past_restaurants": self.past_restaurants,
+            "reservation_restaurants": self.future_restaurants,
+        }
+
+
+@traced
+class ContactTracing:
+    """
+    This class traces the contacts of a positive customer: it reads the
+    reservations of the customer in the TRACING_DAYS before the marking,
+    the reservations in the same restaurants and days, the customers in
+    contact, the restaurants visited and the future bookings of the customer.
+    Each of them is asked once, so the search of the health authority and
+    the emails sent when a customer is marked as positive share the same work.
+    """
+
+    @staticmethod
+    def trace(user_email: str = None, user_phone: str = None, job=None) -> ContactTrace:
+        """
+        :param user_email: the email of the positive customer
+        :param user_phone: the phone of the positive customer, used without the email
+        :param job: the Job where the progress is written (reservations_scanned
+        and contacts_found), if the tracing runs in background
+        :return the ContactTrace, with the error set if the tracing is not possible
+        """
+        response = UserService.search_possible_contacts(user_email, user_phone)
+        if response is None:
+            return ContactTrace(error=NOT_POSITIVE)
+
+        user_id = response["user_id"]
+        date_marking = datetime.strptime(response["from_date"], "%Y-%m-%d")
+        trace = ContactTrace(user_id, date_marking)
+        from_date = date_marking - timedelta(days=TRACING_DAYS)
+
+        # each restaurant and its schedule are asked once for all the visits
+        restaurants = {}
+
+        def restaurant_of(restaurant_id):
+            if restaurant_id not in restaurants:
+                restaurants[restaurant_id] = RestaurantServices.get_rest_by_id(
+                    restaurant_id
+                )
+            return restaurants[restaurant_id]
+
+        opening_hours = OpeningHoursResolver(RestaurantServices.get_schedule_restaurant)
+
+        reservations_customer = BookingServices.get_reservation_by_constraint(
+            user_id, from_data=from_date, to_data=date_marking
+        )
+        if reservations_customer is not None:
+            all_reservations = ContactTracing._reservations_in_same_visits(
+                reservations_customer, job
+            )
+            if all_reservations is None:
+                trace.error = UPSTREAM_ERROR
+                return trace
+
+            for visit, visit_contacts in ContactEngine.find_contacts(
+                reservations_customer, all_reservations
+            ):
+                log.debug(
+                    "I'm working with reserv from {} to {}", visit.start, visit.end
+                )
+                restaurant = restaurant_of(visit.restaurant_id)
+                if restaurant is not None:
+                    trace.visit_friends += visit.reservation["people"]
+                    trace.past_restaurants.append(
+                        {
+                            "email": restaurant.owner_email,
+                            "name": restaurant.name,
+                            "date": visit.start.strftime(DATE_FORMAT),
+                        }
+                    )
+                # if people are in the restaurant at lunch or dinner
+                if len(visit_contacts) == 0 or not opening_hours.in_service_hours(
+                    visit.restaurant_id, visit.start, visit.end
+                ):
+                    continue
+                # they are contacts!
+                for contact in visit_contacts:
+                    trace.contacts.append(
+                        (contact.reservation, restaurant, visit.start)
+                    )
+
+            # API: get user email and name of all the contacts
+            trace.users = UserService.get_users_by_ids(
+                reservation["customer_id"] for reservation, _, _ in trace.contacts
+            )
+            if job is not None:
+                job.update(contacts_found=len(trace.users))
+
+        if user_email is not None and len(user_email) != 0:
+            trace.customer_email = user_email
+        else:
+            customer = UserService.get_user_by_id(user_id)
+            if customer is not None:
+                trace.customer_email = customer.email
+
+        # API booking: get all future booking of the customer
+        future_reservations = BookingServices.get_reservation_by_constraint(
+            user_id, from_data=date_marking
+        )
+        for future_reservation in future_reservations or []:
+            restaurant = restaurant_of(future_reservation["table"]["restaurant"]["id"])
+            if restaurant is not None:
+                date = parse_datetime(future_reservation["reservation_date"])
+                trace.future_restaurants.append(
+                    {
+                        "email": restaurant.owner_email,
+                        "name": restaurant.name,
+                        "date": date.strftime(DATE_FORMAT),
+                        "customer_email": trace.customer_email,
+                    }
+                )
+        return trace
+
+    @staticmethod
+    def trace_hops(
+        user_email: str = None, user_phone: str = None, max_hops: int = 1, job=None
+    ) -> ContactTrace:
+        """
+        Trace the contacts of the positive customer and the contacts of
+        the contacts, with a breadth first search over the customers that were
+        in the same restaurant at the same time. Each level reads the
+        reservations of its customers and the reservations in the same
+        restaurant and day as trace, a (restaurant, day) is asked once for
+        all the levels and the CoPresenceIndex is used for it. The users
+        of each level are asked together, and a customer is visited once at
+        the distance where it is found first. A contact is followed only in
+        the reservations that start after the contact, and the search stops
+        after TRACING_MAX_CONTACTS customers.
+        :param max_hops: the max distance from the positive customer,
+        up to TRACING_MAX_HOPS
+        :param job: the Job where the progress is written (reservations_scanned,
+        contacts_found and hops_done)
+        :return the ContactTrace with the hops and the users set,
+        with the error set if the tracing is not possible
+        """
+        response = UserService.search_possible_contacts(user_email, user_phone)
+        if response is None:
+            return ContactTrace(error=NOT_POSITIVE)
+
+        user_id = response["user_id"]
+        date_marking = datetime.strptime(response["from_date"], "%Y-%m-%d")
+        trace = ContactTrace(user_id, date_marking)
+        from_date = date_marking - timedelta(days=TRACING_DAYS)
+        max_hops = min(max(max_hops, 1), current_app.config.get("TRACING_MAX_HOPS", 2))
+        max_contacts = current_app.config.get("TRACING_MAX_CONTACTS", 500)
+        opening_hours = OpeningHoursResolver(RestaurantServices.get_schedule_restaurant)
+
+        visited = {user_id}
+        # customer id -> the contact from which it is followed (None for the positive)
+        frontier = {user_id: None}
+        # (restaurant, day) -> its reservations, each of them is asked once
+        same_visits = {}
+        for hop in range(1, max_hops + 1):
+            if hop == 1:
+                reservations_frontier = BookingServices.get_reservation_by_constraint(
+                    user_id, from_data=from_date, to_data=date_marking
+                )
+            else:
+                reservations_frontier = ContactTracing._reservations_of_customers(
+                    frontier, date_marking
+                )
+            if reservations_frontier is None:
+                trace.error = UPSTREAM_ERROR
+                return trace
+            # only the (restaurant, day) not seen at the previous levels are asked
+            new_visits = [
+                reservation
+                for reservation in reservations_frontier
+                if ContactTracing._visit_of(reservation) not in same_visits
+            ]
+            reservations = ContactTracing._reservations_in_same_visits(new_visits, job)
+            if reservations is None:
+                trace.error = UPSTREAM_ERROR
+                return trace
+            for reservation in new_visits:
+                same_visits[ContactTracing._visit_of(reservation)] = []
+            for reservation in reservations:
+                visit = ContactTracing._visit_of(reservation)
+                same_visits.setdefault(visit, []).append(reservation)
+            all_reservations = [
+                reservation
+                for visit in sorted(
+                    {
+                        ContactTracing._visit_of(reservation)
+                        for reservation in reservations_frontier
+                    }
+                )
+                for reservation in same_visits[visit]
+            ]
+
+            found = {}
+            for visit, visit_contacts in ContactEngine.find_contacts(
+                reservations_frontier, all_reservations
+            ):
+                if trace.truncated:
+                    break
+                if len(visit_contacts) == 0 or not opening_hours.in_service_hours(
+                    visit.restaurant_id, visit.start, visit.end
+                ):
+                    continue
+                for contact in visit_contacts:
+                    customer_id = contact.reservation["customer_id"]
+                    if customer_id in visited:
+                        continue
+                    if len(visited) - 1 >= max_contacts:
+                        trace.truncated = True
+                        break
+                    visited.add(customer_id)
+                    found[customer_id] = (contact.reservation, visit.start)
+
+            if len(found) == 0:
+                break
+            trace.hops[hop] = list(found.values())
+            # API: get user email and name of the contacts of the level
+            trace.users.update(UserService.get_users_by_ids(found.keys()))
+            if job is not None:
+                job.update(contacts_found=len(trace.users), hops_done=hop)
+            if trace.truncated:
+                log.info("Contact tracing of {} stopped at {}", user_id, hop)
+                break
+            frontier = {customer_id: start for customer_id, (_, start) in found.items()}
+        return trace
+
+    @staticmethod
+    def _reservations_of_customers(customers: dict, to_date: datetime):
+        """
+        Return the reservations of the customers from their contact, each
+        customer is asked with one request and TRACING_CONCURRENCY requests
+        at the same time
+        :param customers: customer id -> datetime of its contact, only the
+        reservations that start after it are kept
+        :param to_date: the end of the tracing period
+        :return the list of reservations or None if there is some error
+        """
+        customer_ids = sorted(customers)
+        concurrency = max(current_app.config.get("TRACING_CONCURRENCY", 8), 1)
+        result = []
+        for start in range(0, len(customer_ids), concurrency):
+            # the window is not asked in shards, the call runs inside the fan-out
+            calls = {
+                customer_id: lambda customer_id=customer_id: (
+                    BookingServices.get_reservation_by_constraint(
+                        customer_id,
+                        from_data=customers[customer_id],
+                        to_data=to_date,
+                        sharded=False,
+                    )
+                )
+                for customer_id in customer_ids[start : start + concurrency]
+            }
+            for customer_id, reservations in FanOut.run(calls).items():
+                if reservations is None:
+                    log.error("Reservations of {} not available", customer_id)
+                    return None
+                since = customers[customer_id]
+                result += [
+                    reservation
+                    for reservation in reservations
+                    if parse_datetime(reservation["reservation_date"]) >= since
+                ]
+        return result
+
+    @staticmethod
+    def _reservations_in_same_visits(reservations_customer, job=None):
+        """
+        Return the reservations that are in the same restaurant and in the
+        same day of a reservation of the customer. Only the reservations of
+        each (restaurant, day) visited are asked, once for each of them and
+        TRACING_CONCURRENCY requests at the same time, instead of all the
+        reservations of the tracing period. The (restaurant, day) inside the
+        CoPresenceIndex are read from it and the others are stored inside it.
+        :param job: the Job where the reservations read are counted
+        :return the list of reservations or None if there is some error
+        """
+        visits = sorted(
+            {
+                ContactTracing._visit_of(reservation)
+                for reservation in reservations_customer
+            }
+        )
+        concurrency = max(current_app.config.get("TRACING_CONCURRENCY", 8), 1)
+        result = []
+        scanned = 0
+        # the (restaurant, day) already inside the index are not asked
+        missing = []
+        for visit in visits:
+            reservations = CoPresenceIndex.visits(*visit)
+            if reservations is None:
+                missing.append(visit)
+            else:
+                result += reservations
+        visits = missing
+        for start in range(0, len(visits), concurrency):
+            calls = {
+                visit: lambda visit=visit: ContactTracing._reservations_of_visit(*visit)
+                for visit in visits[start : start + concurrency]
+            }
+            for visit, reservations in FanOut.run(calls).items():
+                if reservations is None:
+                    log.error("Reservations of the visit {} not available", visit)
+                    return None
+                scanned += len(reservations)
+                reservations = [
+                    reservation
+                    for reservation in reservations
+                    if ContactTracing._visit_of(reservation) == visit
+                ]
+                CoPresenceIndex.store(visit[0], visit[1], reservations)
+                result += reservations
+            if job is not None:
+                job.update(reservations_scanned=scanned)
+        return result
+
+    @staticmethod
+    def _reservations_of_visit(restaurant_id, day: str):
+        """
+        The day is asked with one request and not in shards, because this
+        method already runs inside the fan-out
+        :param day: the day as YYYY-MM-DD
+        :return the reservations of the restaurant in the day,
+        or None if there is some error
+        """
+        from_date = datetime.strptime(day, "%Y-%m-%d")
+        to_date = from_date + timedelta(days=1) - timedelta(seconds=1)
+        return BookingServices.get_reservation_by_constraint(
+            from_data=from_date,
+            to_data=to_date,
+            restaurant_id=restaurant_id,
+            sharded=False,
+        )
+
+    @staticmethod
+    def _visit_of(reservation) -> tuple:
+        """
+        :return tuple (restaurant id, day) of the reservation
+        """
+        return (
+            reservation["table"]["restaurant"]["id"],
+            reservation["reservation_date"][:10],
+        )
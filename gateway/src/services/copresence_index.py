@@ -0,0 +1,335 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from src.utils.json_codec import JsonCodec
+from src.utils.log_utils import get_logger
+
+log = get_logger("services.copresence")
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS copresence_visits ("
+    " reservation_id INTEGER PRIMARY KEY,"
+    " restaurant_id INTEGER NOT NULL,"
+    " day TEXT NOT NULL,"
+    " data BLOB NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS copresence_visits_bucket"
+    " ON copresence_visits (restaurant_id, day)",
+    "CREATE TABLE IF NOT EXISTS copresence_buckets ("
+    " restaurant_id INTEGER NOT NULL,"
+    " day TEXT NOT NULL,"
+    " synced_at REAL NOT NULL,"
+    " PRIMARY KEY (restaurant_id, day))",
+)
+
+
+def sqlite_path(uri: str, root_path: str = None) -> str:
+    """
+    :return the path of the file of a sqlite URI (e.g. sqlite:///db/gooutsafe.db),
+    a relative path is relative to root_path as in flask-sqlalchemy
+    """
+    if not uri.startswith("sqlite:///"):
+        raise ValueError("Not a sqlite URI: {}".format(uri))
+    path = uri[len("sqlite:///") :]
+    if root_path is not None and not os.path.isabs(path):
+        path = os.path.join(root_path, path)
+    return path
+
+
+def bucket_of(reservation: dict):
+    """
+    :return tuple (restaurant id, day as YYYY-MM-DD) of the reservation,
+    or None if the reservation has not these fields
+    """
+    try:
+        return (
+            int(reservation["table"]["restaurant"]["id"]),
+            reservation["reservation_date"][:10],
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class CoPresenceIndex:
+    """
+    This class keeps in a local sqlite database the reservations of each
+    (restaurant, day), so the contact tracing reads the people that were in
+    the same restaurant in the same day without asking the booking microservice.
+
+    A (restaurant, day) is used only if it is complete: it is stored the
+    first time it is asked to the booking microservice and by the sync, that
+    every COPRESENCE_SYNC_SECONDS reads again the last COPRESENCE_DAYS days.
+    The bookings made through the gateway are written in the index at once,
+    if the response of the booking microservice has not the whole reservation
+    its (restaurant, day) is asked again at the next lookup.
+
+    The index can be changed with the following app config:
+    - COPRESENCE_INDEX: True to use the index
+    - SQLALCHEMY_DATABASE_URI: the sqlite database of the index
+    - COPRESENCE_MAX_AGE: seconds after that a (restaurant, day) is asked again
+    - COPRESENCE_SYNC_SECONDS: seconds between two syncs (0 disable the sync)
+    - COPRESENCE_DAYS: days read by the sync
+    """
+
+    _lock = threading.Lock()
+    _local = threading.local()
+    _path = None
+    _max_age = 900
+    _days = 14
+    _sync_thread = None
+
+    @staticmethod
+    def configure(config, root_path: str = None):
+        """
+        Read the database from the flask config and create the tables
+        :param config: the flask app config (or a dict with the same keys)
+        :param root_path: the folder of the relative paths of the database
+        """
+        with CoPresenceIndex._lock:
+            CoPresenceIndex._path = None
+            CoPresenceIndex._local = threading.local()
+            CoPresenceIndex._max_age = config.get("COPRESENCE_MAX_AGE", 900)
+            CoPresenceIndex._days = config.get("COPRESENCE_DAYS", 14)
+            if not config.get("COPRESENCE_INDEX", False):
+                return
+            path = sqlite_path(config["SQLALCHEMY_DATABASE_URI"], root_path)
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            CoPresenceIndex._path = path
+        with CoPresenceIndex._connection() as connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+    @staticmethod
+    def init_app(app):
+        """
+        Read the config and start the thread of the sync at the first request,
+        so it runs only in the process that serves the requests (the reloader
+        of flask runs create_app also in its parent process)
+        """
+        CoPresenceIndex.configure(app.config, app.root_path)
+        seconds = app.config.get("COPRESENCE_SYNC_SECONDS", 0)
+        if CoPresenceIndex._path is None or seconds <= 0:
+            return
+
+        @app.before_first_request
+        def _start_sync():
+            CoPresenceIndex.start_sync(app, seconds)
+
+    @staticmethod
+    def start_sync(app, seconds: float):
+        """
+        Start the thread that runs the sync each seconds, once for the process
+        """
+        with CoPresenceIndex._lock:
+            if CoPresenceIndex._sync_thread is not None:
+                return
+            CoPresenceIndex._sync_thread = threading.Thread(
+                target=CoPresenceIndex._sync_forever,
+                args=(app, seconds),
+                name="copresence-sync",
+                daemon=True,
+            )
+        CoPresenceIndex._sync_thread.start()
+
+    @staticmethod
+    def _sync_forever(app, seconds: float):
+        while True:
+            time.sleep(seconds)
+            with app.app_context():
+                try:
+                    CoPresenceIndex.sync()
+                except Exception as ex:
+                    log.error("Sync of the co-presence index failed: {}", repr(ex))
+
+    @staticmethod
+    def enabled() -> bool:
+        return CoPresenceIndex._path is not None
+
+    @staticmethod
+    def _connection() -> sqlite3.Connection:
+        # one connection for each thread, sqlite serializes the writes
+        local = CoPresenceIndex._local
+        connection = getattr(local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(CoPresenceIndex._path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            local.connection = connection
+        return connection
+
+    @staticmethod
+    def visits(restaurant_id, day: str):
+        """
+        :param day: the day as YYYY-MM-DD
+        :return the reservations of the restaurant in the day, or None if
+        the (restaurant, day) is not inside the index or it is too old
+        """
+        if not CoPresenceIndex.enabled():
+            return None
+        connection = CoPresenceIndex._connection()
+        row = connection.execute(
+            "SELECT synced_at FROM copresence_buckets"
+            " WHERE restaurant_id = ? AND day = ?",
+            (int(restaurant_id), day),
+        ).fetchone()
+        if row is None or time.time() - row[0] > CoPresenceIndex._max_age:
+            return None
+        rows = connection.execute(
+            "SELECT data FROM copresence_visits"
+            " WHERE restaurant_id = ? AND day = ? ORDER BY reservation_id",
+            (int(restaurant_id), day),
+        ).fetchall()
+        return [JsonCodec.loads(data) for data, in rows]
+
+    @staticmethod
+    def store(restaurant_id, day: str, reservations: list):
+        """
+        Replace the reservations of the restaurant in the day
+        :param reservations: all the reservations of the restaurant in the day
+        """
+        if not CoPresenceIndex.enabled():
+            return
+        key = (int(restaurant_id), day)
+        rows = [
+            (int(reservation["id"]), key[0], key[1], JsonCodec.dumps(reservation))
+            for reservation in reservations
+            if bucket_of(reservation) == key
+        ]
+        with CoPresenceIndex._connection() as connection:
+            connection.execute(
+                "DELETE FROM copresence_visits WHERE restaurant_id = ? AND day = ?",
+                key,
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO copresence_visits VALUES (?, ?, ?, ?)", rows
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO copresence_buckets VALUES (?, ?, ?)",
+                key + (time.time(),),
+            )
+
+    @staticmethod
+    def record(reservation, restaurant_id=None, date: datetime = None):
+        """
+        Write a reservation made through the gateway
+        :param reservation: the reservation returned by the booking microservice
+        :param restaurant_id: the restaurant of the reservation, used with date
+        if the reservation is not complete, so its (restaurant, day) is asked again
+        """
+        if not CoPresenceIndex.enabled():
+            return
+        key = bucket_of(reservation) if isinstance(reservation, dict) else None
+        if key is None or "id" not in reservation:
+            if restaurant_id is not None and date is not None:
+                CoPresenceIndex.forget_bucket(restaurant_id, date.strftime("%Y-%m-%d"))
+            return
+        with CoPresenceIndex._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO copresence_visits VALUES (?, ?, ?, ?)",
+                (int(reservation["id"]), key[0], key[1], JsonCodec.dumps(reservation)),
+            )
+
+    @staticmethod
+    def forget(reservation_id):
+        """
+        Remove a reservation, e.g. when it is deleted or moved
+        """
+        if not CoPresenceIndex.enabled():
+            return
+        with CoPresenceIndex._connection() as connection:
+            connection.execute(
+                "DELETE FROM copresence_visits WHERE reservation_id = ?",
+                (int(reservation_id),),
+            )
+
+    @staticmethod
+    def forget_bucket(restaurant_id, day: str):
+        """
+        The reservations of the restaurant in the day are not complete,
+        they are asked again at the next lookup
+        """
+        if not CoPresenceIndex.enabled():
+            return
+        with CoPresenceIndex._connection() as connection:
+            connection.execute(
+                "DELETE FROM copresence_buckets WHERE restaurant_id = ? AND day = ?",
+                (int(restaurant_id), day),
+            )
+
+    @staticmethod
+    def forget_bucket_of(reservation_id):
+        """
+        The (restaurant, day) of the reservation is not complete anymore,
+        e.g. the booking microservice did not answer to a change of it
+        """
+        if not CoPresenceIndex.enabled():
+            return
+        row = (
+            CoPresenceIndex._connection()
+            .execute(
+                "SELECT restaurant_id, day FROM copresence_visits"
+                " WHERE reservation_id = ?",
+                (int(reservation_id),),
+            )
+            .fetchone()
+        )
+        if row is not None:
+            CoPresenceIndex.forget_bucket(*row)
+
+    @staticmethod
+    def _restaurants_of_day(day: str) -> list:
+        """
+        :return the ids of the restaurants with a bucket or a reservation
+        inside the index in the day
+        """
+        rows = (
+            CoPresenceIndex._connection()
+            .execute(
+                "SELECT restaurant_id FROM copresence_buckets WHERE day = ?"
+                " UNION SELECT restaurant_id FROM copresence_visits WHERE day = ?",
+                (day, day),
+            )
+            .fetchall()
+        )
+        return [restaurant_id for restaurant_id, in rows]
+
+    @staticmethod
+    def sync(today: datetime = None) -> int:
+        """
+        Read again the reservations of the last COPRESENCE_DAYS days, the
+        buckets of a day read are replaced, also the ones without reservations
+        :return the number of reservations read
+        """
+        # BookingServices imports this module to record the bookings
+        from src.services.booking_services import BookingServices
+
+        if not CoPresenceIndex.enabled():
+            return 0
+        if today is None:
+            today = datetime.utcnow()
+        today = datetime(today.year, today.month, today.day)
+        read = 0
+        for days_ago in range(CoPresenceIndex._days, -1, -1):
+            start = today - timedelta(days=days_ago)
+            reservations = BookingServices.get_reservation_by_constraint(
+                from_data=start, to_data=start + timedelta(days=1, seconds=-1)
+            )
+            if reservations is None:
+                log.error("Reservations of {} not available for the sync", start)
+                continue
+            # the buckets of the day emptied by the booking microservice
+            # are stored empty, otherwise they keep the old reservations
+            day = start.strftime("%Y-%m-%d")
+            buckets = {
+                (restaurant_id, day): []
+                for restaurant_id in CoPresenceIndex._restaurants_of_day(day)
+            }
+            for reservation in reservations:
+                key = bucket_of(reservation)
+                if key is not None:
+                    buckets.setdefault(key, []).append(reservation)
+            for key, bucket in buckets.items():
+                CoPresenceIndex.store(key[0], key[1], bucket)
+            read += len(reservations)
+        return read
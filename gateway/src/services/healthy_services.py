@@ -1,13 +1,15 @@
-from flask import current_app
-from src.utils.http_utils import HttpUtils
-from datetime import datetime, timedelta
 from src.services import UserService
 from src.services.send_email_service import SendEmailService
-from src.services.booking_services import BookingServices
-from src.services.restaurant_services import RestaurantServices
+from src.services.contact_tracing import ContactTracing, NOT_POSITIVE
 from src.app_constant import *
+from src.utils.jobs import Jobs
+from src.utils.log_utils import get_logger
+from src.utils.tracing import traced
 
+log = get_logger("services.health")
 
+
+@traced
 class HealthyServices:
     """
     This class is a service that has inside it all the component
@@ -33,6 +35,45 @@ class HealthyServices:
         else:
             return "An error occurs, please try again"
 
+    @staticmethod
+    def start_mark_positive(user_email: str = None, user_phone: str = None):
+        """
+        Mark the user as positive and start in background the contact tracing
+        and the emails to the contacts, see Jobs
+        :return tuple (Job, message), the job is None and the message is
+        not empty if the user can not be marked as positive
+        """
+        if user_email is None and user_phone is None:
+            return None, "Insert an email or a phone number"
+        response = UserService.mark_positive(user_email, user_phone)
+        if response is None:
+            return None, "An error occurs, please try again"
+        job = Jobs.submit(
+            "mark_positive",
+            lambda job: HealthyServices._notify_contacts(user_email, user_phone, job),
+        )
+        return job, ""
+
+    @staticmethod
+    def _notify_contacts(user_email: str, user_phone: str, job) -> str:
+        """
+        The work of the job of start_mark_positive, the progress is written
+        inside the job (reservations_scanned, contacts_found, emails_dispatched)
+        :return the message of the job
+        """
+        trace = ContactTracing.trace(user_email, user_phone, job)
+        if trace.error is not None:
+            raise RuntimeError("Error, please try again")
+        contacts = trace.email_contacts()
+        if not SendEmailService.send_possible_contact(contacts):
+            raise RuntimeError("The emails to the contacts are not sent")
+        emails = sum(
+            len(contacts[key])
+            for key in ("contacts", "past_restaurants", "reservation_restaurants")
+        )
+        job.update(emails_dispatched=emails)
+        return "{} contacts notified".format(len(contacts["contacts"]))
+
     @staticmethod
     def unmark_positive(user_email: str = None, user_phone: str = None) -> str:
         """
@@ -54,261 +95,47 @@ class HealthyServices:
 
     @staticmethod
     def search_contacts(user_email: str, user_phone: str):
+        """
+        Search the contacts of the positive customer for the health authority
+        :return the rows of the contacts (see ContactTrace.gui_rows), a message
+        if the customer is not positive or None if there is some error
+        """
         if user_email == "" and user_phone == "":
             return "Insert an email or a phone number"
-        response = UserService.search_possible_contacts(user_email, user_phone)
-
-        if response is None:
+        trace = ContactTracing.trace(user_email, user_phone)
+        if trace.error == NOT_POSITIVE:
             return "The customer not registered or not positive"
+        if trace.error is not None:
+            return None
+        return trace.gui_rows()
 
-        contact_users_GUI = []
-        # now we have the information about the positivity of the user in response
-        date_marking = response["from_date"]
-        user_id = response["user_id"]
-
-        # start to check contacts
-        # API: get all reservation of the customer between date_marking and date_marking -14
-        date_marking = datetime.strptime(date_marking, "%Y-%m-%d")
-        to_date = date_marking - timedelta(days=14)
-        reservations_customer = BookingServices.get_reservation_by_constraint(
-            user_id, from_data=to_date, to_data=date_marking
-        )
-
-        i = 1
-        if reservations_customer is not None:
-            all_reservations = BookingServices.get_reservation_by_constraint(
-                from_data=to_date, to_data=date_marking
-            )
-            if all_reservations is None:
-                return None
-
-            for reservation in reservations_customer:
-                restaurant_id = reservation["table"]["restaurant"]["id"]
-
-                start = datetime.strptime(
-                    reservation["reservation_date"], "%Y-%m-%dT%H:%M:%SZ"
-                )
-                end = datetime.strptime(
-                    reservation["reservation_end"], "%Y-%m-%dT%H:%M:%SZ"
-                )
-                current_app.logger.debug(
-                    "I'm working with reserv from {} to {}".format(start, end)
-                )
-                for one_reservation in all_reservations:
-                    restaurant_id_contact = one_reservation["table"]["restaurant"]["id"]
-                    if restaurant_id_contact != restaurant_id:
-                        continue
-                    start_contact = datetime.strptime(
-                        one_reservation["reservation_date"], "%Y-%m-%dT%H:%M:%SZ"
-                    )
-                    end_contact = datetime.strptime(
-                        one_reservation["reservation_end"], "%Y-%m-%dT%H:%M:%SZ"
-                    )
-
-                    # if people are in the same restaurant in the same day
-                    if start.date() == start_contact.date():
-                        openings = RestaurantServices.get_opening_hours_restaurant(
-                            restaurant_id
-                        )
-
-                        dayNumber = start.weekday()
-                        restaurant_hours = []
-                        current_app.logger.debug(
-                            "I got openings. Start is {}".format(dayNumber)
-                        )
-                        for opening in openings:
-                            if opening["week_day"] == dayNumber:
-                                restaurant_hours.append(
-                                    datetime.strptime(opening["open_lunch"], "%H:%M")
-                                )
-                                restaurant_hours.append(
-                                    datetime.strptime(opening["close_lunch"], "%H:%M")
-                                )
-                                restaurant_hours.append(
-                                    datetime.strptime(opening["open_dinner"], "%H:%M")
-                                )
-                                restaurant_hours.append(
-                                    datetime.strptime(opening["close_dinner"], "%H:%M")
-                                )
-
-                        # if people are in the restaurant at lunch or dinner
-                        if (
-                            restaurant_hours[0].time() <= start.time()
-                            and restaurant_hours[1].time() >= end.time()
-                        ) or (
-                            restaurant_hours[2].time() <= start.time()
-                            and restaurant_hours[3].time() >= end.time()
-                        ):
-                            # people are in the same restaurant at lunch
-                            # if they are in the same time
-                            if (end_contact < start or start_contact > end) is False:
-                                # they are contacts!
-                                # API: get user email and name of the contact
-                                user = UserService.get_user_by_id(
-                                    one_reservation["customer_id"]
-                                )
-                                if user is not None:
-                                    contact_users_GUI.append(
-                                        [
-                                            i,
-                                            user.firstname + " " + user.lastname,
-                                            user.dateofbirth,
-                                            user.email,
-                                            user.phone,
-                                        ]
-                                    )
-                                    i += 1
-        return contact_users_GUI
+    @staticmethod
+    def search_contacts_by_hop(user_email: str, user_phone: str, max_hops: int):
+        """
+        Search the contacts of the positive customer and the contacts
+        of the contacts, up to max_hops (see ContactTracing.trace_hops)
+        :return the ContactTrace, a message if the customer is not positive
+        or None if there is some error
+        """
+        if user_email == "" and user_phone == "":
+            return "Insert an email or a phone number"
+        trace = ContactTracing.trace_hops(user_email, user_phone, max_hops)
+        if trace.error == NOT_POSITIVE:
+            return "The customer not registered or not positive"
+        if trace.error is not None:
+            return None
+        return trace
 
     @staticmethod
     def search_contacts_for_email(user_email: str, user_phone: str):
-
+        """
+        Search the contacts of the positive customer to send the emails
+        :return the json of the emails (see ContactTrace.email_contacts)
+        or a message if there is some error
+        """
         if user_email == "" and user_phone == "":
             return "Insert an email or a phone number"
-
-        friends = []
-        contacts = []
-        past_restaurants = []
-        future_restaurants = []
-
-        if user_email != "":
-            URL = USER_MICROSERVICE_URL + "/positiveinfo/email/" + str(user_email)
-        else:
-            URL = USER_MICROSERVICE_URL + "/positiveinfo/phone/" + str(user_phone)
-
-        # check if the user exists
-        # check if the user is positive (get also date of marking) (API)
-        response = HttpUtils.make_get_request(URL)
-        if response is None:
+        trace = ContactTracing.trace(user_email, user_phone)
+        if trace.error is not None:
             return "Error, please try again"
-
-        # now we have the information about the positivity of the user in response
-        date_marking = response["from_date"]
-        user_id = response["user_id"]
-
-        # start to check contacts
-        # API: get all reservation of the customer between date_marking and date_marking -14
-        date_marking = datetime.strptime(date_marking, "%Y-%m-%d")
-        to_date = date_marking - timedelta(days=14)
-        reservations_customer = BookingServices.get_reservation_by_constraint(
-            user_id, from_data=to_date, to_data=date_marking
-        )
-
-        if reservations_customer is not None:
-
-            # API: get all reservations between date_marking and date_m -14
-            all_reservations = BookingServices.get_reservation_by_constraint(
-                from_data=to_date, to_data=date_marking
-            )
-            for reservation in reservations_customer:
-                restaurant_id = reservation["table"]["restaurant"]["id"]
-                restaurant = RestaurantServices.get_rest_by_id(restaurant_id)
-                if restaurant is None:
-                    continue
-                friends = friends + reservation["people"]
-                start = datetime.strptime(
-                    reservation["reservation_date"], "%Y-%m-%dT%H:%M:%SZ"
-                )
-                end = datetime.strptime(
-                    reservation["reservation_end"], "%Y-%m-%dT%H:%M:%SZ"
-                )
-                past_restaurants.append(
-                    {
-                        "email": restaurant.owner_email,
-                        "name": restaurant.name,
-                        "date": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
-                    }
-                )
-                for one_reservation in all_reservations:
-                    restaurant_id_contact = one_reservation["table"]["restaurant"]["id"]
-                    if restaurant_id_contact != restaurant_id:
-                        continue
-
-                    start_contact = datetime.strptime(
-                        one_reservation["reservation_date"], "%Y-%m-%dT%H:%M:%SZ"
-                    )
-                    end_contact = datetime.strptime(
-                        one_reservation["reservation_end"], "%Y-%m-%dT%H:%M:%SZ"
-                    )
-                    # if people are in the same restaurant in the same day
-                    if start.date() != start_contact.date():
-                        continue
-                    openings = RestaurantServices.get_opening_hours_restaurant(
-                        restaurant_id
-                    )
-
-                    dayNumber = start.weekday()
-                    restaurant_hours = []
-                    for opening in openings:
-                        if opening["week_day"] == dayNumber:
-                            restaurant_hours.append(
-                                datetime.strptime(opening["open_lunch"], "%H:%M")
-                            )
-                            restaurant_hours.append(
-                                datetime.strptime(opening["close_lunch"], "%H:%M")
-                            )
-                            restaurant_hours.append(
-                                datetime.strptime(opening["open_dinner"], "%H:%M")
-                            )
-                            restaurant_hours.append(
-                                datetime.strptime(opening["close_dinner"], "%H:%M")
-                            )
-
-                    # if people are in the restaurant at lunch or dinner
-                    if (
-                        restaurant_hours[0].time() <= start.time()
-                        and restaurant_hours[1].time() >= end.time()
-                    ) or (
-                        restaurant_hours[2].time() <= start.time()
-                        and restaurant_hours[3].time() >= end.time()
-                    ):
-                        # people are in the same restaurant at lunch
-                        # if they are in the same time
-                        if not ((end_contact < start) or (start_contact > end)):
-                            # they are contacts!
-                            # API: get user email and name of the contact
-                            user = UserService.get_user_by_id(
-                                one_reservation["customer_id"]
-                            )
-                            if user is not None:
-                                contacts.append(
-                                    {
-                                        "email": user.email,
-                                        "name": user.firstname,
-                                        "restaurant_name": restaurant.name,
-                                        "date": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
-                                    }
-                                )
-                                friends = friends + one_reservation["people"]
-        if user_email != "":
-            customer_email = user_email
-        else:
-            URL = USER_MICROSERVICE_URL + "/" + str(user_id)
-            user = HttpUtils.make_get_request(URL)
-            customer_email = user["email"]
-
-        # API booking: get all future booking of the customer
-        future_reservations = BookingServices.get_reservation_by_constraint(
-            user_id, from_data=to_date, to_data=date_marking
-        )
-        for future_reservation in future_reservations:
-            date = datetime.strptime(
-                reservation["reservation_date"], "%Y-%m-%dT%H:%M:%SZ"
-            )
-            restaurant_id = future_reservation["table"]["restaurant"]["id"]
-            restaurant = RestaurantServices.get_rest_by_id(restaurant_id)
-            if restaurant is not None:
-                future_restaurants.append(
-                    {
-                        "email": restaurant.owner_email,
-                        "name": restaurant.name,
-                        "date": date.strftime("%Y-%m-%dT%H:%M:%SZ"),
-                        "customer_email": customer_email,
-                    }
-                )
-        return {
-            "friends": friends,
-            "contacts": contacts,
-            "past_restaurants": past_restaurants,
-            "reservation_restaurants": future_restaurants,
-        }
+        return trace.email_contacts()
@@ -0,0 +1,79 @@
+from datetime import datetime, time
+
+# the keys of an opening of the restaurant microservice, (open, close) of each window
+WINDOWS = (("open_lunch", "close_lunch"), ("open_dinner", "close_dinner"))
+
+
+def parse_time(value) -> time:
+    """
+    Parse an hour of the openings (e.g. 12:30), None if it is missing
+    """
+    if value is None:
+        return None
+    return time.fromisoformat(str(value))
+
+
+class OpeningSchedule:
+    """
+    The openings of a restaurant already parsed, for each week day
+    the (open, close) of the lunch and of the dinner
+    """
+
+    __slots__ = ("_days",)
+
+    def __init__(self, openings: list):
+        """
+        :param openings: the openings of the restaurant microservice
+        (see RestaurantServices.get_opening_hours_restaurant)
+        """
+        self._days = {}
+        for opening in openings or []:
+            # the first opening of a day is the one used
+            if opening["week_day"] in self._days:
+                continue
+            windows = []
+            for open_key, close_key in WINDOWS:
+                start = parse_time(opening.get(open_key))
+                end = parse_time(opening.get(close_key))
+                if start is not None and end is not None:
+                    windows.append((start, end))
+            self._days[opening["week_day"]] = tuple(windows)
+
+    def is_open(self, start: datetime, end: datetime) -> bool:
+        """
+        :return True if the interval is inside the lunch or the dinner
+        of the week day of start
+        """
+        start_time = start.time()
+        end_time = end.time()
+        for open_time, close_time in self._days.get(start.weekday(), ()):
+            if open_time <= start_time and close_time >= end_time:
+                return True
+        return False
+
+
+class OpeningHoursResolver:
+    """
+    The schedules of the restaurants used during a contact tracing,
+    each schedule is asked once with fetch
+    """
+
+    def __init__(self, fetch):
+        """
+        :param fetch: function restaurant id -> OpeningSchedule or None
+        """
+        self._fetch = fetch
+        self._schedules = {}
+
+    def schedule_of(self, restaurant_id) -> OpeningSchedule:
+        if restaurant_id not in self._schedules:
+            self._schedules[restaurant_id] = self._fetch(restaurant_id)
+        return self._schedules[restaurant_id]
+
+    def in_service_hours(self, restaurant_id, start: datetime, end: datetime) -> bool:
+        """
+        :return True if the restaurant is open at lunch or at dinner between
+        start and end, False if its openings are not available
+        """
+        schedule = self.schedule_of(restaurant_id)
+        return schedule is not None and schedule.is_open(start, end)
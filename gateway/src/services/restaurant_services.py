@@ -8,18 +8,33 @@ from src.model.dish_model import DishModel
 from src.model.photo_model import PhotoModel
 from src.app_constant import RESTAURANTS_MICROSERVICE_URL
 from src.utils.http_utils import HttpUtils
+from src.utils.fan_out import FanOut
+from src.utils.response_cache import ResponseCache, UpstreamCache
+from src.services.opening_hours import OpeningSchedule
+from src.services.booking_services import BookingServices
 
 from src.model.review_model import ReviewModel
 
 from src.app_constant import BOOKING_MICROSERVICE_URL
+from src.utils.log_utils import get_logger
+from src.utils.tracing import traced
 
+log = get_logger("services.restaurants")
 
+
+@traced
 class RestaurantServices:
     """
     This services give the possibility to isolate all the operations
     about the restaurants with the database
+
+    The schedules read by get_schedule_restaurant are kept in memory
+    for OPENING_HOURS_TTL seconds.
     """
 
+    # restaurant id -> OpeningSchedule, used by get_schedule_restaurant
+    _schedules_cache = ResponseCache(max_size=1024)
+
     @staticmethod
     def create_new_restaurant(
         form: RestaurantForm, user_id: int, max_sit: int, user_email: str = None
@@ -32,30 +47,28 @@ class RestaurantServices:
         # Menu on restaurants microservices is the cuisine type on the form
         # avg_time is the the how much time the people stay inside the restaurants
         name_rest = form.name.data
-        current_app.logger.debug("New rest name is {}".format(name_rest))
+        log.debug("New rest name is {}", name_rest)
         # I'm putting this tries because form.sumbitting in the endpoint does not work
         # so I'm checking here if the field are ok
         try:
             phone_rest = int(form.phone.data)
         except:
             return None
-        current_app.logger.debug("Phone is: {}".format(phone_rest))
+        log.debug("Phone is: {}", phone_rest)
         covid_measures = form.covid_measures.data
-        current_app.logger.debug("Covid Measures is: {}".format(covid_measures))
+        log.debug("Covid Measures is: {}", covid_measures)
         if user_email is not None:
             owner_email = user_email
         else:
             owner_email = current_user.email
-        current_app.logger.debug("owner_email is {}".format(owner_email))
+        log.debug("owner_email is {}", owner_email)
         try:
             lat_rest = float(form.lat.data)
             lon_rest = float(form.lon.data)
         except Exception as e:
-            current_app.logger.error("Wrong lat/ton format\n{}".format(e))
+            log.error("Wrong lat/ton format\n{}", e)
             return None
-        current_app.logger.debug(
-            "Restaurant position is lat={} lon={}".format(lat_rest, lon_rest)
-        )
+        log.debug("Restaurant position is lat={} lon={}", lat_rest, lon_rest)
         restaurant_json = {
             "name": name_rest,
             "covid_measures": covid_measures,
@@ -66,10 +79,10 @@ class RestaurantServices:
             "rating": 0,
             "avg_time": 30,
         }
-        current_app.logger.debug("Restaurants obj is {}".format(restaurant_json))
+        log.debug("Restaurants obj is {}", restaurant_json)
         json_body["restaurant"] = restaurant_json
         n_table_rest = int(form.n_tables.data)
-        current_app.logger.debug("N tables is: {}".format(n_table_rest))
+        log.debug("N tables is: {}", n_table_rest)
         json_body["restaurant_tables"] = n_table_rest
         opening_json = []
 
@@ -77,28 +90,28 @@ class RestaurantServices:
         for i in range(len(days)):
             day_json = {}
             week_day = int(days[i])
-            current_app.logger.debug("Week day is {}".format(week_day))
+            log.debug("Week day is {}", week_day)
             close_dinner = str(form.close_dinner.data)
-            current_app.logger.debug("Close dinner {}".format(close_dinner))
+            log.debug("Close dinner {}", close_dinner)
             close_lunch = str(form.close_lunch.data)
-            current_app.logger.debug("Close lunch  {}".format(close_lunch))
+            log.debug("Close lunch  {}", close_lunch)
             close_lunch = str(form.close_lunch.data)
-            current_app.logger.debug("Close lunch  {}".format(close_lunch))
+            log.debug("Close lunch  {}", close_lunch)
             open_dinner = str(form.open_dinner.data)
-            current_app.logger.debug("Open dinner {}".format(open_dinner))
+            log.debug("Open dinner {}", open_dinner)
             open_lunch = str(form.open_lunch.data)
-            current_app.logger.debug("Open lunch {}".format(open_lunch))
+            log.debug("Open lunch {}", open_lunch)
             day_json["close_dinner"] = close_dinner
             day_json["close_lunch"] = close_lunch
             day_json["open_dinner"] = open_dinner
             day_json["open_lunch"] = open_lunch
             day_json["week_day"] = week_day
             opening_json.append(day_json)
-        current_app.logger.debug("Opening day list \n{}".format(opening_json))
+        log.debug("Opening day list \n{}", opening_json)
         json_body["opening"] = opening_json
 
         cuisine_type = form.cuisine.data
-        current_app.logger.debug("cuisine_type list is \n{}".format(cuisine_type))
+        log.debug("cuisine_type list is \n{}", cuisine_type)
         json_body["menu"] = cuisine_type
 
         url = "{}/create".format(RESTAURANTS_MICROSERVICE_URL)
@@ -107,6 +120,8 @@ class RestaurantServices:
         if restaurant is None:
             return None
         restaurant_model.fill_from_json(restaurant)
+        UpstreamCache.invalidate_restaurant(restaurant_model.id)
+        RestaurantServices.forget_schedule(restaurant_model.id)
         return restaurant_model
 
     @staticmethod
@@ -115,10 +130,10 @@ class RestaurantServices:
         Method to return a list of all restaurants inside the database
         """
         url = "{}".format(RESTAURANTS_MICROSERVICE_URL)
-        current_app.logger.debug("URL microservices: {}".format(url))
+        log.debug("URL microservices: {}", url)
         response = HttpUtils.make_get_request(url)
         if response is None:
-            current_app.logger.error("Microservices error")
+            log.error("Microservices error")
             return []
         return response["restaurants"]
 
@@ -129,11 +144,11 @@ class RestaurantServices:
         :param id: The restaurants id
         """
         url = "{}/{}".format(RESTAURANTS_MICROSERVICE_URL, id)
-        current_app.logger.debug("URL to microservices is {}".format(url))
+        log.debug("URL to microservices is {}", url)
         restaurant = HttpUtils.make_get_request(url)
         if restaurant is None:
             return None
-        current_app.logger.debug(restaurant)
+        log.debug(restaurant)
         restaurant_model = RestaurantModel()
         restaurant_model.fill_from_json(restaurant)
         return restaurant_model
@@ -144,7 +159,7 @@ class RestaurantServices:
         This method return the restaurants dished
         """
         url = "{}/{}/dishes".format(RESTAURANTS_MICROSERVICE_URL, restaurant_id)
-        current_app.logger.debug("URL to microservices is {}".format(url))
+        log.debug("URL to microservices is {}", url)
         response = HttpUtils.make_get_request(url)
         if response is None:
             return None
@@ -163,7 +178,7 @@ class RestaurantServices:
         This method help to retrieve all information inside the
         """
         url = "{}/{}/menu".format(RESTAURANTS_MICROSERVICE_URL, restaurant_id)
-        current_app.logger.debug("URL to microservices is {}".format(url))
+        log.debug("URL to microservices is {}", url)
         response = HttpUtils.make_get_request(url)
         if response is None:
             return None
@@ -180,6 +195,35 @@ class RestaurantServices:
             return None
         return response["openings"]
 
+    @staticmethod
+    def get_schedule_restaurant(restaurant_id: int):
+        """
+        This method return the openings of the restaurant already parsed,
+        the schedule is kept in memory so it is not asked and parsed again
+        :return OpeningSchedule or None if there is some error
+        """
+        schedule = RestaurantServices._schedules_cache.get(restaurant_id)
+        if schedule is not None:
+            return schedule
+        openings = RestaurantServices.get_opening_hours_restaurant(restaurant_id)
+        if openings is None:
+            return None
+        schedule = OpeningSchedule(openings)
+        ttl = current_app.config.get("OPENING_HOURS_TTL", 300)
+        if ttl > 0:
+            RestaurantServices._schedules_cache.set(restaurant_id, schedule, ttl)
+        return schedule
+
+    @staticmethod
+    def forget_schedule(restaurant_id):
+        """
+        Remove the schedule of the restaurant from the memory of
+        get_schedule_restaurant, e.g. when the restaurant is deleted
+        """
+        RestaurantServices._schedules_cache.invalidate(
+            lambda key, entry: key == restaurant_id
+        )
+
     @staticmethod
     def get_restaurant_tables(restaurant_id: int):
         """
@@ -197,9 +241,7 @@ class RestaurantServices:
         # and return a list of them
         all_tables = []
         for json_table in response["tables"]:
-            current_app.logger.debug(
-                "table {}, seats {}".format(json_table["name"], json_table["max_seats"])
-            )
+            log.debug("table {}, seats {}", json_table["name"], json_table["max_seats"])
             new_table = TableModel()
             new_table.fill_from_json(json_table)
             all_tables.append(new_table)
@@ -213,6 +255,7 @@ class RestaurantServices:
         """
         url = "{}/{}/tables".format(RESTAURANTS_MICROSERVICE_URL, table.restaurant_id)
         response = HttpUtils.make_post_request(url, table.serialize())
+        UpstreamCache.invalidate_restaurant(table.restaurant_id)
         if response is None:
             return None
         return True
@@ -235,15 +278,13 @@ class RestaurantServices:
         This method retrieval all information about the restaurants photos
         """
         url = "{}/{}/photos".format(RESTAURANTS_MICROSERVICE_URL, restaurant_id)
-        current_app.logger.debug("URL to microservices is {}".format(url))
+        log.debug("URL to microservices is {}", url)
         response = HttpUtils.make_get_request(url)
         if response is None:
             return None
         photos = []
         for json_photo in response["photos"]:
-            current_app.logger.debug(
-                "photo {}, url {}".format(json_photo["id"], json_photo["url"])
-            )
+            log.debug("photo {}, url {}", json_photo["id"], json_photo["url"])
             new_photo = PhotoModel()
             new_photo.fill_from_json(json_photo)
             photos.append(new_photo)
@@ -259,6 +300,7 @@ class RestaurantServices:
         response, code = HttpUtils.make_post_request(url, photo.serialize())
         if response is None:
             return None
+        UpstreamCache.invalidate_restaurant(photo.restaurant_id)
         photo.fill_from_json(response)
         return photo
 
@@ -290,11 +332,12 @@ class RestaurantServices:
 
         json = {"stars": stars, "review": review, "reviewer_email": reviewer_email}
         url = "{}/{}/reviews".format(RESTAURANTS_MICROSERVICE_URL, restaurant_id)
-        current_app.logger.debug("URL to microservices: {}".format(url))
+        log.debug("URL to microservices: {}", url)
         response, code = HttpUtils.make_post_request(url, json)
 
         if response is None:
             return None
+        UpstreamCache.invalidate_restaurant(restaurant_id)
 
         review = ReviewModel()
         json["id"] = response["id"]
@@ -375,42 +418,62 @@ class RestaurantServices:
         response = HttpUtils.make_get_request(
             "{}/{}/checkin".format(BOOKING_MICROSERVICE_URL, reservation_id)
         )
+        BookingServices.forget_shards(reservation_id)
         return response
 
     @staticmethod
-    def get_all_restaurants_info(restaurant_id: int):
+    def get_all_restaurants_info(
+        restaurant_id: int, with_reviews: bool = False, parallel: bool = True
+    ):
         """
         This method contains the logic to get all informations about the restaurants.
-        :return: RestaurantsModel
-        """
-        model = RestaurantServices.get_rest_by_id(restaurant_id)
-        if model is None:
-            return None
+        All the informations are independent, so by default the requests are made
+        at the same time and the method wait only the slowest one.
+        :param restaurant_id: The restaurants id
+        :param with_reviews: if True also three reviews are loaded inside the model
+        :param parallel: if False the requests are made one after another
+        :return: RestaurantsModel or None if one information is missing,
+        the reviews are empty if they are not available
+        """
+        calls = {
+            "restaurant": lambda: RestaurantServices.get_rest_by_id(restaurant_id),
+            "cuisine": lambda: RestaurantServices.get_menu_restaurant(restaurant_id),
+            "photos": lambda: RestaurantServices.get_photos_restaurants(restaurant_id),
+            "dishes": lambda: RestaurantServices.get_dishes_restaurant(restaurant_id),
+            "hours": lambda: RestaurantServices.get_opening_hours_restaurant(
+                restaurant_id
+            ),
+        }
+        if with_reviews:
+            calls["reviews"] = lambda: RestaurantServices.get_three_reviews(
+                restaurant_id
+            )
 
-        cuisine = RestaurantServices.get_menu_restaurant(restaurant_id)
-        if cuisine is None:
+        if parallel:
+            results = FanOut.run(calls)
+        else:
+            results = {}
+            for name, call in calls.items():
+                results[name] = call()
+                if results[name] is None:
+                    break
+        if with_reviews and results.get("reviews") is None:
+            # the reviews are not needed to show the sheet
+            results["reviews"] = []
+        if any(results.get(name) is None for name in calls.keys()):
             return None
-        model.bind_menu(cuisine)
 
-        photos = RestaurantServices.get_photos_restaurants(restaurant_id)
-        if photos is None:
-            return None
+        model = results["restaurant"]
+        model.bind_menu(results["cuisine"])
         # it's already a model now
         # model.bind_photo(photos)
-        model.photos = photos
-
-        dishes = RestaurantServices.get_dishes_restaurant(restaurant_id)
-        if dishes is None:
-            return None
+        model.photos = results["photos"]
         # it's already a model now
         # model.bind_dish(dishes)
-        model.dishes = dishes
-
-        q_hours = RestaurantServices.get_opening_hours_restaurant(restaurant_id)
-        if q_hours is None:
-            return None
-        model.bind_hours(q_hours)
-
+        model.dishes = results["dishes"]
+        model.bind_hours(results["hours"])
+        if with_reviews:
+            model.reviews = results["reviews"]
         return model
 
     @staticmethod
@@ -425,6 +488,7 @@ class RestaurantServices:
         url = "{}/update".format(RESTAURANTS_MICROSERVICE_URL)
         response, status_code = HttpUtils.make_put_request(url, restaurant.serialize())
         if status_code == 200:
+            UpstreamCache.invalidate_restaurant(restaurant_id)
             return True
         return None
 
@@ -439,6 +503,7 @@ class RestaurantServices:
         if response is None:
             return None
         else:
+            UpstreamCache.invalidate_restaurant(dish.restaurant_id)
             return response
 
     @staticmethod
@@ -448,8 +513,10 @@ class RestaurantServices:
         :return true or false
         """
         url = "{}/delele/{}".format(RESTAURANTS_MICROSERVICE_URL, restaurant_id)
-        current_app.logger.debug("URL to microservice is {}".format(url))
+        log.debug("URL to microservice is {}", url)
         response = HttpUtils.make_put_request(url, {})
+        UpstreamCache.invalidate_restaurant(restaurant_id)
+        RestaurantServices.forget_schedule(restaurant_id)
         return response is not None
 
     @staticmethod
@@ -460,6 +527,8 @@ class RestaurantServices:
         """
         url = "{}/dishes/{}".format(RESTAURANTS_MICROSERVICE_URL, dish_id)
         response = HttpUtils.make_delete_request(url)
+        # the restaurant of the dish is not known, so all the dishes are removed
+        UpstreamCache.invalidate_route("dishes")
         return response
 
     @staticmethod
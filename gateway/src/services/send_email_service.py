@@ -1,9 +1,13 @@
 import requests
-from flask import current_app
 from src.app_constant import EMAIL_MICROSERVICE_URL
 from src.utils.http_utils import HttpUtils
+from src.utils.log_utils import get_logger
+from src.utils.tracing import traced
 
+log = get_logger("services.email")
 
+
+@traced
 class SendEmailService:
     """
     This method contains all the logic to
@@ -16,19 +20,21 @@ class SendEmailService:
         :param email: Email of the new user
         :param name: Name of the new user
         """
-        current_app.logger.debug("Email to send the email: {}".format(email))
-        current_app.logger.debug("Name of the user {}".format(name))
+        log.debug("Email to send the email: {}", email)
+        log.debug("Name of the user {}", name)
         json = {"email": email, "name": name}
-        current_app.logger.debug("JSON request {}".format(json))
+        log.debug("JSON request {}", json)
         url = "{}/confirm_registration".format(EMAIL_MICROSERVICE_URL)
-        current_app.logger.debug("URL to microservices sendemail {}".format(url))
-        response = requests.post(url=url, json=json)
+        log.debug("URL to microservices sendemail {}", url)
+        try:
+            response = HttpUtils.request("POST", url, json=json)
+        except requests.exceptions.RequestException as ex:
+            log.error("Error during the microservice call {}", str(ex))
+            return False
         json = response.json()
         if response.ok is False:
-            current_app.logger.error(
-                "Error during the request: {}".format(response.status_code)
-            )
-            current_app.logger.error("Error with message {}".format(json))
+            log.error("Error during the request: {}", response.status_code)
+            log.error("Error with message {}", json)
             return False
         return True
 
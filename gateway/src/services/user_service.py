@@ -1,3 +1,5 @@
+from datetime import datetime
+
 import requests
 from flask import session, current_app, redirect
 from flask_login import current_user, login_user
@@ -9,28 +11,41 @@ from src.app_constant import (
     BOOKING_MICROSERVICE_URL,
 )
 from src.utils.http_utils import HttpUtils
+from src.utils.fan_out import FanOut
+from src.utils.response_cache import ResponseCache
 from src.services.restaurant_services import RestaurantServices
+from src.services.booking_services import BookingServices
 from src.model import RestaurantModel
 from src.model import UserModel
+from src.utils.log_utils import get_logger
+from src.utils.tracing import traced
+
+log = get_logger("services.user")
 
 
+@traced
 class UserService:
     """
     This service is a wrapper of all operation with user
     - create a new user
     - deleter a user if exist
+
+    The users read by get_users_by_ids are kept in memory for USER_CACHE_TTL
+    seconds and at most USER_BATCH_CONCURRENCY users are asked at the same time.
     """
 
+    # user id -> json of the user, used by get_users_by_ids
+    _users_cache = ResponseCache(max_size=1024)
+
     @staticmethod
     def login_user(email: str, password: str) -> (UserModel, int):
         """
         This method perform the http request to perform the login on user microservices
         :return It return the user if the login has success
         """
-        current_app.logger.debug("Email user: {}".format(email))
-        current_app.logger.debug("Password is {}".format(password))
+        log.debug("Email user: {}", email)
         url = "{}/login".format(USER_MICROSERVICE_URL)
-        current_app.logger.debug("URL to call microservices: {}".format(url))
+        log.debug("URL to call microservices: {}", url)
         json = {"email": email, "password": password}
         response, status_code = HttpUtils.make_post_request(url, json)
         if response is None:
@@ -45,17 +60,15 @@ class UserService:
         login_user(user)
         try:
             url = "{}/role/{}".format(USER_MICROSERVICE_URL, str(user.role_id))
-            current_app.logger.debug("Url is {}".format(url))
-            response = requests.get(url=url)
-        except requests.exceptions.ConnectionError as ex:
-            current_app.logger.error(
-                "Error during the microservice call {}".format(str(ex))
-            )
+            log.debug("Url is {}", url)
+            response = HttpUtils.request("GET", url)
+        except requests.exceptions.RequestException as ex:
+            log.error("Error during the microservice call {}", str(ex))
             return False
         json_response = response.json()
-        current_app.logger.debug("Response json content is: {}".format(json_response))
+        log.debug("Response json content is: {}", json_response)
         if not response.ok:
-            current_app.logger.error(json_response)
+            log.error(json_response)
             return False
 
         role_value = json_response["value"]
@@ -69,24 +82,19 @@ class UserService:
             # and set the session
             try:
                 url = "{}/id/{}".format(RESTAURANTS_MICROSERVICE_URL, str(user.email))
-                current_app.logger.debug(
-                    "Getting the restaurant of the user: Url is {}".format(url)
-                )
-                response = requests.get(url=url)
-            except requests.exceptions.ConnectionError as ex:
-                current_app.logger.error(
-                    "Error during the microservice call {}".format(str(ex))
-                )
+                log.debug("Getting the restaurant of the user: Url is {}", url)
+                response = HttpUtils.request("GET", url)
+            except requests.exceptions.RequestException as ex:
+                log.error("Error during the microservice call {}", str(ex))
                 return False
 
             if response.ok:
                 restaurant = RestaurantModel()
-                current_app.logger.debug(
-                    "Creating Restaurant model starting from: {}".format(
-                        response.json()
-                    )
+                json_restaurant = response.json()
+                log.debug(
+                    "Creating Restaurant model starting from: {}", json_restaurant
                 )
-                restaurant.fill_from_json(response.json())
+                restaurant.fill_from_json(json_restaurant)
 
                 session["RESTAURANT_ID"] = restaurant.id
                 session["RESTAURANT_NAME"] = restaurant.name
@@ -102,17 +110,15 @@ class UserService:
         """
         try:
             url = "{}/role/{}/".format(USER_MICROSERVICE_URL, str(role_id))
-            current_app.logger.debug("Url is {}".format(url))
-            response = requests.get(url=url)
-        except requests.exceptions.ConnectionError as ex:
-            current_app.logger.error(
-                "Error during the microservice call {}".format(str(ex))
-            )
+            log.debug("Url is {}", url)
+            response = HttpUtils.request("GET", url)
+        except requests.exceptions.RequestException as ex:
+            log.error("Error during the microservice call {}", str(ex))
             return False
         json_response = response.json()
-        current_app.logger.debug("Response json content is: {}".format(json_response))
+        log.debug("Response json content is: {}", json_response)
         if not response.ok:
-            current_app.logger.error(json_response)
+            log.error(json_response)
             return None
         return json_response["value"]
 
@@ -133,19 +139,17 @@ class UserService:
             else:
                 url = "{}/user_by_phone".format(url)
                 json["phone"] = phone
-            current_app.logger.debug("Url is {}".format(url))
-            response = requests.post(url=url, json=json)
-        except requests.exceptions.ConnectionError as ex:
-            current_app.logger.error(
-                "Error during the microservice call {}".format(str(ex))
-            )
+            log.debug("Url is {}", url)
+            response = HttpUtils.request("POST", url, json=json)
+        except requests.exceptions.RequestException as ex:
+            log.error("Error during the microservice call {}", str(ex))
             return None
-        current_app.logger.debug("Response is {}".format(response.text))
+        log.debug("Response is {}", response.text)
         json = response.json()
         if response.ok is False:
-            current_app.logger.error("Request error: {}".format(json))
+            log.error("Request error: {}", json)
             return None
-        current_app.logger.debug("User found is: {}".format(json))
+        log.debug("User found is: {}", json)
         user = UserModel()
         user.fill_from_json(json)
         return user
@@ -157,17 +161,16 @@ class UserService:
         :return:
         """
         email = user_form.email.data
-        current_app.logger.debug("New user email {}".format(email))
+        log.debug("New user email {}", email)
         phone = user_form.phone.data
-        current_app.logger.debug("New user phone {}".format(phone))
+        log.debug("New user phone {}", phone)
         password = user_form.password.data
-        current_app.logger.debug("New user password {}".format(password))
         date = user_form.dateofbirth.data
-        current_app.logger.debug("New user date {}".format(date))
+        log.debug("New user date {}", date)
         firstname = user_form.firstname.data
-        current_app.logger.debug("New user date {}".format(firstname))
+        log.debug("New user date {}", firstname)
         lastname = user_form.lastname.data
-        current_app.logger.debug("New user date {}".format(lastname))
+        log.debug("New user date {}", lastname)
         json_request = {
             "email": email,
             "phone": phone,
@@ -182,9 +185,9 @@ class UserService:
             url = "{}/create_operator".format(USER_MICROSERVICE_URL)
         response = HttpUtils.make_post_request(to_url=url, args=json_request)
         if response[0] is None:
-            current_app.logger.debug("An error with code {} occurs".format(response[1]))
+            log.debug("An error with code {} occurs", response[1])
             return False
-        current_app.logger.debug("User created and the response was {}".format(response[0]))
+        log.debug("User created and the response was {}", response[0])
         return True
 
     @staticmethod
@@ -204,15 +207,15 @@ class UserService:
             role_id = current_user.role_id
 
         email = user_form.email.data
-        current_app.logger.debug("New user email {}".format(email))
+        log.debug("New user email {}", email)
         phone = user_form.phone.data
-        current_app.logger.debug("New user phone {}".format(phone))
+        log.debug("New user phone {}", phone)
         date = user_form.dateofbirth.data
-        current_app.logger.debug("New user birth {}".format(date))
+        log.debug("New user birth {}", date)
         firstname = user_form.firstname.data
-        current_app.logger.debug("New user firstname {}".format(firstname))
+        log.debug("New user firstname {}", firstname)
         lastname = user_form.lastname.data
-        current_app.logger.debug("New user lastname {}".format(lastname))
+        log.debug("New user lastname {}", lastname)
         json_request = {
             "email": email,
             "phone": phone,
@@ -222,14 +225,15 @@ class UserService:
             "role": role_id,
             "id": user_id,
         }
-        current_app.logger.debug("Request body \n{}".format(json_request))
+        log.debug("Request body \n{}", json_request)
         url = "{}/data/".format(USER_MICROSERVICE_URL)
         response = HttpUtils.make_put_request(to_url=url, args=json_request)
+        UserService.forget_user(user_id)
         if response[0] is None:
-            current_app.logger.debug("An error with code occurs {}".format(response[1]))
+            log.debug("An error with code occurs {}", response[1])
             return None
         json = response[0]
-        current_app.logger.debug("Response: ".format(json))
+        log.debug("Response: {}", json)
         user = UserModel()
         user.fill_from_json(json)
         return user
@@ -242,12 +246,15 @@ class UserService:
         with current_app.test_request_context():
             if user.role_id == 2 and "RESTAURANT_ID" in session:
                 restaurant_id = session["RESTAURANT_ID"]
-                response = RestaurantServices.delete_restaurant(restaurant_id=restaurant_id)
+                response = RestaurantServices.delete_restaurant(
+                    restaurant_id=restaurant_id
+                )
                 if response is False:
-                    current_app.logger.debug("Impossible delete restaurant")
+                    log.debug("Impossible delete restaurant")
                     return False
         url = "{}/delete/{}".format(USER_MICROSERVICE_URL, str(user_id))
         response = HttpUtils.make_delete_request(url)
+        UserService.forget_user(user_id)
         if response is not None:
             return True
         else:
@@ -267,9 +274,15 @@ class UserService:
 
     @staticmethod
     def get_customer_reservation(fromDate: str, toDate: str, customer_id: str):
-        current_app.logger.debug(
-            "Filtering by: {}".format([fromDate, toDate, customer_id])
-        )
+        log.debug("Filtering by: {}", [fromDate, toDate, customer_id])
+
+        # a window with dates is asked in shards (see BookingServices)
+        from_data = UserService._parse_filter_date(fromDate)
+        to_data = UserService._parse_filter_date(toDate)
+        if from_data is not None and to_data is not None:
+            return BookingServices.get_reservation_by_constraint(
+                customer_id, from_data, to_data
+            )
 
         # bind filter params...
         url = "{}?user_id={}".format(BOOKING_MICROSERVICE_URL, customer_id)
@@ -281,6 +294,19 @@ class UserService:
         response = HttpUtils.make_get_request(url)
         return response
 
+    @staticmethod
+    def _parse_filter_date(value: str):
+        """
+        :return the datetime of a filter of the reservations
+        (e.g. 2020-11-10T20:00:00Z or 2020-11-10), None if it is not valid
+        """
+        for date_format in ("%Y-%m-%dT%H:%M:%SZ", "%Y-%m-%d"):
+            try:
+                return datetime.strptime(value, date_format)
+            except (TypeError, ValueError):
+                pass
+        return None
+
     @staticmethod
     def user_login(form: LoginForm):
         """
@@ -295,20 +321,16 @@ class UserService:
     def get_user_by_email(email):
         try:
             url = "{}/email".format(USER_MICROSERVICE_URL, email)
-            current_app.logger.debug("Url is: {}".format(url))
-            response = requests.post(url, json={"email": email})
-        except requests.exceptions.ConnectionError as ex:
-            current_app.logger.error(
-                "Error during the microservice call {}".format(str(ex))
-            )
+            log.debug("Url is: {}", url)
+            response = HttpUtils.request("POST", url, json={"email": email})
+        except requests.exceptions.RequestException as ex:
+            log.error("Error during the microservice call {}", str(ex))
             return None
         if not response.ok:
-            current_app.logger.error(
-                "Microservice response is: {}".format(response.text)
-            )
+            log.error("Microservice response is: {}", response.text)
             return None
         user = UserModel()
-        current_app.logger.debug("Microservice response is: {}".format(response.json()))
+        log.debug("Microservice response is: {}", response.json())
         user.fill_from_json(response.json())
         return user
 
@@ -317,19 +339,13 @@ class UserService:
         """
         This method perform the request to user microservices to make the user positive
         """
-        current_app.logger.debug(
-            "Asking to mark. Called with: {} , {}".format(email, phone)
-        )
+        log.debug("Asking to mark. Called with: {} , {}", email, phone)
         if email is not None and len(email) != 0:
-            current_app.logger.debug(
-                "marking with email because email len: {}".format(len(email))
-            )
+            log.debug("marking with email because email len: {}", len(email))
             key = "email"
             value = email
         elif phone is not None and len(phone) != 0:
-            current_app.logger.debug(
-                "marking with phone because phone len: {}".format(len(phone))
-            )
+            log.debug("marking with phone because phone len: {}", len(phone))
             key = "phone"
             value = phone
         else:
@@ -408,3 +424,58 @@ class UserService:
         user_model = UserModel()
         user_model.fill_from_json(response)
         return user_model
+
+    @staticmethod
+    def get_users_by_ids(user_ids) -> dict:
+        """
+        This method return the users with the ids, the duplicated ids are
+        asked once, the users in memory are not asked again and the other
+        users are asked to the microservice at the same time
+        (USER_BATCH_CONCURRENCY requests at most)
+        :param user_ids: iterable of user ids, also with duplicates
+        :return dict id -> UserModel, the users not found are not inside
+        """
+        ids = {int(user_id) for user_id in user_ids if user_id is not None}
+        jsons = {}
+        missing = []
+        for user_id in ids:
+            json = UserService._users_cache.get(user_id)
+            if json is None:
+                missing.append(user_id)
+            else:
+                jsons[user_id] = json
+
+        concurrency = max(current_app.config.get("USER_BATCH_CONCURRENCY", 8), 1)
+        ttl = current_app.config.get("USER_CACHE_TTL", 60)
+        for start in range(0, len(missing), concurrency):
+            calls = {
+                user_id: lambda user_id=user_id: HttpUtils.make_get_request(
+                    "{}/{}".format(USER_MICROSERVICE_URL, user_id)
+                )
+                for user_id in missing[start : start + concurrency]
+            }
+            for user_id, json in FanOut.run(calls).items():
+                if json is None:
+                    continue
+                jsons[user_id] = json
+                if ttl > 0:
+                    UserService._users_cache.set(user_id, json, ttl)
+
+        users = {}
+        for user_id, json in jsons.items():
+            user_model = UserModel()
+            user_model.fill_from_json(json)
+            users[user_id] = user_model
+        return users
+
+    @staticmethod
+    def forget_user(user_id):
+        """
+        Remove the user from the memory of get_users_by_ids, e.g. when it is
+        changed or deleted
+        """
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return
+        UserService._users_cache.invalidate(lambda key, entry: key == user_id)
@@ -1,4 +1,5 @@
 import sys, os
 from src.tests.fixtures.client import *
+from src.tests.fixtures.upstream import *
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -1 +1,2 @@
 from .client import *
+from .upstream import *
@@ -0,0 +1,103 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class _UpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _answer(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length > 0 else b""
+        with server.lock:
+            server.calls.append(
+                {
+                    "method": self.command,
+                    "path": self.path,
+                    "headers": dict(self.headers),
+                    "body": body,
+                }
+            )
+        route = server.routes.get((self.command, self.path.split("?")[0]))
+        if route is None:
+            status, payload, headers = 404, {"message": "not found"}, {}
+        else:
+            status, payload, headers = route(self)
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if status != 304:
+            self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(data)
+
+    do_GET = _answer
+    do_POST = _answer
+    do_PUT = _answer
+    do_DELETE = _answer
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _UpstreamServer(ThreadingHTTPServer):
+    # the tests open many connections at the same time
+    request_queue_size = 64
+
+
+class Upstream:
+    """
+    A little HTTP server that run in a thread and answer with the routes
+    registered by the test, it is used to test the HTTP layer of the gateway
+    without the microservices
+    """
+
+    def __init__(self):
+        self.server = _UpstreamServer(("127.0.0.1", 0), _UpstreamHandler)
+        self.server.daemon_threads = True
+        self.server.routes = {}
+        self.server.calls = []
+        self.server.lock = threading.Lock()
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def calls(self):
+        return self.server.calls
+
+    def route(
+        self, method: str, path: str, status: int = 200, payload=None, headers=None
+    ):
+        """
+        Register a static answer for the method and path
+        """
+        self.server.routes[(method, path)] = lambda handler: (
+            status,
+            payload if payload is not None else {},
+            headers or {},
+        )
+
+    def handler(self, method: str, path: str, func):
+        """
+        Register a function that receive the request handler and
+        return a tuple (status, payload, headers)
+        """
+        self.server.routes[(method, path)] = func
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def upstream():
+    server = Upstream()
+    yield server
+    server.close()
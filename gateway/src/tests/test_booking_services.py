@@ -1,6 +1,7 @@
 from random import randrange
 
 import datetime
+from urllib.parse import parse_qs, urlparse
 from src.services import BookingServices
 from src.tests.utils import (
     create_restaurants_on_db,
@@ -146,7 +147,6 @@ class Test_BookServices:
         del_user_on_db(user.id)
         del_user_on_db(rest_owner.id)
 
-
     def test_new_booking_overlaps(self):
         """
         overlapped reservations
@@ -193,7 +193,6 @@ class Test_BookServices:
         del_user_on_db(user.id)
         del_user_on_db(rest_owner.id)
 
-
     def test_booking_in_past(self):
         """
         check if i can book in the past
@@ -226,7 +225,6 @@ class Test_BookServices:
         del_user_on_db(user.id)
         del_user_on_db(rest_owner.id)
 
-
     def test_delete_booking(self):
         """
         test for deletion
@@ -307,3 +305,103 @@ class Test_BookServices:
         # delete users
         del_user_on_db(user.id)
         del_user_on_db(rest_owner.id)
+
+    def test_reservations_sharded(self, upstream, monkeypatch):
+        """
+        It tests that a window is asked in shards of days, the reservations
+        out of the window are removed, the finished shards are reused until
+        a booking changes them and a long window is asked with one request
+        """
+        import src.services.booking_services as booking_services
+        from flask import current_app
+
+        def book(path):
+            # the reservations at 12:00 and 20:00 of the days of the window
+            query = parse_qs(urlparse(path).query)
+            first, last = query["fromDate"][0], query["toDate"][0]
+            day = datetime.datetime.strptime(first[:10], "%Y-%m-%d")
+            reservations = []
+            while day.strftime("%Y-%m-%d") <= last[:10]:
+                for hour, meal in ((12, "lunch"), (20, "dinner")):
+                    date = day.replace(hour=hour).strftime("%Y-%m-%dT%H:%M:%SZ")
+                    if first <= date <= last:
+                        reservations.append(
+                            {"id": date[:10] + "_" + meal, "reservation_date": date}
+                        )
+                day += datetime.timedelta(days=1)
+            return reservations
+
+        upstream.handler("GET", "/book", lambda request: (200, book(request.path), {}))
+        monkeypatch.setattr(
+            booking_services, "BOOKING_MICROSERVICE_URL", "{}/book".format(upstream.url)
+        )
+        monkeypatch.setitem(current_app.config, "BOOKING_SHARD_DAYS", 1)
+        BookingServices.forget_shards()
+
+        reservations = BookingServices.get_reservation_by_constraint(
+            1,
+            datetime.datetime(2020, 11, 10, 15, 0),
+            datetime.datetime(2020, 11, 12, 15, 0),
+        )
+        assert [reservation["id"] for reservation in reservations] == [
+            "2020-11-10_dinner",
+            "2020-11-11_lunch",
+            "2020-11-11_dinner",
+            "2020-11-12_lunch",
+        ]
+        assert len(upstream.calls) == 3
+        assert "user_id=1" in upstream.calls[0]["path"]
+
+        reservations = BookingServices.get_reservation_by_constraint(
+            1,
+            datetime.datetime(2020, 11, 11, 0, 0),
+            datetime.datetime(2020, 11, 13, 23, 59),
+        )
+        assert len(reservations) == 6
+        assert len(upstream.calls) == 4
+
+        # a window that ends at midnight ends at the start of its last day,
+        # with shards or with one request
+        for sharded in (True, False):
+            reservations = BookingServices.get_reservation_by_constraint(
+                1,
+                datetime.datetime(2020, 11, 12),
+                datetime.datetime(2020, 11, 13),
+                sharded=sharded,
+            )
+            assert [reservation["id"] for reservation in reservations] == [
+                "2020-11-12_lunch",
+                "2020-11-12_dinner",
+            ]
+        assert len(upstream.calls) == 5
+        assert "toDate=2020-11-13T00:00:00Z" in upstream.calls[4]["path"]
+
+        # only the shards of the booking changed are asked again
+        BookingServices.forget_shards("2020-11-11_lunch")
+        BookingServices.forget_shards(date=datetime.datetime(2020, 11, 13, 20, 0))
+        BookingServices.get_reservation_by_constraint(
+            1, datetime.datetime(2020, 11, 10), datetime.datetime(2020, 11, 13)
+        )
+        assert len(upstream.calls) == 7
+        # the shards are asked at the same time, in any order
+        assert sorted(
+            parse_qs(urlparse(call["path"]).query)["fromDate"][0][:10]
+            for call in upstream.calls[5:7]
+        ) == ["2020-11-11", "2020-11-13"]
+
+        # a long window is asked with one request
+        monkeypatch.setitem(current_app.config, "BOOKING_SHARD_MAX", 3)
+        BookingServices.get_reservation_by_constraint(
+            1, datetime.datetime(2020, 11, 1), datetime.datetime(2020, 11, 13)
+        )
+        assert len(upstream.calls) == 8
+        assert "toDate=2020-11-13T00:00:00Z" in upstream.calls[7]["path"]
+
+        BookingServices.forget_shards()
+        upstream.route("GET", "/book", status=500, payload={})
+        assert (
+            BookingServices.get_reservation_by_constraint(
+                1, datetime.datetime(2020, 11, 10), datetime.datetime(2020, 11, 11)
+            )
+            is None
+        )
@@ -0,0 +1,563 @@
+import random
+from urllib.parse import parse_qs, urlsplit
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from src.services.contact_engine import ContactEngine, parse_datetime
+from src.services.booking_services import BookingServices
+from src.services.restaurant_services import RestaurantServices
+from src.services.user_service import UserService
+from src.services.copresence_index import CoPresenceIndex
+from src.services.contact_tracing import ContactTrace, ContactTracing
+from src.services.opening_hours import OpeningHoursResolver, OpeningSchedule
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def make_reservation(reservation_id, customer_id, restaurant_id, start, minutes):
+    return {
+        "id": reservation_id,
+        "customer_id": customer_id,
+        "people": [],
+        "table": {"id": 1, "restaurant": {"id": restaurant_id}},
+        "reservation_date": start.strftime(DATE_FORMAT),
+        "reservation_end": (start + timedelta(minutes=minutes)).strftime(DATE_FORMAT),
+    }
+
+
+def naive_contacts(customer_reservations, all_reservations):
+    """
+    The nested loop used before the ContactEngine
+    """
+    result = []
+    for reservation in customer_reservations:
+        start = datetime.strptime(reservation["reservation_date"], DATE_FORMAT)
+        end = datetime.strptime(reservation["reservation_end"], DATE_FORMAT)
+        contacts = []
+        for one in all_reservations:
+            if (
+                one["table"]["restaurant"]["id"]
+                != reservation["table"]["restaurant"]["id"]
+            ):
+                continue
+            start_contact = datetime.strptime(one["reservation_date"], DATE_FORMAT)
+            end_contact = datetime.strptime(one["reservation_end"], DATE_FORMAT)
+            if start.date() != start_contact.date():
+                continue
+            if not (end_contact < start or start_contact > end):
+                contacts.append(one["id"])
+        result.append(contacts)
+    return result
+
+
+class Test_ContactEngine:
+    """
+    This test suite test the engine that finds the contacts of a positive customer.
+    All the code tested inside this class is inside the services/contact_engine.py
+    """
+
+    def test_parse_datetime(self):
+        """
+        It tests that the dates of the booking microservice are parsed
+        """
+        assert parse_datetime("2020-11-10T20:30:00Z") == datetime(2020, 11, 10, 20, 30)
+
+    def test_find_contacts(self):
+        """
+        It tests the overlap of the reservations in the same restaurant and day
+        """
+        day = datetime(2020, 11, 10, 20, 0)
+        customer = [
+            make_reservation(1, 1, 1, day, 60),
+            make_reservation(2, 1, 2, day, 60),
+        ]
+        others = [
+            make_reservation(10, 2, 1, day + timedelta(minutes=59), 60),
+            make_reservation(11, 3, 1, day - timedelta(minutes=30), 30),
+            make_reservation(12, 4, 1, day + timedelta(minutes=61), 60),
+            make_reservation(13, 5, 1, day - timedelta(hours=3), 120),
+            make_reservation(14, 6, 1, day + timedelta(days=1), 60),
+            make_reservation(15, 7, 3, day, 60),
+        ]
+        result = ContactEngine.find_contacts(customer, others)
+        assert [visit.reservation["id"] for visit, _ in result] == [1, 2]
+        contacts = [[c.reservation["id"] for c in visit] for _, visit in result]
+        assert contacts == [[10, 11], []]
+
+    def test_same_result_of_nested_loop(self):
+        """
+        It tests that the engine finds the same contacts of the nested loop
+        """
+        rnd = random.Random(42)
+        first_day = datetime(2020, 11, 1, 12, 0)
+        reservations = [
+            make_reservation(
+                i,
+                rnd.randint(1, 50),
+                rnd.randint(1, 5),
+                first_day
+                + timedelta(days=rnd.randint(0, 13), minutes=rnd.randint(0, 600)),
+                rnd.choice([30, 60, 90, 240]),
+            )
+            for i in range(2000)
+        ]
+        customer = [r for r in reservations if r["customer_id"] == 7]
+        result = ContactEngine.find_contacts(customer, reservations)
+        contacts = [[c.reservation["id"] for c in visit] for _, visit in result]
+        assert contacts == naive_contacts(customer, reservations)
+
+    def test_numpy_same_result_of_python(self):
+        """
+        It tests that the numpy columns find the same contacts of the groups
+        """
+        rnd = random.Random(7)
+        first_day = datetime(2020, 11, 1, 12, 0)
+        reservations = [
+            make_reservation(
+                i,
+                rnd.randint(1, 50),
+                rnd.randint(1, 5),
+                first_day
+                + timedelta(days=rnd.randint(0, 13), minutes=rnd.randint(0, 720)),
+                rnd.choice([30, 60, 90, 240]),
+            )
+            for i in range(3000)
+        ]
+        customer = [r for r in reservations if r["customer_id"] == 3]
+        customer.append(make_reservation(-1, 3, 99, first_day, 60))
+        expected = ContactEngine.find_contacts(customer, reservations)
+        result = ContactEngine.find_contacts_numpy(customer, reservations)
+        assert [[c.reservation["id"] for c in contacts] for _, contacts in result] == [
+            [c.reservation["id"] for c in contacts] for _, contacts in expected
+        ]
+        assert ContactEngine.find_contacts_numpy(customer, [])[0][1] == []
+
+
+class Test_OpeningHours:
+    """
+    This test suite test the schedules of the restaurants used by the contact tracing.
+    All the code tested inside this class is inside the services/opening_hours.py
+    """
+
+    def test_schedule_is_open(self):
+        """
+        It tests that an interval is inside the lunch or the dinner of its week day
+        """
+        schedule = OpeningSchedule(
+            [
+                {
+                    "week_day": 1,
+                    "open_lunch": "12:00",
+                    "close_lunch": "15:00",
+                    "open_dinner": "19:00",
+                    "close_dinner": "23:00",
+                }
+            ]
+        )
+        # 2020-11-10 is a tuesday (week day 1)
+        day = datetime(2020, 11, 10)
+        assert schedule.is_open(day.replace(hour=12), day.replace(hour=15))
+        assert schedule.is_open(day.replace(hour=20), day.replace(hour=21))
+        assert not schedule.is_open(day.replace(hour=14), day.replace(hour=16))
+        assert not schedule.is_open(
+            day.replace(hour=20) + timedelta(days=1),
+            day.replace(hour=21) + timedelta(days=1),
+        )
+
+    def test_resolver_fetch_once(self):
+        """
+        It tests that the schedule of a restaurant is asked once
+        """
+        calls = []
+
+        def fetch(restaurant_id):
+            calls.append(restaurant_id)
+            return None if restaurant_id == 2 else OpeningSchedule([])
+
+        resolver = OpeningHoursResolver(fetch)
+        day = datetime(2020, 11, 10, 20)
+        for _ in range(3):
+            assert not resolver.in_service_hours(1, day, day)
+            assert not resolver.in_service_hours(2, day, day)
+        assert calls == [1, 2]
+
+
+class Test_ContactTrace:
+    """
+    This test suite test the projections of the result of the contact tracing.
+    All the code tested inside this class is inside the services/contact_tracing.py
+    """
+
+    def test_projections(self):
+        """
+        It tests that the GUI rows and the emails are made from the same contacts
+        """
+        start = datetime(2020, 11, 10, 20, 0)
+        restaurant = SimpleNamespace(name="Trial", owner_email="owner@alibaba.com")
+        trace = ContactTrace(1, datetime(2020, 11, 12))
+        trace.visit_friends = ["friend@alibaba.com"]
+        trace.contacts = [
+            (make_reservation(10, 2, 1, start, 60), restaurant, start),
+            (make_reservation(11, 3, 1, start, 60), restaurant, start),
+            (make_reservation(12, 2, 2, start, 60), None, start),
+        ]
+        trace.contacts[0][0]["people"] = ["other@alibaba.com"]
+        trace.users = {
+            2: SimpleNamespace(
+                firstname="Mario",
+                lastname="Rossi",
+                dateofbirth="1995-12-12",
+                email="mario@alibaba.com",
+                phone="12345",
+            )
+        }
+
+        rows = trace.gui_rows()
+        assert [row[0] for row in rows] == [1, 2]
+        assert rows[0][1:] == [
+            "Mario Rossi",
+            "1995-12-12",
+            "mario@alibaba.com",
+            "12345",
+        ]
+
+        emails = trace.email_contacts()
+        assert emails["friends"] == ["friend@alibaba.com", "other@alibaba.com"]
+        assert emails["contacts"] == [
+            {
+                "email": "mario@alibaba.com",
+                "name": "Mario",
+                "restaurant_name": "Trial",
+                "date": "2020-11-10T20:00:00Z",
+            }
+        ]
+
+
+class Test_ContactTracing:
+    """
+    This test suite test the requests made by the contact tracing.
+    All the code tested inside this class is inside the services/contact_tracing.py
+    """
+
+    def test_reservations_of_the_visits(self, upstream, monkeypatch):
+        """
+        It tests that only the reservations of the restaurants and of the days
+        visited by the customer are asked, once for each of them
+        """
+        import src.services.booking_services as booking_services
+
+        day = datetime(2020, 11, 10, 20, 0)
+        customer = [
+            make_reservation(1, 1, 1, day, 60),
+            make_reservation(2, 1, 1, day + timedelta(hours=1), 60),
+            make_reservation(3, 1, 2, day + timedelta(days=1), 60),
+        ]
+        upstream.route(
+            "GET",
+            "/book",
+            payload=customer
+            + [
+                make_reservation(10, 2, 1, day, 60),
+                make_reservation(11, 3, 2, day + timedelta(days=1), 60),
+            ],
+        )
+        monkeypatch.setattr(
+            booking_services, "BOOKING_MICROSERVICE_URL", "{}/book".format(upstream.url)
+        )
+
+        BookingServices.forget_shards()
+        result = ContactTracing._reservations_in_same_visits(customer)
+        assert sorted(reservation["id"] for reservation in result) == [
+            1,
+            2,
+            3,
+            10,
+            11,
+        ]
+        paths = sorted(call["path"] for call in upstream.calls)
+        assert len(paths) == 2
+        assert "fromDate=2020-11-10T00:00:00Z" in paths[0]
+        assert "toDate=2020-11-10T23:59:59Z" in paths[0]
+        assert "restaurant_id=1" in paths[0]
+        assert "restaurant_id=2" in paths[1]
+
+        upstream.route("GET", "/book", status=500, payload={})
+        assert ContactTracing._reservations_in_same_visits(customer) is None
+
+    def test_trace_hops(self, client, upstream, monkeypatch):
+        """
+        It tests that the contacts of the contacts are found once, at their
+        distance, following only the visits after the contact, and that the
+        search stops at TRACING_MAX_HOPS and at TRACING_MAX_CONTACTS
+        """
+        import src.services.booking_services as booking_services
+
+        day = datetime(2020, 11, 10, 20, 0)
+        reservations = [
+            # the positive customer and its contact
+            make_reservation(1, 1, 1, day, 60),
+            make_reservation(10, 2, 1, day, 60),
+            # the customer 2 meets 3 and 5 after the contact, 4 before it
+            make_reservation(20, 2, 2, day + timedelta(days=1), 60),
+            make_reservation(21, 2, 3, day - timedelta(days=1), 60),
+            make_reservation(30, 3, 2, day + timedelta(days=1), 60),
+            make_reservation(40, 4, 3, day - timedelta(days=1), 60),
+            make_reservation(50, 5, 2, day + timedelta(days=1), 60),
+            # the customer 3 meets 2 again and then 6
+            make_reservation(22, 2, 4, day + timedelta(days=1, minutes=90), 60),
+            make_reservation(31, 3, 4, day + timedelta(days=1, minutes=90), 60),
+            make_reservation(33, 3, 5, day + timedelta(days=1, hours=2), 60),
+            make_reservation(60, 6, 5, day + timedelta(days=1, hours=2), 60),
+        ]
+
+        def book(handler):
+            query = parse_qs(urlsplit(handler.path).query)
+            result = reservations
+            if "user_id" in query:
+                user_id = int(query["user_id"][0])
+                result = [r for r in result if r["customer_id"] == user_id]
+            if "fromDate" in query:
+                first, last = query["fromDate"][0], query["toDate"][0]
+                result = [r for r in result if first <= r["reservation_date"] <= last]
+            if "restaurant_id" in query:
+                restaurant_id = int(query["restaurant_id"][0])
+                result = [
+                    r for r in result if r["table"]["restaurant"]["id"] == restaurant_id
+                ]
+            return 200, result, {}
+
+        upstream.handler("GET", "/book", book)
+        monkeypatch.setattr(
+            booking_services, "BOOKING_MICROSERVICE_URL", "{}/book".format(upstream.url)
+        )
+        monkeypatch.setattr(
+            UserService,
+            "search_possible_contacts",
+            lambda email, phone: {"user_id": 1, "from_date": "2020-11-12"},
+        )
+        lookups = []
+
+        def get_users_by_ids(ids):
+            ids = list(ids)
+            lookups.append(ids)
+            return {
+                user_id: SimpleNamespace(
+                    firstname="User",
+                    lastname=str(user_id),
+                    dateofbirth="1995-12-12",
+                    email="{}@alibaba.com".format(user_id),
+                    phone=str(user_id),
+                )
+                for user_id in ids
+            }
+
+        monkeypatch.setattr(UserService, "get_users_by_ids", get_users_by_ids)
+        schedule = OpeningSchedule(
+            [
+                {"week_day": week_day, "open_dinner": "16:00", "close_dinner": "23:00"}
+                for week_day in range(7)
+            ]
+        )
+        monkeypatch.setattr(
+            RestaurantServices, "get_schedule_restaurant", lambda _: schedule
+        )
+        BookingServices.forget_shards()
+
+        trace = ContactTracing.trace_hops("1@alibaba.com", "", max_hops=1)
+        assert trace.error is None
+        assert {hop: [r["id"] for r, _ in c] for hop, c in trace.hops.items()} == {
+            1: [10]
+        }
+
+        # TRACING_MAX_HOPS is 2
+        trace = ContactTracing.trace_hops("1@alibaba.com", "", max_hops=3)
+        assert {hop: [r["id"] for r, _ in c] for hop, c in trace.hops.items()} == {
+            1: [10],
+            2: [30, 50],
+        }
+        assert not trace.truncated
+        assert lookups[-2:] == [[2], [3, 5]]
+        rows = trace.hop_rows()
+        assert [row[3] for row in rows[2]] == ["3@alibaba.com", "5@alibaba.com"]
+
+        client.application.config["TRACING_MAX_HOPS"] = 3
+        trace = ContactTracing.trace_hops("1@alibaba.com", "", max_hops=3)
+        assert {hop: [r["id"] for r, _ in c] for hop, c in trace.hops.items()} == {
+            1: [10],
+            2: [30, 50],
+            3: [60],
+        }
+        assert sorted(trace.users) == [2, 3, 5, 6]
+        # the reservations are asked by customer or by (restaurant, day),
+        # each (restaurant, day) once for all the levels
+        calls = len(upstream.calls)
+        ContactTracing.trace_hops("1@alibaba.com", "", max_hops=3)
+        queries = [
+            parse_qs(urlsplit(call["path"]).query) for call in upstream.calls[calls:]
+        ]
+        assert all("user_id" in query or "restaurant_id" in query for query in queries)
+        assert sorted(
+            int(query["user_id"][0]) for query in queries if "user_id" in query
+        ) == [2, 3, 5]
+        visits = [
+            (query["restaurant_id"][0], query["fromDate"][0][:10])
+            for query in queries
+            if "restaurant_id" in query
+        ]
+        # the restaurant 3 is visited only before the contact
+        assert sorted(visits) == [
+            ("1", "2020-11-10"),
+            ("2", "2020-11-11"),
+            ("4", "2020-11-11"),
+            ("5", "2020-11-11"),
+        ]
+
+        client.application.config["TRACING_MAX_CONTACTS"] = 3
+        trace = ContactTracing.trace_hops("1@alibaba.com", "", max_hops=3)
+        assert sorted(trace.hops) == [1, 2]
+        assert trace.truncated
+        client.application.config["TRACING_MAX_CONTACTS"] = 2
+        trace = ContactTracing.trace_hops("1@alibaba.com", "", max_hops=3)
+        assert {hop: [r["id"] for r, _ in c] for hop, c in trace.hops.items()} == {
+            1: [10],
+            2: [30],
+        }
+        assert trace.truncated
+
+
+class Test_CoPresenceIndex:
+    """
+    This test suite test the index of the reservations of each (restaurant, day).
+    All the code tested inside this class is inside the services/copresence_index.py
+    """
+
+    def configure(self, tmp_path, max_age=900):
+        CoPresenceIndex.configure(
+            {
+                "COPRESENCE_INDEX": True,
+                "COPRESENCE_MAX_AGE": max_age,
+                "SQLALCHEMY_DATABASE_URI": "sqlite:///db/gooutsafe.db",
+            },
+            str(tmp_path),
+        )
+
+    def test_store_and_record(self, tmp_path):
+        """
+        It tests that a (restaurant, day) is read only when it is complete
+        and that the bookings made through the gateway change it
+        """
+        self.configure(tmp_path)
+        assert (tmp_path / "db" / "gooutsafe.db").exists()
+        day = datetime(2020, 11, 10, 20, 0)
+        assert CoPresenceIndex.visits(1, "2020-11-10") is None
+
+        CoPresenceIndex.store(
+            1,
+            "2020-11-10",
+            [
+                make_reservation(2, 2, 1, day, 60),
+                make_reservation(1, 1, 1, day, 60),
+                make_reservation(3, 3, 2, day, 60),
+            ],
+        )
+        visits = CoPresenceIndex.visits(1, "2020-11-10")
+        assert [reservation["id"] for reservation in visits] == [1, 2]
+        assert visits[0]["table"]["restaurant"]["id"] == 1
+
+        CoPresenceIndex.record(make_reservation(4, 4, 1, day, 30))
+        CoPresenceIndex.forget(2)
+        visits = CoPresenceIndex.visits(1, "2020-11-10")
+        assert [reservation["id"] for reservation in visits] == [1, 4]
+
+        # a booking without the whole reservation in the response
+        CoPresenceIndex.record({"message": "ok"}, 1, day)
+        assert CoPresenceIndex.visits(1, "2020-11-10") is None
+
+        CoPresenceIndex.configure({"COPRESENCE_INDEX": False})
+        assert not CoPresenceIndex.enabled()
+        assert CoPresenceIndex.visits(1, "2020-11-10") is None
+
+    def test_old_buckets(self, tmp_path):
+        """
+        It tests that a (restaurant, day) stored too much time ago is not used
+        """
+        self.configure(tmp_path, max_age=-1)
+        CoPresenceIndex.store(1, "2020-11-10", [])
+        assert CoPresenceIndex.visits(1, "2020-11-10") is None
+        CoPresenceIndex.configure({"COPRESENCE_INDEX": False})
+
+    def test_failed_booking_forgets_the_day(self, tmp_path, upstream, monkeypatch):
+        """
+        It tests that a booking or a change answered with an error makes
+        its (restaurant, day) not complete, also the old day of a change
+        """
+        import src.services.booking_services as booking_services
+
+        self.configure(tmp_path)
+        day = datetime(2020, 11, 10, 20, 0)
+        other_day = day + timedelta(days=1)
+        upstream.route("POST", "/book", status=500, payload={})
+        upstream.route("PUT", "/book/1", status=504, payload={})
+        monkeypatch.setattr(
+            booking_services, "BOOKING_MICROSERVICE_URL", "{}/book".format(upstream.url)
+        )
+        try:
+            CoPresenceIndex.store(1, "2020-11-10", [make_reservation(1, 1, 1, day, 60)])
+            CoPresenceIndex.store(2, "2020-11-11", [])
+            customer = SimpleNamespace(id=2)
+            assert BookingServices.book(1, customer, day, 2, "") is None
+            assert CoPresenceIndex.visits(1, "2020-11-10") is None
+
+            CoPresenceIndex.store(1, "2020-11-10", [make_reservation(1, 1, 1, day, 60)])
+            assert BookingServices.update_book(1, 2, 1, other_day, 2) is None
+            assert CoPresenceIndex.visits(1, "2020-11-10") is None
+            assert CoPresenceIndex.visits(2, "2020-11-11") is None
+        finally:
+            CoPresenceIndex.configure({"COPRESENCE_INDEX": False})
+
+    def test_tracing_reads_the_index(self, tmp_path, upstream, monkeypatch):
+        """
+        It tests that the contact tracing asks only the (restaurant, day)
+        that are not inside the index, and stores them
+        """
+        import src.services.booking_services as booking_services
+
+        self.configure(tmp_path)
+        day = datetime(2020, 11, 10, 20, 0)
+        customer = [
+            make_reservation(1, 1, 1, day, 60),
+            make_reservation(2, 1, 2, day, 60),
+        ]
+        CoPresenceIndex.store(
+            1, "2020-11-10", [customer[0], make_reservation(10, 2, 1, day, 60)]
+        )
+        upstream.route(
+            "GET", "/book", payload=[customer[1], make_reservation(11, 3, 2, day, 60)]
+        )
+        monkeypatch.setattr(
+            booking_services, "BOOKING_MICROSERVICE_URL", "{}/book".format(upstream.url)
+        )
+        BookingServices.forget_shards()
+        try:
+            result = ContactTracing._reservations_in_same_visits(customer)
+            assert sorted(reservation["id"] for reservation in result) == [
+                1,
+                2,
+                10,
+                11,
+            ]
+            assert len(upstream.calls) == 1
+            assert "restaurant_id=2" in upstream.calls[0]["path"]
+            visits = CoPresenceIndex.visits(2, "2020-11-10")
+            assert [reservation["id"] for reservation in visits] == [2, 11]
+
+            # the sync reads again each day of the last COPRESENCE_DAYS days,
+            # the reservations of the other days are removed by the shards
+            CoPresenceIndex.forget_bucket(2, "2020-11-10")
+            assert CoPresenceIndex.sync(datetime(2020, 11, 10)) == 2
+            assert CoPresenceIndex.visits(2, "2020-11-10") is not None
+            # the bucket without reservations in the response is emptied
+            assert CoPresenceIndex.visits(1, "2020-11-10") == []
+            assert CoPresenceIndex.visits(1, "2020-11-09") is None
+        finally:
+            CoPresenceIndex.configure({"COPRESENCE_INDEX": False})
@@ -553,7 +553,7 @@ class Test_GoOutSafeForm:
         mark.phone.data = user.phone
         response = mark_people_for_covid19(client, mark)
         assert response.status_code == 200
-        assert "logged_test" in response.data.decode("utf-8")
+        assert "mark_positive_job_test" in response.data.decode("utf-8")
 
         user = UserService.user_is_present(user.email, user.phone)
         assert user.is_positive is True
@@ -1414,7 +1414,7 @@ class Test_GoOutSafeForm:
         mark.phone.data = customer1.phone
         response = mark_people_for_covid19(client, mark)
         assert response.status_code == 200
-        assert "logged_test" in response.data.decode("utf-8")
+        assert "mark_positive_job_test" in response.data.decode("utf-8")
 
         user = UserService.user_is_present(customer1.email, customer1.phone)
         assert user.is_positive is True
@@ -1488,7 +1488,7 @@ class Test_GoOutSafeForm:
         mark.phone.data = ""
         response = mark_people_for_covid19(client, mark)
         assert response.status_code == 200
-        assert "logged_test" in response.data.decode("utf-8")
+        assert "mark_positive_job_test" in response.data.decode("utf-8")
 
         user = UserService.user_is_present(customer1.email, customer1.phone)
         assert user.is_positive is True
@@ -1562,7 +1562,7 @@ class Test_GoOutSafeForm:
         mark.phone.data = customer1.phone
         response = mark_people_for_covid19(client, mark)
         assert response.status_code == 200
-        assert "logged_test" in response.data.decode("utf-8")
+        assert "mark_positive_job_test" in response.data.decode("utf-8")
 
         user = UserService.user_is_present(customer1.email, customer1.phone)
         assert user.is_positive is True
@@ -0,0 +1,873 @@
+import gzip
+import json
+import logging
+import re
+import threading
+import time
+
+import pytest
+from flask import current_app, render_template_string
+
+from src.app_constant import RESTAURANTS_MICROSERVICE_URL, USER_MICROSERVICE_URL
+from src.utils import HttpUtils
+from src.utils.http_pool import HttpPool
+from src.utils.fan_out import FanOut
+from src.utils.async_http_utils import AsyncHttpUtils
+from src.utils.response_cache import ResponseCache, UpstreamCache
+from src.utils.single_flight import SingleFlight
+from src.utils.log_utils import get_logger, redact, StructuredLogger
+from src.utils.json_codec import JsonCodec, BACKENDS, iter_json_array
+from src.utils.retry import Retries, RetryBudget, LatencyTracker
+from src.utils.load_balancer import LoadBalancer, EndpointPool
+from src.utils.metrics import Histogram, Metrics, STRIPES
+from src.utils.tracing import Tracer, traced, TRACEPARENT_HEADER
+from src.utils.deadline import Deadline, DEADLINE_HEADER
+from src.utils.jobs import Jobs
+from src.tests.fixtures.upstream import Upstream
+from src.utils.circuit_breaker import (
+    CircuitBreaker,
+    CircuitBreakers,
+    CLOSED,
+    OPEN,
+    HALF_OPEN,
+)
+
+
+@pytest.fixture
+def http_pool():
+    """
+    Restore the pools of the app config after a test that changes them
+    """
+    yield HttpPool
+    HttpPool.configure(current_app.config)
+
+
+class Test_HttpUtils:
+    """
+    This test suite test the HTTP layer used to call the microservices.
+    All the code tested inside this class is inside the utils package
+    """
+
+    def test_upstream_of_url(self):
+        """
+        It tests that each URL is served by the upstream of the microservice
+        """
+        url = "{}/1/menu".format(RESTAURANTS_MICROSERVICE_URL)
+        assert HttpPool.upstream_of(url) == "restaurants"
+        url = "{}/login".format(USER_MICROSERVICE_URL)
+        assert HttpPool.upstream_of(url) == "user"
+        assert HttpPool.upstream_of("http://localhost/other") == "default"
+
+    def test_session_is_shared(self):
+        """
+        It tests that the same session is used for all the URL of one upstream
+        """
+        first = HttpPool.session_for("{}/1".format(RESTAURANTS_MICROSERVICE_URL))
+        second = HttpPool.session_for("{}/2/menu".format(RESTAURANTS_MICROSERVICE_URL))
+        other = HttpPool.session_for("{}/1".format(USER_MICROSERVICE_URL))
+        assert first is second
+        assert first is not other
+
+    def test_pool_size_from_config(self, http_pool):
+        """
+        It tests that the size of the pool is read from the config
+        """
+        http_pool.configure({"HTTP_POOL_MAXSIZE": 3, "HTTP_POOL_SIZES": {"user": 7}})
+        url = "{}/1".format(USER_MICROSERVICE_URL)
+        adapter = HttpPool.session_for(url).get_adapter(url)
+        assert adapter._pool_maxsize == 7
+        url = "{}/1".format(RESTAURANTS_MICROSERVICE_URL)
+        adapter = HttpPool.session_for(url).get_adapter(url)
+        assert adapter._pool_maxsize == 3
+
+    def test_connection_reused(self, upstream):
+        """
+        It tests that more requests to the same upstream use only one connection
+        """
+        upstream.route("GET", "/items", payload={"items": [1, 2]})
+        for _ in range(3):
+            response = HttpUtils.make_get_request("{}/items".format(upstream.url))
+            assert response == {"items": [1, 2]}
+        metrics = HttpPool.metrics()["default"]
+        assert metrics["requests"] >= 3
+        pool = [p for p in metrics["pools"] if p["host"] == "127.0.0.1"][0]
+        assert pool["connections_opened"] == 1
+        assert pool["requests"] == 3
+
+    def test_fan_out_run_concurrently(self, upstream):
+        """
+        It tests that the calls of the fan-out are made at the same time
+        """
+
+        def slow(handler):
+            time.sleep(0.3)
+            return 200, {"path": handler.path}, {}
+
+        for i in range(4):
+            upstream.handler("GET", "/slow/{}".format(i), slow)
+        calls = {}
+        for i in range(4):
+            url = "{}/slow/{}".format(upstream.url, i)
+            calls[i] = lambda url=url: HttpUtils.make_get_request(url)
+        start = time.time()
+        results = FanOut.run(calls)
+        assert time.time() - start < 1.0
+        for i in range(4):
+            assert results[i] == {"path": "/slow/{}".format(i)}
+
+    def test_fan_out_deadline_and_errors(self):
+        """
+        It tests that a call out of deadline or with an error has None as result
+        """
+
+        def broken():
+            raise Exception("broken")
+
+        results = FanOut.run(
+            {
+                "ok": lambda: current_app.name,
+                "slow": lambda: time.sleep(1) or "late",
+                "error": broken,
+            },
+            timeout=0.3,
+        )
+        assert results["ok"] == current_app.name
+        assert results["slow"] is None
+        assert results["error"] is None
+
+    def test_fan_out_nested(self, upstream):
+        """
+        It tests that a call of the fan-out that makes a fan-out does not
+        wait the threads of the same pool
+        """
+        upstream.route("GET", "/items", payload={"items": [1]})
+        url = "{}/items".format(upstream.url)
+        try:
+            FanOut.configure({"FANOUT_MAX_WORKERS": 2, "FANOUT_TIMEOUT": 2})
+
+            def outer():
+                assert FanOut.in_worker()
+                inner = FanOut.run(
+                    {i: lambda: HttpUtils.make_get_request(url) for i in range(3)}
+                )
+                return list(inner.values())
+
+            start = time.time()
+            results = FanOut.run({i: outer for i in range(4)})
+            assert time.time() - start < 1.0
+            assert all(result == [{"items": [1]}] * 3 for result in results.values())
+            assert not FanOut.in_worker()
+        finally:
+            FanOut.configure(current_app.config)
+
+    def test_async_gather_requests(self, upstream):
+        """
+        It tests that the async client make the requests at the same time
+        and return the same values of HttpUtils
+        """
+
+        def slow(handler):
+            time.sleep(0.3)
+            return 200, {"path": handler.path}, {}
+
+        for i in range(5):
+            upstream.handler("GET", "/slow/{}".format(i), slow)
+        upstream.route("POST", "/create", status=201, payload={"id": 1})
+        upstream.route("PUT", "/update", status=400, payload={"error": "bad"})
+        requests = [("GET", "{}/slow/{}".format(upstream.url, i)) for i in range(5)]
+        requests.append(("POST", "{}/create".format(upstream.url), {"name": "a"}))
+        requests.append(("PUT", "{}/update".format(upstream.url), {"name": "b"}))
+        requests.append(("DELETE", "{}/missing".format(upstream.url)))
+
+        start = time.time()
+        results = AsyncHttpUtils.run_requests(requests)
+        assert time.time() - start < 1.0
+        for i in range(5):
+            assert results[i] == {"path": "/slow/{}".format(i)}
+        assert results[5] == ({"id": 1}, 201)
+        assert results[6] == (None, 400)
+        assert results[7] is None
+
+    def test_async_connection_error(self):
+        """
+        It tests that a connection error has the same result of HttpUtils
+        """
+        results = AsyncHttpUtils.run_requests(
+            [
+                ("GET", "http://127.0.0.1:1/none"),
+                ("POST", "http://127.0.0.1:1/none", {}),
+            ]
+        )
+        assert results == [None, (None, 500)]
+        assert AsyncHttpUtils().timeout == current_app.config["HTTP_TIMEOUT"]
+        assert AsyncHttpUtils(timeout=2).timeout == 2
+
+    def test_async_breaker_metrics_and_spans(self, upstream):
+        """
+        It tests that the async client uses the circuit breaker, the metrics
+        and the spans of HttpUtils
+        """
+        Metrics.reset()
+        exporter = Tracer.exporter()
+        exporter.clear()
+        upstream.route("GET", "/items", payload={"items": [1]})
+        upstream.route("GET", "/broken", status=500)
+        url = "{}/broken".format(upstream.url)
+        with Tracer.span("root") as root:
+            results = AsyncHttpUtils.run_requests(
+                [("GET", "{}/items".format(upstream.url))] + [("GET", url)] * 5,
+                concurrency=1,
+            )
+        assert results == [{"items": [1]}] + [None] * 5
+        http = [
+            s for s in exporter.spans(root.trace_id) if s["name"].startswith("HTTP")
+        ]
+        # the circuit opens before the last request, that is not sent
+        assert len(http) == len(upstream.calls) == 5
+        assert http[0]["attributes"]["status"] == 200
+        assert upstream.calls[0]["headers"][TRACEPARENT_HEADER].endswith(
+            "{}-01".format(http[0]["span_id"])
+        )
+        text = Metrics.render()
+        labels = 'upstream="default",route="default",method="GET"'
+        assert "gateway_upstream_request_seconds_count{%s} 5" % labels in text
+
+        assert CircuitBreakers.for_url(url).state == OPEN
+        calls = len(upstream.calls)
+        assert AsyncHttpUtils.run_requests([("POST", url, {})]) == [(None, 503)]
+        assert len(upstream.calls) == calls
+
+    def test_circuit_breaker_states(self):
+        """
+        It tests the transitions closed -> open -> half open -> closed
+        """
+        breaker = CircuitBreaker("test", window=4, min_calls=4, open_seconds=0.2)
+        for _ in range(2):
+            breaker.record(True)
+        for _ in range(2):
+            breaker.record(False)
+        assert breaker.state == OPEN
+        assert breaker.allow_request() is False
+        time.sleep(0.25)
+        assert breaker.state == HALF_OPEN
+        assert breaker.allow_request() is True
+        # only one probe in half open
+        assert breaker.allow_request() is False
+        breaker.record(True)
+        assert breaker.state == CLOSED
+
+    def test_circuit_breaker_slow_calls(self):
+        """
+        It tests that the slow calls are counted as failures
+        """
+        breaker = CircuitBreaker("test", window=4, min_calls=2, slow_call=0.1)
+        breaker.record(True, elapsed=0.5)
+        assert breaker.state == CLOSED
+        breaker.record(True, elapsed=0.5)
+        assert breaker.state == OPEN
+
+    def test_circuit_breaker_fast_fail(self, upstream):
+        """
+        It tests that when the upstream fails the requests are not made
+        """
+        upstream.route("GET", "/broken", status=500)
+        upstream.route("POST", "/broken", status=500)
+        url = "{}/broken".format(upstream.url)
+        for _ in range(5):
+            assert HttpUtils.make_get_request(url) is None
+        assert CircuitBreakers.for_url(url).state == OPEN
+        calls = len(upstream.calls)
+        assert HttpUtils.make_get_request(url) is None
+        assert HttpUtils.make_post_request(url, {}) == (None, 503)
+        assert len(upstream.calls) == calls
+
+    def test_deadline_timeout_and_header(self, upstream):
+        """
+        It tests that the time left is used as timeout and sent as header
+        """
+
+        def slow(handler):
+            time.sleep(1)
+            return 200, {}, {}
+
+        upstream.handler("GET", "/slow", slow)
+        upstream.route("GET", "/fast", payload={"ok": True})
+        token = Deadline.start(0.5)
+        try:
+            assert HttpUtils.make_get_request("{}/fast".format(upstream.url)) == {
+                "ok": True
+            }
+            header = int(upstream.calls[-1]["headers"][DEADLINE_HEADER])
+            assert 0 < header <= 500
+            start = time.time()
+            assert HttpUtils.make_get_request("{}/slow".format(upstream.url)) is None
+            assert time.time() - start < 0.9
+            # the budget is finished, so the request is not made
+            calls = len(upstream.calls)
+            url = "{}/fast".format(upstream.url)
+            assert HttpUtils.make_get_request(url) is None
+            assert HttpUtils.make_post_request(url, {}) == (None, 504)
+            assert len(upstream.calls) == calls
+        finally:
+            Deadline.stop(token)
+        assert Deadline.remaining() is None
+
+    def test_response_cache_ttl_and_lru(self):
+        """
+        It tests that the entries expire and the least recently used is removed
+        """
+        cache = ResponseCache(max_size=2)
+        cache.set("a", 1, ttl=0.2)
+        cache.set("b", 2, ttl=10)
+        assert cache.get("a") == 1
+        cache.set("c", 3, ttl=10)
+        # b is the least recently used
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+        time.sleep(0.25)
+        assert cache.get("a") is None
+        stats = cache.stats()
+        assert stats["hits"] == 2
+        assert stats["misses"] == 2
+        assert stats["evictions"] == 1
+
+    def test_upstream_cache_invalidate_restaurant(self):
+        """
+        It tests that a write on a restaurant remove only its responses
+        """
+        base = RESTAURANTS_MICROSERVICE_URL
+        assert UpstreamCache.route_of("{}/1/menu".format(base)) == ("menu", 1)
+        assert UpstreamCache.route_of("{}/1/reviews/3".format(base)) == (None, None)
+        assert UpstreamCache.is_cached(base)
+        for url in ["{}/1/menu", "{}/12/menu", "{}/1", "{}"]:
+            UpstreamCache.put(url.format(base), {"url": url})
+        assert UpstreamCache.invalidate_restaurant(1) == 3
+        assert UpstreamCache.get("{}/12/menu".format(base)) is not None
+        assert UpstreamCache.get("{}/1/menu".format(base)) is None
+        assert UpstreamCache.invalidate_route("menu") == 1
+
+    def test_get_request_cached(self, upstream, monkeypatch):
+        """
+        It tests that a cached GET is made only one time
+        """
+        monkeypatch.setattr(
+            UpstreamCache,
+            "_routes",
+            [
+                (
+                    "menu",
+                    re.compile(
+                        r"^{}/(?P<restaurant_id>\d+)/menu$".format(upstream.url)
+                    ),
+                )
+            ],
+        )
+        upstream.route("GET", "/1/menu", payload={"menus": []})
+        url = "{}/1/menu".format(upstream.url)
+        for _ in range(3):
+            assert HttpUtils.make_get_request(url) == {"menus": []}
+        assert len(upstream.calls) == 1
+        UpstreamCache.invalidate_restaurant(1)
+        assert HttpUtils.make_get_request(url) == {"menus": []}
+        assert len(upstream.calls) == 2
+
+    def test_get_request_revalidated(self, upstream, monkeypatch):
+        """
+        It tests that an expired response is revalidated with the ETag
+        and reused when the upstream answers 304
+        """
+        monkeypatch.setattr(
+            UpstreamCache,
+            "_routes",
+            [("restaurants", re.compile(r"^{}/restaurants$".format(upstream.url)))],
+        )
+        UpstreamCache.configure({"RESPONSE_CACHE_TTL": {"restaurants": 0.1}})
+
+        def restaurants(handler):
+            if handler.headers.get("If-None-Match") == '"v1"':
+                return 304, b"", {"ETag": '"v1"'}
+            return 200, {"restaurants": [1, 2, 3]}, {"ETag": '"v1"'}
+
+        upstream.handler("GET", "/restaurants", restaurants)
+        url = "{}/restaurants".format(upstream.url)
+        assert HttpUtils.make_get_request(url) == {"restaurants": [1, 2, 3]}
+        time.sleep(0.15)
+        assert HttpUtils.make_get_request(url) == {"restaurants": [1, 2, 3]}
+        assert len(upstream.calls) == 2
+        assert upstream.calls[1]["headers"]["If-None-Match"] == '"v1"'
+        # revalidated, so it is fresh again
+        assert HttpUtils.make_get_request(url) == {"restaurants": [1, 2, 3]}
+        assert len(upstream.calls) == 2
+        assert UpstreamCache.stats()["revalidations"] == 1
+
+    def test_single_flight_coalesce(self, upstream):
+        """
+        It tests that the identical GET requests in flight make only one call
+        """
+
+        def slow(handler):
+            time.sleep(0.3)
+            return 200, {"restaurants": []}, {}
+
+        upstream.handler("GET", "/restaurants", slow)
+        url = "{}/restaurants".format(upstream.url)
+        results = FanOut.run(
+            {i: lambda: HttpUtils.make_get_request(url) for i in range(5)}
+        )
+        assert all(result == {"restaurants": []} for result in results.values())
+        assert len(upstream.calls) == 1
+        # the call is finished, so a new request is made
+        assert HttpUtils.make_get_request(url) == {"restaurants": []}
+        assert len(upstream.calls) == 2
+
+    def test_single_flight_side_effects(self):
+        """
+        It tests that the GET requests with side effects are not coalesced
+        """
+        assert SingleFlight.can_coalesce("{}/1".format(USER_MICROSERVICE_URL))
+        url = "{}/mark/email/a@a.com".format(USER_MICROSERVICE_URL)
+        assert not SingleFlight.can_coalesce(url)
+
+    def test_single_flight_error_shared(self):
+        """
+        It tests that the error of the call is raised also in the followers
+        """
+        flight = SingleFlight()
+
+        def broken():
+            time.sleep(0.2)
+            raise ValueError("broken")
+
+        def call():
+            try:
+                flight.do("key", broken)
+            except ValueError:
+                return "error"
+
+        results = FanOut.run({i: call for i in range(3)})
+        assert list(results.values()) == ["error"] * 3
+        assert flight.stats()["leaders"] == 1
+
+    def test_log_lazy_and_redacted(self):
+        """
+        It tests that the message is formatted only when it is written
+        and that the passwords are not written
+        """
+        formatted = []
+
+        class Body:
+            def __format__(self, spec):
+                formatted.append(True)
+                return "body"
+
+        records = []
+        handler = logging.Handler()
+        handler.emit = lambda record: records.append(record.getMessage())
+        log = get_logger("test")
+        log.logger.addHandler(handler)
+        try:
+            log.logger.setLevel(logging.INFO)
+            log.debug("Response is: {}", Body())
+            assert formatted == []
+            assert records == []
+            log.logger.setLevel(logging.DEBUG)
+            log.debug("Body {}", {"email": "a@a.com", "password": "secret"}, code=200)
+            assert "secret" not in records[0]
+            assert "a@a.com" in records[0]
+            assert "code=200" in records[0]
+        finally:
+            log.logger.removeHandler(handler)
+            log.logger.setLevel(logging.NOTSET)
+        assert redact([{"user": {"password": "x"}}]) == [{"user": {"password": "***"}}]
+
+    def test_log_sampling(self):
+        """
+        It tests that the debug messages are sampled but the errors are not
+        """
+        records = []
+        handler = logging.Handler()
+        handler.emit = lambda record: records.append(record.getMessage())
+        log = get_logger("sampled")
+        log.logger.addHandler(handler)
+        log.logger.setLevel(logging.DEBUG)
+        try:
+            StructuredLogger.configure({"LOG_SAMPLING": {"sampled": 0}})
+            for _ in range(10):
+                log.debug("debug")
+            log.error("error")
+            assert records == ["error"]
+        finally:
+            StructuredLogger.configure({})
+            log.logger.removeHandler(handler)
+            log.logger.setLevel(logging.NOTSET)
+
+    def test_json_codec_backends(self):
+        """
+        It tests that all the backends encode and decode the same values
+        """
+        body = {"id": 1, "name": "Pizza è", "tables": [{"capacity": 4}], "x": None}
+        try:
+            for backend in BACKENDS.keys():
+                JsonCodec.use(backend)
+                assert JsonCodec.backend == backend
+                data = JsonCodec.dumps(body)
+                assert isinstance(data, bytes)
+                assert json.loads(data.decode("utf-8")) == body
+                assert JsonCodec.loads(data) == body
+                assert JsonCodec.loads(data.decode("utf-8")) == body
+            JsonCodec.use("missing")
+            assert JsonCodec.backend == "json"
+        finally:
+            JsonCodec.configure(current_app.config)
+
+    def test_gzip_response_and_json_body(self, upstream):
+        """
+        It tests that a compressed response is decoded and that the
+        json body is sent with the right content type
+        """
+        payload = [{"id": i, "name": "restaurant {}".format(i)} for i in range(100)]
+        upstream.route(
+            "GET",
+            "/restaurants",
+            payload=gzip.compress(json.dumps(payload).encode()),
+            headers={"Content-Encoding": "gzip"},
+        )
+        upstream.route("POST", "/book", status=201, payload={"id": 1})
+        url = "{}/restaurants".format(upstream.url)
+        assert HttpUtils.make_get_request(url) == payload
+        assert "gzip" in upstream.calls[-1]["headers"]["Accept-Encoding"]
+
+        url = "{}/book".format(upstream.url)
+        assert HttpUtils.make_post_request(url, {"people": 2}) == ({"id": 1}, 201)
+        call = upstream.calls[-1]
+        assert call["headers"]["Content-Type"] == "application/json"
+        assert json.loads(call["body"].decode()) == {"people": 2}
+
+    def test_retry_with_backoff(self, upstream):
+        """
+        It tests that an idempotent GET is retried after a 503,
+        but a GET with side effects is made only once
+        """
+        answers = [503, 503, 200]
+
+        def flaky(handler):
+            return answers.pop(0), {"ok": True}, {}
+
+        upstream.handler("GET", "/flaky", flaky)
+        upstream.route("GET", "/mark/1", status=503)
+        try:
+            Retries.configure({"RETRY_ATTEMPTS": 3, "RETRY_BACKOFF": 0.01})
+            url = "{}/flaky".format(upstream.url)
+            assert HttpUtils.make_get_request(url) == {"ok": True}
+            assert len(upstream.calls) == 3
+            assert HttpUtils.make_get_request("{}/mark/1".format(upstream.url)) is None
+            assert len(upstream.calls) == 4
+            assert 0 <= Retries.backoff(10) <= 1.0
+        finally:
+            Retries.configure(current_app.config)
+
+    def test_retry_budget(self):
+        """
+        It tests that the budget limits the extra requests
+        """
+        budget = RetryBudget(ratio=0.5, min_per_second=0)
+        assert budget.withdraw() is True
+        assert budget.withdraw() is False
+        budget.deposit()
+        assert budget.withdraw() is False
+        budget.deposit()
+        assert budget.withdraw() is True
+        tracker = LatencyTracker()
+        assert tracker.percentile(95) is None
+        for i in range(1, 101):
+            tracker.record(i / 100)
+        assert tracker.percentile(50) == 0.51
+        assert tracker.percentile(95, min_samples=200) is None
+
+    def test_hedged_request(self, upstream):
+        """
+        It tests that a slow request is hedged and that the first
+        successful response wins
+        """
+        answers = []
+
+        def replica(handler):
+            status, name, delay = answers.pop(0) if len(answers) > 0 else (200, "", 0)
+            time.sleep(delay)
+            return status, {"replica": name}, {}
+
+        upstream.handler("GET", "/restaurants", replica)
+        url = "{}/restaurants".format(upstream.url)
+        try:
+            Retries.configure(
+                {
+                    "HEDGE_UPSTREAMS": ["default"],
+                    "HEDGE_MIN_SAMPLES": 5,
+                    "RETRY_ATTEMPTS": 1,
+                }
+            )
+            for _ in range(5):
+                Retries.record_latency(url, 0.05)
+            # the hedge answers before the slow request and wins
+            answers[:] = [(200, "slow", 1.0), (200, "fast", 0)]
+            start = time.time()
+            assert HttpUtils.make_get_request(url) == {"replica": "fast"}
+            assert time.time() - start < 0.5
+            assert len(upstream.calls) == 2
+            # an error of the hedge does not win
+            answers[:] = [(200, "slow", 0.3), (503, "broken", 0)]
+            assert HttpUtils.make_get_request(url) == {"replica": "slow"}
+            assert len(upstream.calls) == 4
+            # a fast request is not hedged
+            answers[:] = [(200, "fast", 0)]
+            assert HttpUtils.make_get_request(url) == {"replica": "fast"}
+            time.sleep(0.1)
+            assert len(upstream.calls) == 5
+        finally:
+            Retries.configure(current_app.config)
+
+    def test_load_balancer_least_outstanding(self):
+        """
+        It tests that the replica with less requests in flight is chosen
+        and that a replica that fails is ejected
+        """
+        pool = EndpointPool("restaurants", ["http://a", "http://b"], eject_failures=2)
+        busy = pool.acquire()
+        for _ in range(2):
+            endpoint = pool.acquire()
+            assert endpoint is not busy
+            pool.release(endpoint, failed=True)
+        assert [state["ejected"] for state in pool.states()].count(True) == 1
+        for _ in range(5):
+            assert pool.acquire() is busy
+        assert busy.outstanding == 6
+
+    def test_load_balancer_replicas(self, upstream):
+        """
+        It tests that the requests are sent directly to the replicas and
+        that a replica that fails is ejected without errors for the caller
+        """
+        replica = Upstream()
+        for server in (upstream, replica):
+            server.route(
+                "GET", "/restaurants/reviews/1", payload={"server": server.url}
+            )
+        url = "{}/reviews/1".format(RESTAURANTS_MICROSERVICE_URL)
+        config = {
+            "UPSTREAM_ENDPOINTS": {
+                "restaurants": [
+                    "{}/restaurants".format(upstream.url),
+                    "{}/restaurants".format(replica.url),
+                ]
+            },
+            "LB_EJECT_FAILURES": 1,
+        }
+        try:
+            LoadBalancer.configure(config)
+            Retries.configure({"RETRY_BACKOFF": 0.01})
+            servers = set()
+            for _ in range(20):
+                servers.add(HttpUtils.make_get_request(url)["server"])
+            assert servers == {upstream.url, replica.url}
+            # the replica is overloaded
+            replica.route("GET", "/restaurants/reviews/1", status=503)
+            for _ in range(20):
+                assert HttpUtils.make_get_request(url) == {"server": upstream.url}
+            states = LoadBalancer.states()["restaurants"]
+            assert states[1]["ejected"] is True
+            assert all(state["outstanding"] == 0 for state in states)
+        finally:
+            LoadBalancer.configure(current_app.config)
+            Retries.configure(current_app.config)
+            replica.close()
+
+    def test_histogram_threads(self):
+        """
+        It tests that the observations of more threads are all counted
+        """
+        histogram = Histogram(buckets=(0.1, 1))
+
+        def observe():
+            for _ in range(1000):
+                histogram.observe(0.05)
+                histogram.observe(0.5, error=True)
+
+        threads = [threading.Thread(target=observe) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        histogram.observe(0.1)
+        histogram.observe(5)
+        data = histogram.collect()
+        assert data["buckets"] == [4001, 8001, 8002]
+        assert data["count"] == 8002
+        assert data["errors"] == 4000
+        assert abs(data["sum"] - (4000 * 0.55 + 5.1)) < 1e-6
+
+        # the shards do not grow with the threads
+        threads = [
+            threading.Thread(target=histogram.observe, args=(1,)) for _ in range(100)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(histogram._shards) == STRIPES
+        assert histogram.collect()["count"] == 8102
+
+    def test_metrics_view(self, client, upstream):
+        """
+        It tests that /metrics exports the latency of the views and of the
+        calls to the microservices with the gauges of the HTTP layer
+        """
+        Metrics.reset()
+        upstream.route("GET", "/items", payload={})
+        upstream.route("GET", "/broken", status=500)
+        HttpUtils.make_get_request("{}/items".format(upstream.url))
+        HttpUtils.make_get_request("{}/broken".format(upstream.url))
+        client.get("/metrics")
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.mimetype == "text/plain"
+        text = response.data.decode()
+        labels = 'endpoint="metrics.export_metrics",method="GET"'
+        assert "gateway_view_request_seconds_count{%s} 1" % labels in text
+        labels = 'upstream="default",route="default",method="GET"'
+        assert "gateway_upstream_request_seconds_count{%s} 2" % labels in text
+        assert (
+            'gateway_upstream_request_seconds_bucket{%s,le="+Inf"} 2' % labels in text
+        )
+        assert "gateway_upstream_request_errors_total{%s} 1" % labels in text
+        assert "gateway_cache_hit_ratio" in text
+        assert 'gateway_upstream_pool_maxsize{upstream="default"}' in text
+
+    def test_tracing_spans(self, client, upstream):
+        """
+        It tests that the service methods, the calls to the microservices,
+        the json decode and the templates are children of the same trace
+        and that the trace is sent to the microservices
+        """
+
+        @traced
+        class Service:
+            @staticmethod
+            def load(url):
+                return HttpUtils.make_get_request(url)
+
+        upstream.route("GET", "/items", payload={"items": [1]})
+        exporter = Tracer.exporter()
+        exporter.clear()
+        with Tracer.span("root") as root:
+            assert Service.load("{}/items".format(upstream.url)) == {"items": [1]}
+            assert render_template_string("{{ 1 + 1 }}") == "2"
+        spans = {span["name"]: span for span in exporter.spans(root.trace_id)}
+        assert spans["Service.load"]["parent_id"] == root.span_id
+        http = spans["HTTP GET default"]
+        assert http["parent_id"] == spans["Service.load"]["span_id"]
+        assert http["attributes"]["status"] == 200
+        assert spans["json decode"]["parent_id"] == spans["Service.load"]["span_id"]
+        assert spans["render None"]["parent_id"] == root.span_id
+        header = upstream.calls[-1]["headers"][TRACEPARENT_HEADER]
+        assert header == "00-{}-{}-01".format(root.trace_id, http["span_id"])
+
+        trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+        parent_id = "00f067aa0ba902b7"
+        client.get(
+            "/metrics",
+            headers={TRACEPARENT_HEADER: "00-{}-{}-01".format(trace_id, parent_id)},
+        )
+        request_span = exporter.spans(trace_id)[-1]
+        assert request_span["name"] == "GET /metrics"
+        assert request_span["parent_id"] == parent_id
+        assert request_span["attributes"]["status"] == 200
+        assert Tracer.parse_traceparent("00-bad-header") == (None, None)
+
+    def test_iter_json_array(self):
+        """
+        It tests that the items of an array are decoded also when they
+        are split between the chunks
+        """
+        items = [{"id": 1, "name": "Caffè ☕"}, [1, 2], 12345, "a,]", None, 1.5]
+        data = json.dumps(items, ensure_ascii=False).encode()
+        for size in (1, 3, 7, len(data)):
+            chunks = [data[i : i + size] for i in range(0, len(data), size)]
+            assert list(iter_json_array(chunks)) == items
+        assert list(iter_json_array([b" [ ] "])) == []
+        for body in (b'{"a": 1}', b"[1, 2", b'[{"a": }]'):
+            try:
+                list(iter_json_array([body]))
+                assert False
+            except ValueError:
+                pass
+
+    def test_get_list_stream(self, upstream):
+        """
+        It tests that a long list is decoded while it is received
+        """
+        payload = [{"id": i, "people": ["a@a.com"]} for i in range(500)]
+        upstream.route(
+            "GET",
+            "/book",
+            payload=gzip.compress(json.dumps(payload).encode()),
+            headers={"Content-Encoding": "gzip"},
+        )
+        url = "{}/book".format(upstream.url)
+        items = HttpUtils.make_get_list_stream(url, chunk_size=256)
+        assert next(items) == payload[0]
+        assert list(items) == payload[1:]
+        assert HttpUtils.make_get_list_stream("{}/missing".format(upstream.url)) is None
+
+        # an error while the body is read stops the items, it is not raised
+        upstream.route("GET", "/broken", payload=b'[{"id": 1}, {"id": }]')
+        items = HttpUtils.make_get_list_stream("{}/broken".format(upstream.url))
+        assert list(items) == [{"id": 1}]
+        upstream.route(
+            "GET", "/broken", payload=b"not gzip", headers={"Content-Encoding": "gzip"}
+        )
+        items = HttpUtils.make_get_list_stream("{}/broken".format(upstream.url))
+        assert list(items) == []
+
+    def test_jobs_progress(self):
+        """
+        It tests that a job runs in background with its own deadline
+        and that its progress and its result are readable
+        """
+        Jobs.configure({"JOBS_MAX_WORKERS": 1, "JOBS_BUDGET": 30, "JOBS_KEEP": 1})
+        started = threading.Event()
+        release = threading.Event()
+
+        def work(job):
+            job.update(done=1)
+            started.set()
+            release.wait(5)
+            assert Deadline.remaining() > 10
+            return current_app.name
+
+        token = Deadline.start(0.1)
+        try:
+            job = Jobs.submit("work", work)
+        finally:
+            Deadline.stop(token)
+        assert started.wait(5)
+        assert Jobs.get(job.id).to_dict()["state"] == "running"
+        assert job.to_dict()["progress"] == {"done": 1}
+        time.sleep(0.2)
+        release.set()
+
+        def broken(job):
+            raise RuntimeError("broken")
+
+        failed = Jobs.submit("broken", broken)
+        for _ in range(100):
+            if failed.is_finished():
+                break
+            time.sleep(0.05)
+        assert job.to_dict()["state"] == "done"
+        assert job.message == current_app.name
+        assert failed.to_dict()["state"] == "failed"
+        assert failed.message == "broken"
+        # only the last finished job is kept
+        Jobs.submit("work", lambda job: None)
+        assert Jobs.get(job.id) is None
+        assert Jobs.get("missing") is None
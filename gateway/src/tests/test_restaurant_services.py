@@ -1,4 +1,5 @@
 from random import random, randrange
+from types import SimpleNamespace
 
 from src.forms import RestaurantForm
 from src.services.restaurant_services import RestaurantServices
@@ -410,3 +411,32 @@ class Test_RestaurantServices:
         table.fill_from_json(json)
 
         assert json["name"] == (table.serialize())["name"]
+
+    def test_all_info_without_reviews(self, monkeypatch):
+        """
+        It tests that the sheet of the restaurant is returned also
+        if the reviews are not available, and not without an other information
+        """
+        restaurant = SimpleNamespace(
+            bind_menu=lambda menu: None, bind_hours=lambda hours: None
+        )
+        infos = {
+            "get_rest_by_id": restaurant,
+            "get_menu_restaurant": [],
+            "get_photos_restaurants": [],
+            "get_dishes_restaurant": [],
+            "get_opening_hours_restaurant": [],
+            "get_three_reviews": None,
+        }
+        for name, value in infos.items():
+            monkeypatch.setattr(RestaurantServices, name, lambda _, value=value: value)
+
+        for parallel in (True, False):
+            model = RestaurantServices.get_all_restaurants_info(
+                1, with_reviews=True, parallel=parallel
+            )
+            assert model is restaurant
+            assert model.reviews == []
+
+        monkeypatch.setattr(RestaurantServices, "get_dishes_restaurant", lambda _: None)
+        assert RestaurantServices.get_all_restaurants_info(1, with_reviews=True) is None
@@ -127,3 +127,41 @@ class Test_UserServices:
 
         result_delete = UserService.delete_user(user.id)
         assert result_delete is True
+
+    def test_get_users_by_ids(self, upstream, monkeypatch):
+        """
+        It tests that each user is asked once and then it is read from memory
+        """
+        import src.services.user_service as user_service
+
+        for user_id in (1, 2):
+            upstream.route(
+                "GET",
+                "/user/{}".format(user_id),
+                payload={
+                    "id": user_id,
+                    "email": "user{}@alibaba.com".format(user_id),
+                    "phone": "12345",
+                    "firstname": "user_{}".format(user_id),
+                    "lastname": "user",
+                    "dateofbirth": "1995-12-12T00:00:00Z",
+                    "role_id": 3,
+                },
+            )
+        monkeypatch.setattr(
+            user_service, "USER_MICROSERVICE_URL", "{}/user".format(upstream.url)
+        )
+        UserService.forget_user(1)
+        UserService.forget_user(2)
+
+        users = UserService.get_users_by_ids([1, 2, 1, "2", 3, None])
+        assert sorted(users.keys()) == [1, 2]
+        assert users[1].firstname == "user_1"
+        assert len(upstream.calls) == 3
+
+        users = UserService.get_users_by_ids([2, 3])
+        assert list(users.keys()) == [2]
+        assert len(upstream.calls) == 4
+        UserService.forget_user(2)
+        UserService.get_users_by_ids([2])
+        assert len(upstream.calls) == 5
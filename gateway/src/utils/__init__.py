@@ -1,2 +1,16 @@
 from .formatter import *
 from .http_utils import HttpUtils
+from .http_pool import HttpPool
+from .fan_out import FanOut
+from .async_http_utils import AsyncHttpUtils
+from .circuit_breaker import CircuitBreakers, CircuitOpenError
+from .deadline import Deadline, DeadlineExceeded, request_budget
+from .response_cache import ResponseCache, UpstreamCache
+from .single_flight import SingleFlight
+from .log_utils import get_logger, redact
+from .json_codec import JsonCodec
+from .retry import Retries
+from .load_balancer import LoadBalancer
+from .metrics import Metrics
+from .tracing import Tracer, traced
+from .jobs import Jobs
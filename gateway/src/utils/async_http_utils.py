@@ -0,0 +1,204 @@
+import asyncio
+import time
+
+import aiohttp
+from flask import current_app, has_app_context
+
+from src.utils.circuit_breaker import CircuitBreakers
+from src.utils.deadline import Deadline, DeadlineExceeded
+from src.utils.http_pool import HttpPool
+from src.utils.json_codec import JsonCodec
+from src.utils.load_balancer import LoadBalancer
+from src.utils.metrics import Metrics
+from src.utils.retry import Retries
+from src.utils.tracing import Tracer
+from src.utils.log_utils import get_logger
+
+log = get_logger("http")
+
+# seconds of a request without the app config (see HTTP_TIMEOUT)
+DEFAULT_TIMEOUT = 30
+
+
+class AsyncHttpUtils:
+    """
+    This class is the asyncio version of HttpUtils, the coroutines return
+    the same values of the HttpUtils methods:
+    - get and delete return the json response or None if there is some error
+    - post and put return the tuple (json, status_code)
+
+    It is used as async context manager, so all the requests share the same
+    connection pool, e.g:
+
+        async with AsyncHttpUtils() as client:
+            menu, photos = await client.gather_requests(
+                [("GET", menu_url), ("GET", photos_url)]
+            )
+
+    From a flask view (that is not a coroutine) it is possible to use
+    AsyncHttpUtils.run_requests([...]) that make the same work inside a new loop.
+    """
+
+    def __init__(
+        self, limit: int = 100, limit_per_host: int = 32, timeout: float = None
+    ):
+        """
+        :param limit: max number of open connections
+        :param limit_per_host: max number of open connections to the same host
+        :param timeout: total seconds for each request, by default
+        HTTP_TIMEOUT as the requests of HttpUtils
+        """
+        if timeout is None:
+            timeout = DEFAULT_TIMEOUT
+            if has_app_context():
+                timeout = current_app.config.get("HTTP_TIMEOUT", DEFAULT_TIMEOUT)
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.limit, limit_per_host=self.limit_per_host
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+        self.session = None
+
+    async def _request(self, method: str, to_url: str, args=None):
+        """
+        This method contains the code to make the request
+        to a url, with the same hooks of HttpUtils.request: the circuit
+        breaker of the upstream, the replica chosen by LoadBalancer, the
+        latency inside Metrics and the span of the call.
+        :return tuple (json, status_code), json is None if there is some error
+        """
+        upstream = HttpPool.upstream_of(to_url)
+        route = Retries.route_of(to_url)
+        breaker = CircuitBreakers.for_url(to_url)
+        if not breaker.allow_request():
+            log.error("Circuit open for {}", breaker.name)
+            return None, 503
+        with Tracer.span(
+            "HTTP {} {}".format(method, route),
+            kind="client",
+            upstream=upstream,
+            url=to_url,
+        ) as span:
+            endpoint = None
+            status = None
+            start = None
+            try:
+                log.debug("Url is: {}", to_url)
+                timeout = aiohttp.ClientTimeout(total=Deadline.timeout(self.timeout))
+                headers = Deadline.headers()
+                headers.update(Tracer.headers())
+                data = None
+                if args is not None:
+                    data = JsonCodec.dumps(args)
+                    headers["Content-Type"] = "application/json"
+                url, endpoint = LoadBalancer.acquire(to_url)
+                start = time.monotonic()
+                async with self.session.request(
+                    method, url, data=data, timeout=timeout, headers=headers
+                ) as response:
+                    status = response.status
+                    if span is not None:
+                        span.set("status", status)
+                    if response.status >= 400:
+                        log.error("Error from microservice")
+                        log.error("Error received {}", response.reason)
+                        return None, response.status
+                    json = JsonCodec.loads(await response.read())
+                    log.debug("Response is: {}", json)
+                    return json, response.status
+            except DeadlineExceeded as ex:
+                log.error(str(ex))
+                return None, 504
+            except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+                log.error("Error during the microservice call {}", str(ex))
+                return None, 500
+            finally:
+                failed = status is None or status >= 500
+                LoadBalancer.release(to_url, endpoint, failed)
+                # the calls that are not sent (e.g. out of deadline) are not counted
+                if start is not None:
+                    elapsed = time.monotonic() - start
+                    breaker.record(not failed, elapsed)
+                    Metrics.observe_upstream(upstream, route, method, status, elapsed)
+
+    async def get(self, to_url: str):
+        """
+        :param to_url: The URL of the endpoint
+        :return the json response or None if there is some error
+        """
+        json, _ = await self._request("GET", to_url)
+        return json
+
+    async def post(self, to_url: str, args):
+        """
+        :param to_url: The URL of the endpoint
+        :param args: Python object, this object help to fill the body request
+        :return tuple (json, status_code)
+        """
+        return await self._request("POST", to_url, args)
+
+    async def put(self, to_url: str, args):
+        """
+        :param to_url: The URL of the endpoint
+        :param args: Python object, this object help to fill the body request
+        :return tuple (json, status_code)
+        """
+        return await self._request("PUT", to_url, args)
+
+    async def delete(self, to_url: str):
+        """
+        :param to_url: The URL of the endpoint
+        :return the json response or None if there is some error
+        """
+        json, _ = await self._request("DELETE", to_url)
+        return json
+
+    async def gather_requests(self, requests: list, concurrency: int = None) -> list:
+        """
+        Make all the requests at the same time
+        :param requests: list of tuple (method, url) or (method, url, args)
+        :param concurrency: max number of requests in flight, by default no limit
+        :return the list of results in the same order of the requests
+        """
+        methods = {
+            "GET": self.get,
+            "POST": self.post,
+            "PUT": self.put,
+            "DELETE": self.delete,
+        }
+        semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+
+        async def _one(request):
+            method = methods[request[0].upper()]
+            if semaphore is None:
+                return await method(*request[1:])
+            async with semaphore:
+                return await method(*request[1:])
+
+        return await asyncio.gather(*[_one(request) for request in requests])
+
+    @staticmethod
+    def run_requests(requests: list, concurrency: int = None, **kwargs) -> list:
+        """
+        Make all the requests at the same time from a code that is not a coroutine
+        :param requests: list of tuple (method, url) or (method, url, args)
+        :param concurrency: max number of requests in flight, by default no limit
+        :return the list of results in the same order of the requests
+        """
+
+        async def _run():
+            async with AsyncHttpUtils(**kwargs) as client:
+                return await client.gather_requests(requests, concurrency)
+
+        return asyncio.run(_run())
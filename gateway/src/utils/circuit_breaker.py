@@ -0,0 +1,180 @@
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+
+from src.utils.http_pool import UPSTREAMS
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised when the call is refused because the circuit of the upstream is open,
+    it is a ConnectionError so the code that already handle a connection
+    error handle also this case.
+    """
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of one upstream.
+    - closed: all the calls are made, the last `window` results are kept and
+      when the failure rate is over `failure_rate` the circuit goes open.
+      A call slower than `slow_call` seconds is counted as a failure.
+    - open: all the calls fail fast, after `open_seconds` the circuit goes half open.
+    - half open: only `half_open_calls` calls are made to test the upstream,
+      if they succeed the circuit goes closed otherwise it goes open again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_rate: float = 0.5,
+        slow_call: float = 5.0,
+        open_seconds: float = 30,
+        half_open_calls: int = 1,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self._lock = threading.Lock()
+        self._results = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0
+        self._probes = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def _refresh(self):
+        if (
+            self._state == OPEN
+            and time.monotonic() - self._opened_at >= self.open_seconds
+        ):
+            self._state = HALF_OPEN
+            self._probes = 0
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._results.clear()
+
+    def allow_request(self) -> bool:
+        """
+        Return True if the call can be made to the upstream
+        """
+        with self._lock:
+            self._refresh()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return True
+            return False
+
+    def record(self, success: bool, elapsed: float = 0):
+        """
+        Store the result of a call
+        :param success: False if the call finished with an error
+        :param elapsed: seconds used by the call
+        """
+        failed = not success or elapsed > self.slow_call
+        with self._lock:
+            if self._state == HALF_OPEN:
+                if failed:
+                    self._open()
+                else:
+                    self._state = CLOSED
+                    self._results.clear()
+                return
+            if self._state == OPEN:
+                return
+            self._results.append(failed)
+            if len(self._results) < self.min_calls:
+                return
+            if sum(self._results) / len(self._results) >= self.failure_rate:
+                self._open()
+
+
+class CircuitBreakers:
+    """
+    Registry of the circuit breakers, there is one breaker for each
+    microservice (the *_MICROSERVICE_URL constants), any other URL has a
+    breaker for its host.
+
+    The breakers can be changed with the following app config:
+    - CIRCUIT_BREAKER_WINDOW: number of last calls used to calculate the failure rate
+    - CIRCUIT_BREAKER_MIN_CALLS: min number of calls before open the circuit
+    - CIRCUIT_BREAKER_FAILURE_RATE: failure rate (0-1) that open the circuit
+    - CIRCUIT_BREAKER_SLOW_CALL: seconds after that a call is counted as failure
+    - CIRCUIT_BREAKER_OPEN_SECONDS: seconds that the circuit stay open
+    """
+
+    _lock = threading.Lock()
+    _breakers = {}
+    _config = {}
+
+    @staticmethod
+    def configure(config):
+        """
+        Read the thresholds from the flask config and reset all the breakers
+        :param config: the flask app config (or a dict with the same keys)
+        """
+        with CircuitBreakers._lock:
+            CircuitBreakers._config = {
+                "window": config.get("CIRCUIT_BREAKER_WINDOW", 20),
+                "min_calls": config.get("CIRCUIT_BREAKER_MIN_CALLS", 5),
+                "failure_rate": config.get("CIRCUIT_BREAKER_FAILURE_RATE", 0.5),
+                "slow_call": config.get("CIRCUIT_BREAKER_SLOW_CALL", 5.0),
+                "open_seconds": config.get("CIRCUIT_BREAKER_OPEN_SECONDS", 30),
+            }
+            CircuitBreakers._breakers = {}
+
+    @staticmethod
+    def base_url(url: str) -> str:
+        """
+        Return the base URL of the upstream that serve the url
+        """
+        for base_url in UPSTREAMS.values():
+            if url.startswith(base_url):
+                return base_url
+        parts = urlsplit(url)
+        return "{}://{}".format(parts.scheme, parts.netloc)
+
+    @staticmethod
+    def for_url(url: str) -> CircuitBreaker:
+        """
+        Return the breaker of the upstream that serve the url
+        """
+        base_url = CircuitBreakers.base_url(url)
+        breaker = CircuitBreakers._breakers.get(base_url)
+        if breaker is not None:
+            return breaker
+        with CircuitBreakers._lock:
+            breaker = CircuitBreakers._breakers.get(base_url)
+            if breaker is None:
+                breaker = CircuitBreaker(base_url, **CircuitBreakers._config)
+                CircuitBreakers._breakers[base_url] = breaker
+        return breaker
+
+    @staticmethod
+    def states() -> dict:
+        """
+        Return the state of each breaker, base url -> state
+        """
+        with CircuitBreakers._lock:
+            breakers = dict(CircuitBreakers._breakers)
+        return {name: breaker.state for name, breaker in breakers.items()}
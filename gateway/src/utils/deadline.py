@@ -0,0 +1,124 @@
+import contextvars
+import time
+
+import requests
+from flask import request, g
+
+# Header used to send to the microservices the milliseconds left to the request
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """
+    Raised when the time budget of the request is finished before the call
+    """
+
+
+def request_budget(seconds: float):
+    """
+    Decorator to change the time budget of a view, e.g:
+
+        @home.route("/")
+        @request_budget(5)
+        def index():
+            ...
+
+    :param seconds: total seconds that the view can use to call the microservices
+    """
+
+    def decorator(func):
+        func.request_budget = seconds
+        return func
+
+    return decorator
+
+
+class Deadline:
+    """
+    This class keep the deadline of the incoming flask request, each call
+    to the microservices use as timeout the time left and stop when the
+    time budget is finished.
+
+    The deadline is stored inside a context variable, so it is also
+    available in the threads of the FanOut.
+
+    The budget can be changed with the following app config:
+    - REQUEST_BUDGET: default seconds for each request
+    and for a single view with the decorator request_budget
+    """
+
+    @staticmethod
+    def init_app(app):
+        """
+        Register the hooks that start and stop the deadline of each request
+        """
+
+        @app.before_request
+        def _start_deadline():
+            view = app.view_functions.get(request.endpoint)
+            budget = getattr(view, "request_budget", None)
+            if budget is None:
+                budget = app.config.get("REQUEST_BUDGET")
+            g.deadline_token = Deadline.start(budget)
+
+        @app.teardown_request
+        def _stop_deadline(exc):
+            token = g.pop("deadline_token", None)
+            if token is not None:
+                Deadline.stop(token)
+
+    @staticmethod
+    def start(seconds: float):
+        """
+        Start a new deadline
+        :param seconds: the budget, if None there is no deadline
+        :return the token to stop the deadline
+        """
+        if seconds is None:
+            return _deadline.set(None)
+        return _deadline.set(time.monotonic() + seconds)
+
+    @staticmethod
+    def stop(token):
+        """
+        Restore the deadline that there was before start
+        """
+        _deadline.reset(token)
+
+    @staticmethod
+    def remaining():
+        """
+        :return the seconds left, or None if there is no deadline
+        """
+        deadline = _deadline.get()
+        if deadline is None:
+            return None
+        return deadline - time.monotonic()
+
+    @staticmethod
+    def timeout(default: float = None):
+        """
+        Return the timeout to use for the next call
+        :param default: timeout to use if it is lower than the time left
+        :raise DeadlineExceeded if the time budget is finished
+        """
+        remaining = Deadline.remaining()
+        if remaining is None:
+            return default
+        if remaining <= 0:
+            raise DeadlineExceeded("The time budget of the request is finished")
+        if default is None:
+            return remaining
+        return min(default, remaining)
+
+    @staticmethod
+    def headers() -> dict:
+        """
+        :return the headers to send the time left to the microservices
+        """
+        remaining = Deadline.remaining()
+        if remaining is None:
+            return {}
+        return {DEADLINE_HEADER: str(max(int(remaining * 1000), 0))}
@@ -0,0 +1,135 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from flask import current_app
+
+from src.utils.deadline import Deadline
+
+
+class FanOut:
+    """
+    This class run independent calls to the microservices at the same time
+    with a shared pool of threads, so the latency of a page is the latency
+    of the slowest call and not the sum of all the calls.
+
+    A call that runs inside the pool and makes a fan-out runs the inner
+    calls one after the other in its thread: if it waits other threads of
+    the same pool, all the threads can end up waiting calls still in queue.
+
+    The pool can be changed with the following app config:
+    - FANOUT_MAX_WORKERS: max number of threads used by the fan-out
+    - FANOUT_TIMEOUT: seconds to wait all the calls before give up
+    """
+
+    _lock = threading.Lock()
+    _local = threading.local()
+    _executor = None
+    _max_workers = 16
+    _timeout = 10
+
+    @staticmethod
+    def configure(config):
+        """
+        Read the size of the pool from the flask config
+        :param config: the flask app config (or a dict with the same keys)
+        """
+        with FanOut._lock:
+            FanOut._max_workers = config.get("FANOUT_MAX_WORKERS", 16)
+            FanOut._timeout = config.get("FANOUT_TIMEOUT", 10)
+            executor = FanOut._executor
+            FanOut._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    @staticmethod
+    def _get_executor() -> ThreadPoolExecutor:
+        executor = FanOut._executor
+        if executor is not None:
+            return executor
+        with FanOut._lock:
+            if FanOut._executor is None:
+                FanOut._executor = ThreadPoolExecutor(
+                    max_workers=FanOut._max_workers, thread_name_prefix="fan-out"
+                )
+            return FanOut._executor
+
+    @staticmethod
+    def submit(call, executor: ThreadPoolExecutor = None):
+        """
+        Run the call inside the pool with the app context and the
+        context variables of the caller.
+        :param call: a function without arguments
+        :param executor: the pool where the call runs, by default the fan-out pool
+        :return the future of the call
+        """
+        app = current_app._get_current_object()
+        context = contextvars.copy_context()
+        in_pool = executor is None
+
+        def _run():
+            FanOut._local.worker = in_pool
+            with app.app_context():
+                return context.run(call)
+
+        if executor is None:
+            executor = FanOut._get_executor()
+        return executor.submit(_run)
+
+    @staticmethod
+    def in_worker() -> bool:
+        """
+        :return True if the current thread is a thread of the fan-out pool
+        """
+        return getattr(FanOut._local, "worker", False)
+
+    @staticmethod
+    def run(calls: dict, timeout: float = None) -> dict:
+        """
+        Run all the calls at the same time and wait the result until the deadline
+        :param calls: dict name -> function without arguments
+        :param timeout: seconds to wait all the calls, by default FANOUT_TIMEOUT
+        or the time left to the request if it is lower
+        :return dict name -> result of the call, the result is None if the call
+        raise an exception or it is not finished before the deadline
+        """
+        if FanOut.in_worker():
+            return FanOut._run_inline(calls)
+        if timeout is None:
+            timeout = FanOut._timeout
+        remaining = Deadline.remaining()
+        if remaining is not None:
+            timeout = max(min(timeout, remaining), 0)
+        futures = {name: FanOut.submit(call) for name, call in calls.items()}
+        wait(futures.values(), timeout=timeout)
+        results = {}
+        for name, future in futures.items():
+            if not future.done():
+                future.cancel()
+                current_app.logger.error("Call {} is out of deadline".format(name))
+                results[name] = None
+            elif future.exception() is not None:
+                current_app.logger.error(
+                    "Error during the call {}: {}".format(name, future.exception())
+                )
+                results[name] = None
+            else:
+                results[name] = future.result()
+        return results
+
+    @staticmethod
+    def _run_inline(calls: dict) -> dict:
+        """
+        Run the calls one after the other in the current thread
+        :return dict name -> result of the call, None if the call raise an exception
+        """
+        results = {}
+        for name, call in calls.items():
+            try:
+                results[name] = call()
+            except Exception as ex:
+                current_app.logger.error(
+                    "Error during the call {}: {}".format(name, ex)
+                )
+                results[name] = None
+        return results
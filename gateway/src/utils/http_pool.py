@@ -0,0 +1,161 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.app_constant import (
+    USER_MICROSERVICE_URL,
+    EMAIL_MICROSERVICE_URL,
+    RESTAURANTS_MICROSERVICE_URL,
+    BOOKING_MICROSERVICE_URL,
+)
+
+# Name of the upstream -> base URL used by the services
+UPSTREAMS = {
+    "user": USER_MICROSERVICE_URL,
+    "email": EMAIL_MICROSERVICE_URL,
+    "restaurants": RESTAURANTS_MICROSERVICE_URL,
+    "booking": BOOKING_MICROSERVICE_URL,
+}
+
+DEFAULT_UPSTREAM = "default"
+
+
+class HttpPool:
+    """
+    This class keeps one keep-alive requests.Session for each upstream
+    microservice, so all the calls made by the gateway reuse the
+    connections already open instead of doing a new TCP handshake each time.
+
+    The size of the pools can be changed with the following app config:
+    - HTTP_POOL_CONNECTIONS: number of host pools cached by each session
+    - HTTP_POOL_MAXSIZE: max number of connections kept alive for each host
+    - HTTP_POOL_BLOCK: if True a thread wait a free connection instead of open a new one
+    - HTTP_POOL_SIZES: dict upstream name -> max size, to override HTTP_POOL_MAXSIZE
+    """
+
+    _lock = threading.Lock()
+    _sessions = {}
+    _stats = {}
+    _config = {
+        "pool_connections": 4,
+        "pool_maxsize": 16,
+        "pool_block": False,
+        "sizes": {},
+    }
+
+    @staticmethod
+    def configure(config):
+        """
+        Read the pool size from the flask config and drop the sessions
+        already created, so the new size is used by the next request.
+        :param config: the flask app config (or a dict with the same keys)
+        """
+        with HttpPool._lock:
+            HttpPool._config = {
+                "pool_connections": config.get("HTTP_POOL_CONNECTIONS", 4),
+                "pool_maxsize": config.get("HTTP_POOL_MAXSIZE", 16),
+                "pool_block": config.get("HTTP_POOL_BLOCK", False),
+                "sizes": dict(config.get("HTTP_POOL_SIZES", {})),
+            }
+            sessions = HttpPool._sessions
+            HttpPool._sessions = {}
+        for session in sessions.values():
+            session.close()
+
+    @staticmethod
+    def upstream_of(url: str) -> str:
+        """
+        Return the name of the upstream that serve the url
+        :param url: the URL of the endpoint
+        :return the upstream name, or "default" if the url is not a microservice url
+        """
+        best_name = DEFAULT_UPSTREAM
+        best_len = 0
+        for name, base_url in UPSTREAMS.items():
+            if url.startswith(base_url) and len(base_url) > best_len:
+                best_name = name
+                best_len = len(base_url)
+        return best_name
+
+    @staticmethod
+    def session_for(url: str) -> requests.Session:
+        """
+        Return the shared session of the upstream that serve the url,
+        the session is created the first time that it is requested.
+        :param url: the URL of the endpoint
+        """
+        name = HttpPool.upstream_of(url)
+        session = HttpPool._sessions.get(name)
+        if session is not None:
+            return session
+        with HttpPool._lock:
+            session = HttpPool._sessions.get(name)
+            if session is None:
+                session = HttpPool._build_session(name)
+                HttpPool._sessions[name] = session
+        return session
+
+    @staticmethod
+    def _build_session(name: str) -> requests.Session:
+        config = HttpPool._config
+        adapter = HTTPAdapter(
+            pool_connections=config["pool_connections"],
+            pool_maxsize=config["sizes"].get(name, config["pool_maxsize"]),
+            pool_block=config["pool_block"],
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    @staticmethod
+    def record(url: str, failed: bool = False):
+        """
+        Update the counters of the upstream that serve the url
+        :param url: the URL of the endpoint
+        :param failed: True if the call finished with an error
+        """
+        name = HttpPool.upstream_of(url)
+        with HttpPool._lock:
+            stats = HttpPool._stats.setdefault(name, {"requests": 0, "errors": 0})
+            stats["requests"] += 1
+            if failed:
+                stats["errors"] += 1
+
+    @staticmethod
+    def metrics() -> dict:
+        """
+        Return for each upstream the counters and the status of the
+        connection pools, e.g:
+        {"restaurants": {"requests": 10, "errors": 0, "pool_maxsize": 16,
+                         "pools": [{"host": "ngnix", "connections_opened": 2,
+                                    "requests": 10, "idle": 2}]}}
+        """
+        with HttpPool._lock:
+            sessions = dict(HttpPool._sessions)
+            stats = {name: dict(value) for name, value in HttpPool._stats.items()}
+            config = HttpPool._config
+        result = {}
+        for name in set(sessions.keys()) | set(stats.keys()):
+            entry = stats.get(name, {"requests": 0, "errors": 0})
+            entry["pool_maxsize"] = config["sizes"].get(name, config["pool_maxsize"])
+            entry["pools"] = []
+            session = sessions.get(name)
+            if session is not None:
+                adapter = session.get_adapter("http://")
+                for key in list(adapter.poolmanager.pools.keys()):
+                    pool = adapter.poolmanager.pools.get(key)
+                    if pool is None:
+                        continue
+                    idle = [conn for conn in list(pool.pool.queue) if conn is not None]
+                    entry["pools"].append(
+                        {
+                            "host": pool.host,
+                            "connections_opened": pool.num_connections,
+                            "requests": pool.num_requests,
+                            "idle": len(idle),
+                        }
+                    )
+            result[name] = entry
+        return result
@@ -1,6 +1,24 @@
+import threading
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+
 import requests
 from flask import current_app
 
+from src.utils.http_pool import HttpPool
+from src.utils.circuit_breaker import CircuitBreakers, CircuitOpenError
+from src.utils.deadline import Deadline, DeadlineExceeded
+from src.utils.response_cache import UpstreamCache
+from src.utils.single_flight import SingleFlight
+from src.utils.json_codec import JsonCodec, iter_json_array
+from src.utils.retry import Retries
+from src.utils.load_balancer import LoadBalancer
+from src.utils.metrics import Metrics
+from src.utils.tracing import Tracer
+from src.utils.log_utils import get_logger
+
+log = get_logger("http")
+
 
 class HttpUtils:
     """
@@ -9,34 +27,285 @@ class HttpUtils:
     @author Vincenzo Palazzo v.palazzo1@studenti.unipi.it
     """
 
+    # the identical GET requests in flight share the same upstream call
+    single_flight = SingleFlight()
+
+    @staticmethod
+    def request(method: str, to_url: str, **kwargs):
+        """
+        This method perform the request with the pooled session of the
+        upstream, so the connection is reused between the calls.
+        If the circuit of the upstream is open the request is not made.
+        The timeout is the time left to the incoming request (HTTP_TIMEOUT
+        at most) and it is also sent to the microservice as header.
+        The json body is encoded with JsonCodec.
+        If the upstream has more replicas the request is sent directly to
+        one of them (see LoadBalancer).
+        The call is recorded as a span and the traceparent header is sent.
+        :param method: the HTTP method
+        :param to_url: The URL of the endpoint
+        :return the requests response
+        :raise CircuitOpenError if the circuit of the upstream is open
+        :raise DeadlineExceeded if the time budget of the request is finished
+        """
+        kwargs["timeout"] = Deadline.timeout(
+            kwargs.get("timeout", current_app.config.get("HTTP_TIMEOUT"))
+        )
+        upstream = HttpPool.upstream_of(to_url)
+        route = Retries.route_of(to_url)
+        with Tracer.span(
+            "HTTP {} {}".format(method, route),
+            kind="client",
+            upstream=upstream,
+            url=to_url,
+        ) as span:
+            headers = Deadline.headers()
+            headers.update(Tracer.headers())
+            body = kwargs.pop("json", None)
+            if body is not None:
+                kwargs["data"] = JsonCodec.dumps(body)
+                headers["Content-Type"] = "application/json"
+            if len(headers) > 0:
+                headers.update(kwargs.get("headers") or {})
+                kwargs["headers"] = headers
+            breaker = CircuitBreakers.for_url(to_url)
+            if not breaker.allow_request():
+                raise CircuitOpenError("Circuit open for {}".format(breaker.name))
+            session = HttpPool.session_for(to_url)
+            url, endpoint = LoadBalancer.acquire(to_url)
+            start = time.monotonic()
+            try:
+                response = session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException:
+                elapsed = time.monotonic() - start
+                LoadBalancer.release(to_url, endpoint, failed=True)
+                breaker.record(False, elapsed)
+                HttpPool.record(to_url, failed=True)
+                Metrics.observe_upstream(upstream, route, method, None, elapsed)
+                raise
+            elapsed = time.monotonic() - start
+            failed = response.status_code >= 500
+            LoadBalancer.release(to_url, endpoint, failed=failed)
+            breaker.record(not failed, elapsed)
+            HttpPool.record(to_url, failed=failed)
+            Metrics.observe_upstream(
+                upstream, route, method, response.status_code, elapsed
+            )
+            if span is not None:
+                span.set("status", response.status_code)
+                if endpoint is not None:
+                    span.set("replica", endpoint.base_url)
+            return response
+
+    @staticmethod
+    def _decode(response):
+        """
+        :return the json of the response, decoded with JsonCodec
+        """
+        with Tracer.span("json decode", size=len(response.content)):
+            return JsonCodec.loads(response.content)
+
     @staticmethod
     def make_get_request(to_url: str):
         """
         This method contains the code to make the request
         to a url.
+        The responses of the routes inside UpstreamCache are kept in
+        memory, so the same request is not made until the response expires.
+        When it expires the request is made with the validators of the response
+        (If-None-Match/If-Modified-Since) and if the upstream answers
+        304 Not Modified the response in memory is used again.
+        When more threads ask the same URL at the same time only one request
+        is made and all the threads receive the same json, that must be only read.
+        The GET requests without side effects are retried and hedged (see Retries).
         :param to_url: The URL of the endpoint
         :return the json response or None if there is some error
         """
-        try:
-            current_app.logger.debug("Url is: {}".format(to_url))
-            response = requests.get(to_url, timeout=2000)
-            current_app.logger.debug(
-                "Header Request: {}".format(response.request.headers)
+        is_cached = UpstreamCache.is_cached(to_url)
+        entry = None
+        if is_cached:
+            entry = UpstreamCache.lookup(to_url)
+            if entry is not None and not entry.is_expired():
+                return entry.value
+        if not SingleFlight.can_coalesce(to_url):
+            return HttpUtils._get_json(to_url, is_cached, entry, idempotent=False)
+        return HttpUtils.single_flight.do(
+            "GET {}".format(to_url),
+            lambda: HttpUtils._get_json(to_url, is_cached, entry),
+            timeout=Deadline.remaining(),
+        )
+
+    @staticmethod
+    def _timed_get(to_url: str, headers: dict):
+        """
+        Make one attempt of the GET request and record its latency
+        """
+        start = time.monotonic()
+        response = HttpUtils.request("GET", to_url, headers=headers)
+        if response.status_code < 500:
+            Retries.record_latency(to_url, time.monotonic() - start)
+        return response
+
+    @staticmethod
+    def _hedged_get(to_url: str, headers: dict):
+        """
+        Make the GET request and, if it is slower than the usual latency
+        of the route, make a second request, the first successful response wins.
+        The first attempt runs in the attempts pool of Retries and the second
+        one in its hedge pool, the delay starts when the first attempt is sent
+        :return the requests response
+        """
+        delay = Retries.hedge_delay(to_url)
+        if delay is None:
+            return HttpUtils._timed_get(to_url, headers)
+        started = threading.Event()
+
+        def _first():
+            started.set()
+            return HttpUtils._timed_get(to_url, headers)
+
+        futures = [Retries.submit(_first)]
+        # the time in the queue of the pool is not part of the delay
+        started.wait(Deadline.remaining())
+        done, _ = wait(futures, timeout=delay)
+        if len(done) == 0 and Retries.budget_for(to_url).withdraw():
+            log.debug("Hedged request to {}", to_url)
+            futures.append(
+                Retries.submit(
+                    lambda: HttpUtils._timed_get(to_url, headers), hedge=True
+                )
             )
-        except requests.exceptions.ConnectionError as ex:
-            current_app.logger.error(
-                "Error during the microservice call {}".format(str(ex))
+        response = None
+        error = None
+        while len(futures) > 0:
+            done, pending = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                elif future.result().status_code < 500:
+                    return future.result()
+                else:
+                    response = future.result()
+            futures = list(pending)
+        if response is not None:
+            return response
+        raise error
+
+    @staticmethod
+    def _get_with_retries(to_url: str, headers: dict, idempotent: bool = True):
+        """
+        Make the GET request, if it is idempotent it is hedged and retried
+        after a connection error, a timeout or a 502/503/504, until there
+        are attempts, budget and time left
+        :return the requests response
+        :raise the RequestException of the last attempt
+        """
+        if not idempotent:
+            return HttpUtils.request("GET", to_url, headers=headers)
+        budget = Retries.budget_for(to_url)
+        budget.deposit()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = HttpUtils._hedged_get(to_url, headers)
+                if not Retries.is_retryable_status(response.status_code):
+                    return response
+                error = None
+            except (CircuitOpenError, DeadlineExceeded):
+                raise
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as ex:
+                error = ex
+            backoff = Retries.backoff(attempt)
+            remaining = Deadline.remaining()
+            if (
+                attempt >= Retries.attempts()
+                or (remaining is not None and backoff >= remaining)
+                or not budget.withdraw()
+            ):
+                if error is not None:
+                    raise error
+                return response
+            log.warning("Retry {} of {}", attempt, to_url)
+            time.sleep(backoff)
+
+    @staticmethod
+    def _get_json(to_url: str, is_cached: bool, entry=None, idempotent: bool = True):
+        """
+        This method make the GET request and store the response inside the cache
+        :param to_url: The URL of the endpoint
+        :param is_cached: True if the url is inside UpstreamCache
+        :param entry: the expired CacheEntry of the url, if any
+        :param idempotent: False if the request has side effects, so it is made once
+        :return the json response or None if there is some error
+        """
+        try:
+            log.debug("Url is: {}", to_url)
+            response = HttpUtils._get_with_retries(
+                to_url, UpstreamCache.conditional_headers(entry), idempotent
             )
+            log.debug("Header Request: {}", response.request.headers)
+        except requests.exceptions.RequestException as ex:
+            log.error("Error during the microservice call {}", str(ex))
             return None
 
+        if response.status_code == 304 and entry is not None:
+            log.debug("Response not modified for {}", to_url)
+            UpstreamCache.revalidated(to_url)
+            return entry.value
         if response.ok is False:
-            current_app.logger.error("Error from microservice")
-            current_app.logger.error("Error received {}".format(response.reason))
+            log.error("Error from microservice")
+            log.error("Error received {}", response.reason)
             return None
-        json = response.json()
-        current_app.logger.debug("Response is: {}".format(json))
+        json = HttpUtils._decode(response)
+        log.debug("Response is: {}", json)
+        if is_cached:
+            UpstreamCache.put(
+                to_url,
+                json,
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+            )
         return json
 
+    @staticmethod
+    def make_get_list_stream(to_url: str, chunk_size: int = 64 * 1024):
+        """
+        This method make the GET request of an url that answers with a json
+        array and decode the items while the body is received, so a long list
+        is never all in memory. The response is not cached.
+        The connection is used until the iterator is consumed or closed.
+        If the body can not be read or decoded after the first items, the
+        error is logged and the generator stops, it never raises.
+        :param to_url: The URL of the endpoint
+        :param chunk_size: bytes read from the connection each time
+        :return a generator of the items of the array, or None if there is some error
+        """
+        try:
+            log.debug("Url is: {}", to_url)
+            response = HttpUtils.request("GET", to_url, stream=True)
+        except requests.exceptions.RequestException as ex:
+            log.error("Error during the microservice call {}", str(ex))
+            return None
+        if response.ok is False:
+            log.error("Error from microservice")
+            log.error("Error received {}", response.reason)
+            response.close()
+            return None
+        return HttpUtils._iter_items(response, chunk_size)
+
+    @staticmethod
+    def _iter_items(response, chunk_size: int):
+        try:
+            yield from iter_json_array(response.iter_content(chunk_size))
+        except (requests.exceptions.RequestException, ValueError) as ex:
+            log.error("The list of {} is not complete: {}", response.url, str(ex))
+        finally:
+            response.close()
+
     @staticmethod
     def make_post_request(to_url: str, args):
         """
@@ -47,25 +316,27 @@ class HttpUtils:
         :return the json response or None if there is some error
         """
         try:
-            current_app.logger.debug("Url is: {}".format(to_url))
-            current_app.logger.debug("Body request is: {}".format(args))
-            response = requests.post(url=to_url, json=args, timeout=2000)
-            current_app.logger.debug(
-                "Header Request: {}".format(response.request.headers)
-            )
-        except requests.exceptions.ConnectionError as ex:
-            current_app.logger.error(
-                "Error during the microservice call {}".format(str(ex))
-            )
+            log.debug("Url is: {}", to_url)
+            log.debug("Body request is: {}", args)
+            response = HttpUtils.request("POST", to_url, json=args)
+            log.debug("Header Request: {}", response.request.headers)
+        except CircuitOpenError as ex:
+            log.error(str(ex))
+            return None, 503
+        except DeadlineExceeded as ex:
+            log.error(str(ex))
+            return None, 504
+        except requests.exceptions.RequestException as ex:
+            log.error("Error during the microservice call {}", str(ex))
             return None, 500
 
         if response.ok is False:
-            current_app.logger.error("Error from microservice")
-            current_app.logger.error("Error received {}".format(response.reason))
-            current_app.logger.error("Error content {}".format(response.json()))
+            log.error("Error from microservice")
+            log.error("Error received {}", response.reason)
+            log.error("Error content {}", response.content)
             return None, response.status_code
-        json = response.json()
-        current_app.logger.debug("Response is: {}".format(json))
+        json = HttpUtils._decode(response)
+        log.debug("Response is: {}", json)
         return json, response.status_code
 
     @staticmethod
@@ -78,25 +349,27 @@ class HttpUtils:
         :return the json response or None if there is some error
         """
         try:
-            current_app.logger.debug("Url is: {}".format(to_url))
-            current_app.logger.debug("Body request is: {}".format(args))
-            response = requests.put(url=to_url, json=args, timeout=2000)
-            current_app.logger.debug(
-                "Header Request: {}".format(response.request.headers)
-            )
-        except requests.exceptions.ConnectionError as ex:
-            current_app.logger.error(
-                "Error during the microservice call {}".format(str(ex))
-            )
+            log.debug("Url is: {}", to_url)
+            log.debug("Body request is: {}", args)
+            response = HttpUtils.request("PUT", to_url, json=args)
+            log.debug("Header Request: {}", response.request.headers)
+        except CircuitOpenError as ex:
+            log.error(str(ex))
+            return None, 503
+        except DeadlineExceeded as ex:
+            log.error(str(ex))
+            return None, 504
+        except requests.exceptions.RequestException as ex:
+            log.error("Error during the microservice call {}", str(ex))
             return None, 500
 
         if response.ok is False:
-            current_app.logger.error("Error from microservice")
-            current_app.logger.error("Error received {}".format(response.reason))
-            current_app.logger.error("Error content {}".format(response.json()))
+            log.error("Error from microservice")
+            log.error("Error received {}", response.reason)
+            log.error("Error content {}", response.content)
             return None, response.status_code
-        json = response.json()
-        current_app.logger.debug("Response is: {}".format(json))
+        json = HttpUtils._decode(response)
+        log.debug("Response is: {}", json)
         return json, response.status_code
 
     @staticmethod
@@ -108,24 +381,20 @@ class HttpUtils:
         :return the json response or None if there is some error
         """
         try:
-            current_app.logger.debug("Url is: {}".format(to_url))
-            current_app.logger.debug("Method: DELETE".format(to_url))
-            response = requests.delete(to_url, timeout=2000)
-            current_app.logger.debug(
-                "Header Request: {}".format(response.request.headers)
-            )
-        except requests.exceptions.ConnectionError as ex:
-            current_app.logger.error(
-                "Error during the microservice call {}".format(str(ex))
-            )
+            log.debug("Url is: {}", to_url)
+            log.debug("Method: DELETE", to_url)
+            response = HttpUtils.request("DELETE", to_url)
+            log.debug("Header Request: {}", response.request.headers)
+        except requests.exceptions.RequestException as ex:
+            log.error("Error during the microservice call {}", str(ex))
             return None
 
         if response.ok is False:
-            current_app.logger.error("Error from microservice")
-            current_app.logger.error("Error received {}".format(response.reason))
+            log.error("Error from microservice")
+            log.error("Error received {}", response.reason)
             return None
-        json = response.json()
-        current_app.logger.debug("Response is: {}".format(json))
+        json = HttpUtils._decode(response)
+        log.debug("Response is: {}", json)
         return json
 
     def append_query(url, query, value):
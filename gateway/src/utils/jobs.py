@@ -0,0 +1,148 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils.deadline import Deadline
+from src.utils.fan_out import FanOut
+from src.utils.log_utils import get_logger
+
+log = get_logger("utils.jobs")
+
+# states of a job
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job:
+    """
+    A work that runs in background, the work writes its progress
+    with update and the views read it with to_dict
+    """
+
+    def __init__(self, name: str):
+        self.id = secrets.token_hex(8)
+        self.name = name
+        self.state = QUEUED
+        self.progress = {}
+        self.message = None
+        self.created = time.time()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def update(self, **counters):
+        """
+        Set the counters of the progress, e.g. job.update(contacts_found=3)
+        """
+        with self._lock:
+            self.progress.update(counters)
+
+    def is_finished(self) -> bool:
+        return self.state in (DONE, FAILED)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "id": self.id,
+                "name": self.name,
+                "state": self.state,
+                "progress": dict(self.progress),
+                "message": self.message,
+                "created": self.created,
+                "finished": self.finished,
+            }
+
+
+class Jobs:
+    """
+    This class runs the long works of the views (e.g. the contact tracing
+    of a positive customer) in a local pool of threads, so the view answers
+    at once with the id of the job and its progress is read later.
+    A job has its own time budget instead of the one of the request, and
+    only the last finished jobs are kept in memory.
+
+    The pool can be changed with the following app config:
+    - JOBS_MAX_WORKERS: max number of jobs running at the same time
+    - JOBS_BUDGET: seconds that a job can use to call the microservices
+    - JOBS_KEEP: number of jobs kept in memory
+    """
+
+    _lock = threading.Lock()
+    _executor = None
+    _jobs = OrderedDict()
+    _max_workers = 2
+    _budget = 300
+    _keep = 100
+
+    @staticmethod
+    def configure(config):
+        """
+        Read the size of the pool from the flask config
+        :param config: the flask app config (or a dict with the same keys)
+        """
+        with Jobs._lock:
+            Jobs._max_workers = config.get("JOBS_MAX_WORKERS", 2)
+            Jobs._budget = config.get("JOBS_BUDGET", 300)
+            Jobs._keep = config.get("JOBS_KEEP", 100)
+            executor = Jobs._executor
+            Jobs._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    @staticmethod
+    def _get_executor() -> ThreadPoolExecutor:
+        with Jobs._lock:
+            if Jobs._executor is None:
+                Jobs._executor = ThreadPoolExecutor(
+                    max_workers=Jobs._max_workers, thread_name_prefix="job"
+                )
+            return Jobs._executor
+
+    @staticmethod
+    def submit(name: str, work) -> Job:
+        """
+        Run the work in background with the app context
+        :param name: the name of the job, e.g. mark_positive
+        :param work: function Job -> message of the job, it raises
+        an exception if the job fails
+        :return the Job, its id is used to read it with get
+        """
+        job = Job(name)
+        with Jobs._lock:
+            Jobs._jobs[job.id] = job
+            Jobs._forget_finished()
+
+        def _run():
+            job.state = RUNNING
+            token = Deadline.start(Jobs._budget)
+            try:
+                job.message = work(job)
+                job.state = DONE
+            except Exception as ex:
+                log.error("The job {} {} failed: {}", name, job.id, repr(ex))
+                job.message = str(ex)
+                job.state = FAILED
+            finally:
+                job.finished = time.time()
+                Deadline.stop(token)
+
+        FanOut.submit(_run, Jobs._get_executor())
+        return job
+
+    @staticmethod
+    def _forget_finished():
+        # called with the lock
+        finished = [job_id for job_id, job in Jobs._jobs.items() if job.is_finished()]
+        for job_id in finished[: max(len(finished) - Jobs._keep, 0)]:
+            del Jobs._jobs[job_id]
+
+    @staticmethod
+    def get(job_id: str) -> Job:
+        """
+        :return the job or None if it is not in memory
+        """
+        with Jobs._lock:
+            return Jobs._jobs.get(job_id)
@@ -0,0 +1,150 @@
+import codecs
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _orjson_dumps(obj) -> bytes:
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _json_loads(data):
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode("utf-8")
+    return json.loads(data)
+
+
+def _json_dumps(obj) -> bytes:
+    return json.dumps(obj).encode("utf-8")
+
+
+# backend name -> (loads, dumps)
+BACKENDS = {"json": (_json_loads, _json_dumps)}
+if orjson is not None:
+    BACKENDS["orjson"] = (orjson.loads, _orjson_dumps)
+
+
+class JsonCodec:
+    """
+    This class decode and encode the json bodies of the microservices, by
+    default it use orjson if it is installed otherwise the json module.
+
+    The backend can be changed with the following app config:
+    - JSON_CODEC: name of the backend ("orjson" or "json")
+    """
+
+    backend = "orjson" if orjson is not None else "json"
+    _loads, _dumps = BACKENDS[backend]
+
+    @staticmethod
+    def configure(config):
+        """
+        Read the backend from the flask config, if the backend is not
+        available the json module is used
+        :param config: the flask app config (or a dict with the same keys)
+        """
+        JsonCodec.use(config.get("JSON_CODEC", JsonCodec.backend))
+
+    @staticmethod
+    def use(backend: str, loads=None, dumps=None):
+        """
+        Change the backend
+        :param backend: name of the backend
+        :param loads: function bytes -> object, to register a new backend
+        :param dumps: function object -> bytes, to register a new backend
+        """
+        if loads is not None and dumps is not None:
+            BACKENDS[backend] = (loads, dumps)
+        if backend not in BACKENDS:
+            backend = "json"
+        JsonCodec.backend = backend
+        JsonCodec._loads, JsonCodec._dumps = BACKENDS[backend]
+
+    @staticmethod
+    def loads(data):
+        """
+        :param data: bytes or str with the json
+        :return the python object
+        """
+        return JsonCodec._loads(data)
+
+    @staticmethod
+    def dumps(obj) -> bytes:
+        """
+        :param obj: the python object
+        :return the json as utf-8 bytes
+        """
+        return JsonCodec._dumps(obj)
+
+
+_WHITESPACE = " \t\n\r"
+
+
+def iter_json_array(chunks, decoder: json.JSONDecoder = None):
+    """
+    Decode a json array one item at a time, so the whole body and the
+    whole list are never in memory at the same time
+    :param chunks: iterable of bytes with the json, e.g. response.iter_content()
+    :return a generator of the items of the array
+    :raise ValueError if the json is not an array or it is not valid
+    """
+    decoder = decoder or json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    position = 0
+    finished = False
+    started = False
+
+    def read_more() -> bool:
+        nonlocal buffer, position, finished
+        if finished:
+            return False
+        chunk = next(chunks, None)
+        if chunk is None:
+            finished = True
+            buffer = buffer[position:] + utf8.decode(b"", final=True)
+        else:
+            buffer = buffer[position:] + utf8.decode(chunk)
+        position = 0
+        return True
+
+    while True:
+        while position < len(buffer) and buffer[position] in _WHITESPACE:
+            position += 1
+        if position == len(buffer):
+            if not read_more():
+                raise ValueError("The json array is not complete")
+            continue
+        char = buffer[position]
+        if not started:
+            if char != "[":
+                raise ValueError("The json is not an array")
+            started = True
+            position += 1
+            continue
+        if char == "]":
+            return
+        if char == ",":
+            position += 1
+            continue
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if read_more():
+                continue
+            raise
+        # a number can continue in the next chunk (e.g. "1" of "1.5")
+        if not finished and (
+            end == len(buffer)
+            or (
+                isinstance(item, (int, float)) and buffer[end] not in ",]" + _WHITESPACE
+            )
+        ):
+            read_more()
+            continue
+        position = end
+        yield item
@@ -0,0 +1,165 @@
+import random
+import threading
+import time
+
+from src.utils.http_pool import HttpPool, UPSTREAMS
+
+
+class Endpoint:
+    """
+    A replica of an upstream, with the requests in flight and the
+    consecutive failures used to eject it for a while
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.ejections = 0
+
+    def is_ejected(self, now: float) -> bool:
+        return now < self.ejected_until
+
+
+class EndpointPool:
+    """
+    The replicas of an upstream, each request is sent to the replica with less
+    requests in flight between two replicas chosen at random (power of two
+    choices). A replica that fails eject_failures times in a row is not used
+    for eject_seconds, if all the replicas are ejected all of them are used.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        base_urls: list,
+        eject_failures: int = 3,
+        eject_seconds: float = 10,
+    ):
+        self.name = name
+        self.endpoints = [Endpoint(base_url) for base_url in base_urls]
+        self.eject_failures = eject_failures
+        self.eject_seconds = eject_seconds
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Endpoint:
+        """
+        Choose the endpoint of the next request and count it as in flight,
+        the caller must call release when the request is finished
+        """
+        with self._lock:
+            now = time.monotonic()
+            healthy = [ep for ep in self.endpoints if not ep.is_ejected(now)]
+            if len(healthy) == 0:
+                healthy = self.endpoints
+            if len(healthy) == 1:
+                endpoint = healthy[0]
+            else:
+                first, second = random.sample(healthy, 2)
+                endpoint = first if first.outstanding <= second.outstanding else second
+            endpoint.outstanding += 1
+            return endpoint
+
+    def release(self, endpoint: Endpoint, failed: bool = False):
+        """
+        The request sent to the endpoint is finished
+        :param failed: True if the request finished with a connection error,
+        a timeout or a 5xx status code
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+            if not failed:
+                endpoint.failures = 0
+                return
+            endpoint.failures += 1
+            if endpoint.failures >= self.eject_failures:
+                endpoint.failures = 0
+                endpoint.ejected_until = time.monotonic() + self.eject_seconds
+                endpoint.ejections += 1
+
+    def states(self) -> list:
+        with self._lock:
+            now = time.monotonic()
+            return [
+                {
+                    "endpoint": ep.base_url,
+                    "outstanding": ep.outstanding,
+                    "ejected": ep.is_ejected(now),
+                    "ejections": ep.ejections,
+                }
+                for ep in self.endpoints
+            ]
+
+
+class LoadBalancer:
+    """
+    This class sends the requests of an upstream directly to its replicas,
+    without the hop through nginx. The url of a request is written with the
+    base URL of the upstream (e.g. http://ngnix/restaurants) and it is
+    changed with the base URL of the replica chosen by the EndpointPool.
+    The upstreams without replicas are called with their url.
+
+    The replicas can be changed with the following app config:
+    - UPSTREAM_ENDPOINTS: dict upstream name -> list of base URLs, e.g.
+      {"restaurants": ["http://restaurants_1:5003/restaurants",
+                       "http://restaurants_2:5003/restaurants"]}
+    - LB_EJECT_FAILURES: consecutive failures that eject a replica
+    - LB_EJECT_SECONDS: seconds that a replica stays ejected
+    """
+
+    _pools = {}
+
+    @staticmethod
+    def configure(config):
+        """
+        Read the replicas from the flask config
+        :param config: the flask app config (or a dict with the same keys)
+        """
+        pools = {}
+        for name, base_urls in config.get("UPSTREAM_ENDPOINTS", {}).items():
+            if len(base_urls) == 0:
+                continue
+            pools[name] = EndpointPool(
+                name,
+                base_urls,
+                config.get("LB_EJECT_FAILURES", 3),
+                config.get("LB_EJECT_SECONDS", 10),
+            )
+        LoadBalancer._pools = pools
+
+    @staticmethod
+    def acquire(url: str):
+        """
+        Choose the replica that serve the url
+        :param url: the URL of the endpoint, written with the base URL of the upstream
+        :return tuple (url of the replica, endpoint), the endpoint is None if the
+        upstream has no replicas and in this case the url is not changed
+        """
+        name = HttpPool.upstream_of(url)
+        pool = LoadBalancer._pools.get(name)
+        if pool is None:
+            return url, None
+        endpoint = pool.acquire()
+        return endpoint.base_url + url[len(UPSTREAMS[name]) :], endpoint
+
+    @staticmethod
+    def release(url: str, endpoint: Endpoint, failed: bool = False):
+        """
+        The request sent to the endpoint returned by acquire is finished
+        :param url: the URL of the endpoint passed to acquire
+        :param endpoint: the endpoint returned by acquire, it can be None
+        :param failed: True if the request finished with an error
+        """
+        if endpoint is None:
+            return
+        pool = LoadBalancer._pools.get(HttpPool.upstream_of(url))
+        if pool is not None:
+            pool.release(endpoint, failed)
+
+    @staticmethod
+    def states() -> dict:
+        """
+        :return for each upstream with replicas the state of the replicas
+        """
+        return {name: pool.states() for name, pool in LoadBalancer._pools.items()}
@@ -0,0 +1,122 @@
+import logging
+import random
+from collections.abc import Mapping
+
+from flask import current_app
+
+# the values of these keys are never written inside the logs
+SENSITIVE_KEYS = {"password", "new_password", "token", "authorization", "cookie"}
+REDACTED = "***"
+
+
+def redact(value):
+    """
+    Return a copy of the value where the sensitive keys of the dicts
+    (also inside lists and nested dicts) are replaced with ***
+    """
+    if isinstance(value, Mapping):
+        return {
+            key: REDACTED if str(key).lower() in SENSITIVE_KEYS else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+
+class LazyMessage:
+    """
+    A log message that is formatted only when the record is emitted,
+    so if the level is disabled the values are never converted to string.
+    """
+
+    __slots__ = ("fmt", "args", "fields")
+
+    def __init__(self, fmt: str, args: tuple, fields: dict):
+        self.fmt = fmt
+        self.args = args
+        self.fields = fields
+
+    def __str__(self):
+        if not isinstance(self.fmt, str):
+            message = str(redact(self.fmt))
+        else:
+            message = self.fmt
+        if len(self.args) > 0:
+            message = message.format(*[redact(arg) for arg in self.args])
+        if len(self.fields) > 0:
+            message = "{} {}".format(
+                message,
+                " ".join(
+                    "{}={}".format(
+                        key,
+                        REDACTED if key.lower() in SENSITIVE_KEYS else redact(value),
+                    )
+                    for key, value in self.fields.items()
+                ),
+            )
+        return message
+
+
+class StructuredLogger:
+    """
+    Logger of the gateway, it is a child of the flask app logger and it
+    works with the "{}" placeholders:
+
+        log = get_logger("http")
+        log.debug("Response is: {}", json, url=to_url)
+
+    - the message is formatted only when it is emitted
+    - the sensitive keys (e.g. password) inside the values are redacted
+    - the debug and info messages can be sampled with the app config
+      LOG_SAMPLING: dict logger name -> rate (0-1), e.g. {"http": 0.1}
+    """
+
+    _sampling = {}
+
+    def __init__(self, name: str):
+        self.name = name
+
+    @staticmethod
+    def configure(config):
+        """
+        Read the sampling rates from the flask config
+        :param config: the flask app config (or a dict with the same keys)
+        """
+        StructuredLogger._sampling = dict(config.get("LOG_SAMPLING", {}))
+
+    @property
+    def logger(self) -> logging.Logger:
+        return current_app.logger.getChild(self.name)
+
+    def _sampled(self) -> bool:
+        rate = StructuredLogger._sampling.get(self.name, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+    def _log(self, level: int, fmt: str, args: tuple, fields: dict, sampled: bool):
+        logger = self.logger
+        if not logger.isEnabledFor(level):
+            return
+        if sampled and not self._sampled():
+            return
+        logger.log(level, LazyMessage(fmt, args, fields))
+
+    def debug(self, fmt: str, *args, **fields):
+        self._log(logging.DEBUG, fmt, args, fields, True)
+
+    def info(self, fmt: str, *args, **fields):
+        self._log(logging.INFO, fmt, args, fields, True)
+
+    def warning(self, fmt: str, *args, **fields):
+        self._log(logging.WARNING, fmt, args, fields, False)
+
+    def error(self, fmt: str, *args, **fields):
+        self._log(logging.ERROR, fmt, args, fields, False)
+
+
+def get_logger(name: str) -> StructuredLogger:
+    """
+    :param name: name of the logger, it is used also for the sampling rate
+    :return the StructuredLogger with the name
+    """
+    return StructuredLogger(name)
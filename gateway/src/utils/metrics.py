@@ -0,0 +1,307 @@
+import bisect
+import threading
+import time
+
+from flask import g, request
+
+from src.utils.circuit_breaker import CircuitBreakers, OPEN, HALF_OPEN
+from src.utils.http_pool import HttpPool
+from src.utils.load_balancer import LoadBalancer
+from src.utils.response_cache import UpstreamCache
+
+# upper bounds in seconds of the buckets of the latency histograms
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+# number of shards of a histogram, the threads are spread among them
+STRIPES = 16
+
+
+class _Shard:
+    """
+    The counters of a histogram written by a part of the threads
+    """
+
+    __slots__ = ("counts", "sum", "errors", "lock")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+
+class Histogram:
+    """
+    A latency histogram with a counter of the errors.
+    The counters are split in a fixed number of shards, each thread writes
+    the shard of its id, so the threads rarely wait the same lock and the
+    memory does not grow with the threads. The shards are summed by collect.
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS, stripes: int = STRIPES):
+        self.buckets = tuple(buckets)
+        self._shards = tuple(
+            _Shard(len(self.buckets) + 1) for _ in range(max(stripes, 1))
+        )
+
+    def _shard(self) -> _Shard:
+        # the ids are addresses aligned to the pages, the higher bits are mixed
+        ident = threading.get_ident()
+        return self._shards[(ident ^ ident >> 12 ^ ident >> 24) % len(self._shards)]
+
+    def observe(self, seconds: float, error: bool = False):
+        index = bisect.bisect_left(self.buckets, seconds)
+        shard = self._shard()
+        with shard.lock:
+            shard.counts[index] += 1
+            shard.sum += seconds
+            if error:
+                shard.errors += 1
+
+    def collect(self) -> dict:
+        """
+        :return dict with the cumulative count of each bucket (the last one is +Inf),
+        the count, the sum and the errors of all the observations
+        """
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+        errors = 0
+        for shard in self._shards:
+            with shard.lock:
+                for index, value in enumerate(shard.counts):
+                    counts[index] += value
+                total += shard.sum
+                errors += shard.errors
+        cumulative = []
+        running = 0
+        for value in counts:
+            running += value
+            cumulative.append(running)
+        return {
+            "buckets": cumulative,
+            "count": running,
+            "sum": total,
+            "errors": errors,
+        }
+
+
+def _labels(labels: dict) -> str:
+    return ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels.items()
+    )
+
+
+class Metrics:
+    """
+    This class keeps the latency histograms of the flask views and of the
+    calls to the microservices, and writes them with the gauges of the
+    HTTP layer (pools, cache, circuit breakers, replicas) in the
+    Prometheus text format, served by the /metrics view.
+    """
+
+    _lock = threading.Lock()
+    _views = {}
+    _upstreams = {}
+
+    @staticmethod
+    def init_app(app):
+        """
+        Register the hooks that measure each request of the app
+        """
+
+        @app.before_request
+        def _start_timer():
+            g.metrics_start = time.perf_counter()
+
+        @app.after_request
+        def _read_status(response):
+            g.metrics_status = response.status_code
+            return response
+
+        @app.teardown_request
+        def _observe_request(exc):
+            start = g.pop("metrics_start", None)
+            if start is None:
+                return
+            status = g.pop("metrics_status", None)
+            if exc is not None or status is None:
+                status = 500
+            Metrics.observe_view(
+                request.endpoint or "not_found",
+                request.method,
+                status,
+                time.perf_counter() - start,
+            )
+
+    @staticmethod
+    def _histogram(histograms: dict, key: tuple) -> Histogram:
+        histogram = histograms.get(key)
+        if histogram is None:
+            with Metrics._lock:
+                histogram = histograms.setdefault(key, Histogram())
+        return histogram
+
+    @staticmethod
+    def observe_view(endpoint: str, method: str, status: int, seconds: float):
+        """
+        :param endpoint: the flask endpoint of the view (e.g. home.index)
+        :param status: the status code of the response
+        """
+        Metrics._histogram(Metrics._views, (endpoint, method)).observe(
+            seconds, status >= 500
+        )
+
+    @staticmethod
+    def observe_upstream(
+        upstream: str, route: str, method: str, status: int, seconds: float
+    ):
+        """
+        :param upstream: the name of the microservice (see HttpPool.upstream_of)
+        :param route: the name of the route (see Retries.route_of)
+        :param status: the status code of the response, None if there is no response
+        """
+        Metrics._histogram(Metrics._upstreams, (upstream, route, method)).observe(
+            seconds, status is None or status >= 500
+        )
+
+    @staticmethod
+    def reset():
+        with Metrics._lock:
+            Metrics._views = {}
+            Metrics._upstreams = {}
+
+    @staticmethod
+    def _write_histograms(
+        lines: list, name: str, description: str, histograms: dict, keys: tuple
+    ):
+        lines.append("# HELP {}_seconds {}".format(name, description))
+        lines.append("# TYPE {}_seconds histogram".format(name))
+        errors = []
+        for key, histogram in sorted(histograms.items()):
+            labels = dict(zip(keys, key))
+            data = histogram.collect()
+            for bound, count in zip(histogram.buckets + ("+Inf",), data["buckets"]):
+                lines.append(
+                    "{}_seconds_bucket{{{}}} {}".format(
+                        name, _labels(dict(labels, le=bound)), count
+                    )
+                )
+            lines.append(
+                "{}_seconds_sum{{{}}} {}".format(name, _labels(labels), data["sum"])
+            )
+            lines.append(
+                "{}_seconds_count{{{}}} {}".format(name, _labels(labels), data["count"])
+            )
+            errors.append((labels, data["errors"]))
+        lines.append("# TYPE {}_errors_total counter".format(name))
+        for labels, value in errors:
+            lines.append(
+                "{}_errors_total{{{}}} {}".format(name, _labels(labels), value)
+            )
+
+    @staticmethod
+    def _write_gauges(lines: list, name: str, kind: str, samples: list):
+        lines.append("# TYPE {} {}".format(name, kind))
+        for labels, value in samples:
+            if len(labels) == 0:
+                lines.append("{} {}".format(name, value))
+            else:
+                lines.append("{}{{{}}} {}".format(name, _labels(labels), value))
+
+    @staticmethod
+    def render() -> str:
+        """
+        :return all the metrics in the Prometheus text format
+        """
+        # HttpUtils imports this module to record the calls
+        from src.utils.http_utils import HttpUtils
+
+        lines = []
+        Metrics._write_histograms(
+            lines,
+            "gateway_view_request",
+            "Latency of the flask views",
+            dict(Metrics._views),
+            ("endpoint", "method"),
+        )
+        Metrics._write_histograms(
+            lines,
+            "gateway_upstream_request",
+            "Latency of the calls to the microservices",
+            dict(Metrics._upstreams),
+            ("upstream", "route", "method"),
+        )
+
+        pools = HttpPool.metrics()
+        Metrics._write_gauges(
+            lines,
+            "gateway_upstream_pool_maxsize",
+            "gauge",
+            [
+                ({"upstream": name}, pool["pool_maxsize"])
+                for name, pool in pools.items()
+            ],
+        )
+        for field in ("connections_opened", "idle"):
+            Metrics._write_gauges(
+                lines,
+                "gateway_upstream_pool_{}".format(field),
+                "gauge",
+                [
+                    ({"upstream": name, "host": host["host"]}, host[field])
+                    for name, pool in pools.items()
+                    for host in pool["pools"]
+                ],
+            )
+
+        cache = UpstreamCache.stats()
+        for field in ("hits", "misses", "evictions", "revalidations"):
+            Metrics._write_gauges(
+                lines,
+                "gateway_cache_{}_total".format(field),
+                "counter",
+                [({}, cache[field])],
+            )
+        for field in ("size", "hit_ratio"):
+            Metrics._write_gauges(
+                lines, "gateway_cache_{}".format(field), "gauge", [({}, cache[field])]
+            )
+
+        single_flight = HttpUtils.single_flight.stats()
+        Metrics._write_gauges(
+            lines,
+            "gateway_coalesced_requests_total",
+            "counter",
+            [({}, single_flight["followers"])],
+        )
+
+        # 0 closed, 1 half open, 2 open
+        state_value = {HALF_OPEN: 1, OPEN: 2}
+        Metrics._write_gauges(
+            lines,
+            "gateway_circuit_state",
+            "gauge",
+            [
+                ({"upstream": name}, state_value.get(state, 0))
+                for name, state in CircuitBreakers.states().items()
+            ],
+        )
+
+        replicas = LoadBalancer.states()
+        for field in ("outstanding", "ejected"):
+            Metrics._write_gauges(
+                lines,
+                "gateway_replica_{}".format(field),
+                "gauge",
+                [
+                    (
+                        {"upstream": name, "endpoint": state["endpoint"]},
+                        int(state[field]),
+                    )
+                    for name, states in replicas.items()
+                    for state in states
+                ],
+            )
+        return "\n".join(lines) + "\n"
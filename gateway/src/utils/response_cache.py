@@ -0,0 +1,313 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from src.app_constant import RESTAURANTS_MICROSERVICE_URL
+
+# route name -> regex of the URL, the routes that are not here are never cached
+CACHED_ROUTES = {
+    "restaurants": r"^{}$",
+    "restaurant": r"^{}/(?P<restaurant_id>\d+)$",
+    "menu": r"^{}/(?P<restaurant_id>\d+)/menu$",
+    "dishes": r"^{}/(?P<restaurant_id>\d+)/dishes$",
+    "photos": r"^{}/(?P<restaurant_id>\d+)/photos$",
+    "openings": r"^{}/(?P<restaurant_id>\d+)/openings$",
+    "name": r"^{}/(?P<restaurant_id>\d+)/name$",
+}
+
+# route name -> seconds that a response is valid
+DEFAULT_TTL = {
+    "restaurants": 30,
+    "restaurant": 60,
+    "menu": 300,
+    "dishes": 60,
+    "photos": 60,
+    "openings": 300,
+    "name": 300,
+}
+
+
+class CacheEntry:
+    """
+    One response inside the cache, with the validators (ETag and
+    Last-Modified) of the response to revalidate it when it is expired
+    """
+
+    def __init__(
+        self,
+        value,
+        expires_at: float,
+        route: str = None,
+        tag=None,
+        etag: str = None,
+        last_modified: str = None,
+    ):
+        self.value = value
+        self.expires_at = expires_at
+        self.route = route
+        self.tag = tag
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def has_validators(self) -> bool:
+        return self.etag is not None or self.last_modified is not None
+
+    def is_expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+
+class ResponseCache:
+    """
+    A thread safe cache with a time to live for each entry and a max
+    number of entries, when it is full the least recently used entry is removed.
+    An expired entry with validators is kept until it is removed by the LRU,
+    so it can be revalidated.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revalidations = 0
+
+    def get_entry(self, key):
+        """
+        :return the entry of the key, also if it is expired (in this case
+        it is counted as miss), or None if it is missing
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.is_expired():
+                self.misses += 1
+                if not entry.has_validators():
+                    del self._entries[key]
+                    return None
+            else:
+                self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+    def get(self, key):
+        """
+        :return the value of the key or None if it is missing or expired
+        """
+        entry = self.get_entry(key)
+        if entry is None or entry.is_expired():
+            return None
+        return entry.value
+
+    def refresh(self, key, ttl: float) -> bool:
+        """
+        The entry is still valid (e.g. the upstream answered 304 Not Modified),
+        so it is valid for other ttl seconds
+        :return False if the entry is not inside the cache anymore
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            entry.expires_at = time.monotonic() + ttl
+            self.revalidations += 1
+            return True
+
+    def set(
+        self,
+        key,
+        value,
+        ttl: float,
+        route: str = None,
+        tag=None,
+        etag: str = None,
+        last_modified: str = None,
+    ):
+        """
+        Store the value of the key for ttl seconds
+        :param route: name of the route of the key, used to invalidate
+        :param tag: a value used to invalidate (e.g the restaurant id)
+        :param etag: the ETag header of the response
+        :param last_modified: the Last-Modified header of the response
+        """
+        entry = CacheEntry(
+            value, time.monotonic() + ttl, route, tag, etag, last_modified
+        )
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, predicate) -> int:
+        """
+        Remove all the entries where predicate(key, entry) is True
+        :return the number of entries removed
+        """
+        with self._lock:
+            keys = [
+                key for key, entry in self._entries.items() if predicate(key, entry)
+            ]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.revalidations = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "revalidations": self.revalidations,
+                "hit_ratio": self.hits / total if total > 0 else 0,
+            }
+
+
+class UpstreamCache:
+    """
+    This class is the cache of the GET requests to the microservices,
+    only the routes inside CACHED_ROUTES are cached.
+    The values inside the cache are shared, so they must be only read.
+
+    The cache can be changed with the following app config:
+    - RESPONSE_CACHE_SIZE: max number of responses inside the cache
+    - RESPONSE_CACHE_TTL: dict route name -> seconds, a route with 0 is not cached
+    """
+
+    _cache = ResponseCache()
+    _ttl = dict(DEFAULT_TTL)
+    _routes = [
+        (name, re.compile(regex.format(re.escape(RESTAURANTS_MICROSERVICE_URL))))
+        for name, regex in CACHED_ROUTES.items()
+    ]
+
+    @staticmethod
+    def configure(config):
+        """
+        Read the size and the ttl from the flask config and clear the cache
+        :param config: the flask app config (or a dict with the same keys)
+        """
+        ttl = dict(DEFAULT_TTL)
+        ttl.update(config.get("RESPONSE_CACHE_TTL", {}))
+        UpstreamCache._ttl = ttl
+        UpstreamCache._cache = ResponseCache(config.get("RESPONSE_CACHE_SIZE", 1024))
+
+    @staticmethod
+    def route_of(url: str):
+        """
+        :return tuple (route name, restaurant id) or (None, None) if the url is not cached
+        """
+        for name, regex in UpstreamCache._routes:
+            match = regex.match(url)
+            if match is not None:
+                restaurant_id = match.groupdict().get("restaurant_id")
+                return name, int(restaurant_id) if restaurant_id else None
+        return None, None
+
+    @staticmethod
+    def is_cached(url: str) -> bool:
+        """
+        :return True if the responses of the url are stored inside the cache
+        """
+        route, _ = UpstreamCache.route_of(url)
+        return route is not None and UpstreamCache._ttl.get(route, 0) > 0
+
+    @staticmethod
+    def get(url: str):
+        """
+        :return the json response of the url or None
+        """
+        return UpstreamCache._cache.get(url)
+
+    @staticmethod
+    def lookup(url: str):
+        """
+        :return the CacheEntry of the url, also if it is expired, or None
+        """
+        return UpstreamCache._cache.get_entry(url)
+
+    @staticmethod
+    def conditional_headers(entry: CacheEntry) -> dict:
+        """
+        :return the headers to make a conditional request with the validators
+        of the entry, so the upstream can answer 304 if nothing is changed
+        """
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.etag is not None:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified is not None:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    @staticmethod
+    def put(url: str, json, etag: str = None, last_modified: str = None):
+        """
+        Store the json response of the url, if the url is not cached nothing happens
+        :param etag: the ETag header of the response
+        :param last_modified: the Last-Modified header of the response
+        """
+        route, restaurant_id = UpstreamCache.route_of(url)
+        ttl = UpstreamCache._ttl.get(route, 0)
+        if route is None or ttl <= 0:
+            return
+        UpstreamCache._cache.set(
+            url, json, ttl, route, restaurant_id, etag, last_modified
+        )
+
+    @staticmethod
+    def revalidated(url: str) -> bool:
+        """
+        The upstream answered 304 Not Modified, so the response of the url
+        is valid for another ttl
+        """
+        route, _ = UpstreamCache.route_of(url)
+        return UpstreamCache._cache.refresh(url, UpstreamCache._ttl.get(route, 0))
+
+    @staticmethod
+    def invalidate_restaurant(restaurant_id) -> int:
+        """
+        Remove all the responses about the restaurant and the list of restaurants
+        :return the number of responses removed
+        """
+        try:
+            restaurant_id = int(restaurant_id)
+        except (TypeError, ValueError):
+            restaurant_id = None
+        return UpstreamCache._cache.invalidate(
+            lambda key, entry: entry.tag == restaurant_id
+            or entry.route == "restaurants"
+        )
+
+    @staticmethod
+    def invalidate_route(route: str) -> int:
+        """
+        Remove all the responses of the route (e.g. "dishes")
+        :return the number of responses removed
+        """
+        return UpstreamCache._cache.invalidate(lambda key, entry: entry.route == route)
+
+    @staticmethod
+    def clear():
+        UpstreamCache._cache.clear()
+
+    @staticmethod
+    def stats() -> dict:
+        return UpstreamCache._cache.stats()
@@ -0,0 +1,244 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils.fan_out import FanOut
+from src.utils.http_pool import HttpPool
+from src.utils.response_cache import UpstreamCache
+
+# status codes of a replica that is not able to answer now, the GET can be retried
+RETRYABLE_STATUS = {502, 503, 504}
+
+
+class RetryBudget:
+    """
+    A token bucket that limits the extra requests (retries and hedges)
+    sent to an upstream: each request deposit ratio tokens, each extra
+    request withdraw one token, and min_per_second tokens are added each
+    second, so the extra load is at most ratio of the traffic plus min_per_second.
+    """
+
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 1.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = max(min_per_second * 10, 1.0)
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._last) * self.min_per_second
+        )
+        self._last = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """
+        :return True if an extra request can be made
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class LatencyTracker:
+    """
+    The latency of the last responses of a route, used to choose
+    after how much time a request is hedged
+    """
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percentile: float, min_samples: int = 1):
+        """
+        :return the latency in seconds of the percentile (0-100),
+        or None if there are less than min_samples latencies
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) == 0 or len(samples) < min_samples:
+            return None
+        index = min(int(len(samples) * percentile / 100), len(samples) - 1)
+        return samples[index]
+
+
+class Retries:
+    """
+    This class contains the policy of the retries and of the hedged
+    requests of the idempotent GET requests.
+    A retry is made after a connection error, a timeout or a 502/503/504,
+    waiting a random time up to an exponential backoff.
+    A hedged request is a second request made when the first one is slower
+    than a percentile of the latency of the route, the first successful
+    response wins.
+    The retries and the hedged requests of an upstream are limited by its RetryBudget.
+
+    The policy can be changed with the following app config:
+    - RETRY_ATTEMPTS: max number of attempts of a GET request (1 disable the retries)
+    - RETRY_BACKOFF: seconds of the backoff after the first attempt, it doubles each attempt
+    - RETRY_BACKOFF_MAX: max seconds of the backoff
+    - RETRY_BUDGET_RATIO: extra requests allowed for each request of an upstream
+    - RETRY_BUDGET_MIN: extra requests allowed each second, also without traffic
+    - HEDGE_UPSTREAMS: list of upstream names where the GET requests are hedged
+    - HEDGE_PERCENTILE: percentile of the latency after that a request is hedged
+    - HEDGE_MIN_SAMPLES: latencies needed before the first hedged request
+    - HEDGE_MAX_WORKERS: max number of threads used by the hedged requests
+    - HEDGE_ATTEMPT_WORKERS: max number of threads used by the first attempts
+    of the requests that can be hedged
+    """
+
+    _lock = threading.Lock()
+    # pool name ("attempt" or "hedge") -> ThreadPoolExecutor
+    _executors = {}
+    _budgets = {}
+    _latencies = {}
+    _config = {
+        "attempts": 3,
+        "backoff": 0.05,
+        "backoff_max": 1.0,
+        "budget_ratio": 0.1,
+        "budget_min": 1.0,
+        "hedge_upstreams": [],
+        "hedge_percentile": 95,
+        "hedge_min_samples": 20,
+        "hedge_workers": 8,
+        "attempt_workers": 32,
+    }
+
+    @staticmethod
+    def configure(config):
+        """
+        Read the policy from the flask config and reset the budgets and the latencies
+        :param config: the flask app config (or a dict with the same keys)
+        """
+        with Retries._lock:
+            Retries._config = {
+                "attempts": max(config.get("RETRY_ATTEMPTS", 3), 1),
+                "backoff": config.get("RETRY_BACKOFF", 0.05),
+                "backoff_max": config.get("RETRY_BACKOFF_MAX", 1.0),
+                "budget_ratio": config.get("RETRY_BUDGET_RATIO", 0.1),
+                "budget_min": config.get("RETRY_BUDGET_MIN", 1.0),
+                "hedge_upstreams": list(config.get("HEDGE_UPSTREAMS", [])),
+                "hedge_percentile": config.get("HEDGE_PERCENTILE", 95),
+                "hedge_min_samples": config.get("HEDGE_MIN_SAMPLES", 20),
+                "hedge_workers": config.get("HEDGE_MAX_WORKERS", 8),
+                "attempt_workers": config.get("HEDGE_ATTEMPT_WORKERS", 32),
+            }
+            Retries._budgets = {}
+            Retries._latencies = {}
+            executors = Retries._executors
+            Retries._executors = {}
+        for executor in executors.values():
+            executor.shutdown(wait=False)
+
+    @staticmethod
+    def attempts() -> int:
+        return Retries._config["attempts"]
+
+    @staticmethod
+    def budget_for(url: str) -> RetryBudget:
+        """
+        :return the RetryBudget of the upstream that serve the url
+        """
+        name = HttpPool.upstream_of(url)
+        budget = Retries._budgets.get(name)
+        if budget is not None:
+            return budget
+        with Retries._lock:
+            budget = Retries._budgets.get(name)
+            if budget is None:
+                budget = RetryBudget(
+                    Retries._config["budget_ratio"], Retries._config["budget_min"]
+                )
+                Retries._budgets[name] = budget
+        return budget
+
+    @staticmethod
+    def route_of(url: str) -> str:
+        """
+        :return the name used to group the latencies of the url, the route
+        of UpstreamCache or the upstream name for the other urls
+        """
+        route, _ = UpstreamCache.route_of(url)
+        if route is not None:
+            return route
+        return HttpPool.upstream_of(url)
+
+    @staticmethod
+    def record_latency(url: str, seconds: float):
+        route = Retries.route_of(url)
+        tracker = Retries._latencies.get(route)
+        if tracker is None:
+            with Retries._lock:
+                tracker = Retries._latencies.setdefault(route, LatencyTracker())
+        tracker.record(seconds)
+
+    @staticmethod
+    def hedge_delay(url: str):
+        """
+        :return the seconds to wait before hedging the request of the url,
+        or None if the request must not be hedged
+        """
+        config = Retries._config
+        if HttpPool.upstream_of(url) not in config["hedge_upstreams"]:
+            return None
+        tracker = Retries._latencies.get(Retries.route_of(url))
+        if tracker is None:
+            return None
+        return tracker.percentile(
+            config["hedge_percentile"], config["hedge_min_samples"]
+        )
+
+    @staticmethod
+    def submit(call, hedge: bool = False):
+        """
+        Run an attempt of a hedged request inside its own pool, the first
+        attempts and the hedges have two pools, so the hedges do not wait
+        the first attempts and no attempt waits the threads of the fan-out
+        :param call: a function without arguments
+        :param hedge: True for the second attempt of the request
+        :return the future of the call
+        """
+        name = "hedge" if hedge else "attempt"
+        executor = Retries._executors.get(name)
+        if executor is None:
+            with Retries._lock:
+                executor = Retries._executors.get(name)
+                if executor is None:
+                    executor = ThreadPoolExecutor(
+                        max_workers=Retries._config[name + "_workers"],
+                        thread_name_prefix=name,
+                    )
+                    Retries._executors[name] = executor
+        return FanOut.submit(call, executor)
+
+    @staticmethod
+    def backoff(attempt: int) -> float:
+        """
+        :param attempt: number of attempts already made (1 after the first one)
+        :return the seconds to wait before the next attempt, with full jitter
+        """
+        config = Retries._config
+        limit = min(config["backoff_max"], config["backoff"] * 2 ** (attempt - 1))
+        return random.uniform(0, limit)
+
+    @staticmethod
+    def is_retryable_status(status_code: int) -> bool:
+        return status_code in RETRYABLE_STATUS
@@ -0,0 +1,88 @@
+import re
+import threading
+
+# GET routes that change something on the microservices, they are never coalesced
+NOT_COALESCED_ROUTES = [
+    re.compile(r"/mark/"),
+    re.compile(r"/checkin$"),
+    re.compile(r"/calculate_rating"),
+]
+
+
+class _Call:
+    """
+    A call in flight, the followers wait the event and read the result
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    This class make sure that for each key there is only one call in flight,
+    the threads that ask the same key while the call is in flight wait
+    and share the result of the first one.
+    The result is shared, so it must be only read.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.followers = 0
+
+    @staticmethod
+    def can_coalesce(url: str) -> bool:
+        """
+        :return False if the GET request of the url has side effects
+        """
+        path = url.split("?")[0]
+        return not any(regex.search(path) for regex in NOT_COALESCED_ROUTES)
+
+    def do(self, key, func, timeout: float = None):
+        """
+        Call func, or wait the result of the call with the same key in flight
+        :param key: the key of the call (e.g. method and url)
+        :param func: function without arguments
+        :param timeout: max seconds that a follower wait the result
+        :return the result of func, or None if the follower wait more than timeout
+        :raise the exception raised by func
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            if not call.event.wait(timeout):
+                return None
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as ex:
+            call.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "followers": self.followers,
+            }
@@ -0,0 +1,287 @@
+import contextvars
+import functools
+import re
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import g, request
+from jinja2 import Template
+
+from src.utils.json_codec import JsonCodec
+
+TRACEPARENT_HEADER = "traceparent"
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+# the span of the code that is running now
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    A timed operation of a trace, e.g. a flask request, a service method,
+    a call to a microservice or the render of a template
+    """
+
+    __slots__ = (
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "attributes",
+        "start",
+        "duration",
+        "_started",
+    )
+
+    def __init__(self, name: str, trace_id: str = None, parent_id: str = None):
+        self.name = name
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = {}
+        self.start = time.time()
+        self.duration = None
+        self._started = time.perf_counter()
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._started
+
+    def traceparent(self) -> str:
+        """
+        :return the W3C traceparent header of the span
+        """
+        return "00-{}-{}-01".format(self.trace_id, self.span_id)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration": self.duration,
+            "attributes": self.attributes,
+        }
+
+
+class MemoryExporter:
+    """
+    Keep the last finished spans in memory
+    """
+
+    def __init__(self, size: int = 1000):
+        self._spans = deque(maxlen=size)
+
+    def export(self, span: Span):
+        self._spans.append(span.to_dict())
+
+    def spans(self, trace_id: str = None) -> list:
+        """
+        :return the spans of the trace, or all the spans
+        """
+        spans = list(self._spans)
+        if trace_id is None:
+            return spans
+        return [span for span in spans if span["trace_id"] == trace_id]
+
+    def clear(self):
+        self._spans.clear()
+
+
+class FileExporter:
+    """
+    Append the finished spans to a file, one json for each line
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        line = JsonCodec.dumps(span.to_dict()) + b"\n"
+        with self._lock:
+            with open(self.path, "ab") as file:
+                file.write(line)
+
+
+class TracedTemplate(Template):
+    """
+    A jinja template that records a span each time it is rendered
+    """
+
+    def render(self, *args, **kwargs):
+        with Tracer.span("render {}".format(self.name), kind="template"):
+            return super().render(*args, **kwargs)
+
+
+class Tracer:
+    """
+    This class opens a trace for each request of the gateway, the service
+    methods (see traced), the calls to the microservices, the decode of
+    their json and the render of the templates are recorded as child spans.
+    The current span is inside a context variable, so it is also available
+    in the threads of the FanOut, and it is sent to the microservices with
+    the W3C traceparent header.
+
+    The spans can be exported with the following app config:
+    - TRACE_EXPORTER: "memory", "file" or None to disable the tracing
+    - TRACE_FILE: the file used by the "file" exporter
+    - TRACE_MEMORY_SIZE: number of spans kept by the "memory" exporter
+    """
+
+    _exporter = None
+
+    @staticmethod
+    def configure(config):
+        """
+        Create the exporter from the flask config
+        :param config: the flask app config (or a dict with the same keys)
+        """
+        exporter = config.get("TRACE_EXPORTER")
+        if exporter == "memory":
+            Tracer._exporter = MemoryExporter(config.get("TRACE_MEMORY_SIZE", 1000))
+        elif exporter == "file":
+            Tracer._exporter = FileExporter(config.get("TRACE_FILE", "traces.jsonl"))
+        else:
+            Tracer._exporter = None
+
+    @staticmethod
+    def init_app(app):
+        """
+        Read the config and register the hooks that open and close the
+        trace of each request and trace the render of the templates
+        """
+        Tracer.configure(app.config)
+        app.jinja_env.template_class = TracedTemplate
+
+        @app.before_request
+        def _start_trace():
+            if Tracer._exporter is None:
+                return
+            trace_id, parent_id = Tracer.parse_traceparent(
+                request.headers.get(TRACEPARENT_HEADER)
+            )
+            span = Span(
+                "{} {}".format(request.method, request.path), trace_id, parent_id
+            )
+            span.set("kind", "server")
+            span.set("endpoint", request.endpoint)
+            g.trace_span = span
+            g.trace_token = _current_span.set(span)
+
+        @app.after_request
+        def _trace_status(response):
+            span = g.get("trace_span")
+            if span is not None:
+                span.set("status", response.status_code)
+            return response
+
+        @app.teardown_request
+        def _finish_trace(exc):
+            span = g.pop("trace_span", None)
+            token = g.pop("trace_token", None)
+            if span is None:
+                return
+            if exc is not None:
+                span.set("error", repr(exc))
+            _current_span.reset(token)
+            Tracer._finish(span)
+
+    @staticmethod
+    def exporter():
+        return Tracer._exporter
+
+    @staticmethod
+    def current() -> Span:
+        """
+        :return the span of the code that is running now, or None
+        """
+        return _current_span.get()
+
+    @staticmethod
+    def _finish(span: Span):
+        span.finish()
+        exporter = Tracer._exporter
+        if exporter is not None:
+            exporter.export(span)
+
+    @staticmethod
+    @contextmanager
+    def span(name: str, **attributes):
+        """
+        Record the code inside the with as a child of the current span, e.g:
+
+            with Tracer.span("json decode", bytes=len(content)):
+                ...
+
+        If the tracing is disabled the span is None
+        """
+        if Tracer._exporter is None:
+            yield None
+            return
+        parent = _current_span.get()
+        if parent is None:
+            span = Span(name)
+        else:
+            span = Span(name, parent.trace_id, parent.span_id)
+        span.attributes.update(attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as ex:
+            span.set("error", repr(ex))
+            raise
+        finally:
+            _current_span.reset(token)
+            Tracer._finish(span)
+
+    @staticmethod
+    def headers() -> dict:
+        """
+        :return the headers to propagate the current span to a microservice
+        """
+        span = _current_span.get()
+        if span is None:
+            return {}
+        return {TRACEPARENT_HEADER: span.traceparent()}
+
+    @staticmethod
+    def parse_traceparent(value: str):
+        """
+        :return tuple (trace id, parent span id) of the traceparent header,
+        or (None, None) if it is missing or not valid
+        """
+        if value is None:
+            return None, None
+        match = _TRACEPARENT.match(value.strip())
+        if match is None:
+            return None, None
+        return match.group(1), match.group(2)
+
+
+def traced(cls):
+    """
+    Class decorator that records a span for each call to the static
+    methods of the class, the span is named ClassName.method
+    """
+
+    def wrap(name, func):
+        span_name = "{}.{}".format(cls.__name__, name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Tracer.span(span_name, kind="service"):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    for name, value in list(vars(cls).items()):
+        if isinstance(value, staticmethod) and not name.startswith("_"):
+            setattr(cls, name, staticmethod(wrap(name, value.__func__)))
+    return cls
@@ -4,6 +4,6 @@ from .users import users
 from .restaurants import restaurants
 from .book import book
 from .health import health
+from .metrics import metrics
 
-
-blueprints = [home, auth, users, restaurants, book, health]
+blueprints = [home, auth, users, restaurants, book, health, metrics]
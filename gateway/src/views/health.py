@@ -1,10 +1,13 @@
-from flask import Blueprint, redirect, render_template, request
+from flask import Blueprint, abort, jsonify, redirect, render_template, request
 
 from src.auth import roles_allowed
 from src.services import UserService
 from src.forms import SearchUserForm
 
 from src.services import HealthyServices
+from src.services.contact_tracing import ContactTrace
+from src.utils.deadline import request_budget
+from src.utils.jobs import Jobs
 
 health = Blueprint("health", __name__)
 
@@ -17,6 +20,7 @@ def report_positive():
 
 
 @health.route("/mark_positive", methods=["POST", "GET"])
+@request_budget(60)
 @roles_allowed(roles=["HEALTH"])
 def mark_positive():
     form = SearchUserForm()
@@ -31,9 +35,10 @@ def mark_positive():
                     form=form,
                     message="Insert an email or a phone number",
                 )
-            message = HealthyServices.mark_positive(email, phone)
-            if len(message) == 0:
-                return redirect("/")
+            job, message = HealthyServices.start_mark_positive(email, phone)
+            if job is not None:
+                # the contacts are traced in background, see mark_positive_job
+                return redirect("/mark_positive/jobs/{}".format(job.id))
             return render_template(
                 "mark_positive.html",
                 _test="mark_positive_page_error_test",
@@ -44,7 +49,28 @@ def mark_positive():
     return render_template("mark_positive.html", form=form)
 
 
+@health.route("/mark_positive/jobs/<job_id>")
+@roles_allowed(roles=["HEALTH"])
+def mark_positive_job(job_id):
+    job = Jobs.get(job_id)
+    if job is None:
+        abort(404)
+    return render_template(
+        "mark_positive_job.html", _test="mark_positive_job_test", job=job.to_dict()
+    )
+
+
+@health.route("/mark_positive/jobs/<job_id>/status")
+@roles_allowed(roles=["HEALTH"])
+def mark_positive_job_status(job_id):
+    job = Jobs.get(job_id)
+    if job is None:
+        return jsonify({"message": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+
 @health.route("/search_contacts", methods=["POST", "GET"])
+@request_budget(60)
 @roles_allowed(roles=["HEALTH"])
 def search_contacts():
     form = SearchUserForm()
@@ -69,8 +95,19 @@ def search_contacts():
                     message="User not exist inside the sistem",
                     _test="search_contact_not_registered",
                 )
-            contacts = HealthyServices.search_contacts(email, phone)
-            if isinstance(contacts, list):
+            hops = request.args.get("hops", default=1, type=int)
+            if hops > 1:
+                contacts = HealthyServices.search_contacts_by_hop(email, phone, hops)
+            else:
+                contacts = HealthyServices.search_contacts(email, phone)
+            if isinstance(contacts, ContactTrace):
+                return render_template(
+                    "list_contacts.html",
+                    _test="list_hops_page",
+                    hops=contacts.hop_rows(),
+                    truncated=contacts.truncated,
+                )
+            elif isinstance(contacts, list):
                 return render_template(
                     "list_contacts.html", _test="list_page", contacts=contacts
                 )
@@ -5,11 +5,13 @@ from src.services import (
     UserService,
     RestaurantServices,
 )
+from src.utils.deadline import request_budget
 
 home = Blueprint("home", __name__)
 
 
 @home.route("/")
+@request_budget(5)
 def index():
     restaurants = RestaurantServices.get_all_restaurants()
     if current_user is None:
@@ -28,7 +30,9 @@ def index():
         elif session["ROLE"] == "OPERATOR":
             if "RESTAURANT_ID" in session:
                 restaurant_id = session["RESTAURANT_ID"]
-                model = RestaurantServices.get_all_restaurants_info(restaurant_id)
+                model = RestaurantServices.get_all_restaurants_info(
+                    restaurant_id, with_reviews=True
+                )
                 if model is None:
                     abort(501)
                 weekDaysLabel = [
@@ -53,7 +57,7 @@ def index():
                     cuisine=model.cusine,
                     weekDaysLabel=weekDaysLabel,
                     photos=model.photos,
-                    reviews=RestaurantServices.get_three_reviews(restaurant_id),
+                    reviews=model.reviews,
                     dishes=model.dishes,
                     _test=_test,
                 )
@@ -0,0 +1,10 @@
+from flask import Blueprint, Response
+
+from src.utils.metrics import Metrics
+
+metrics = Blueprint("metrics", __name__)
+
+
+@metrics.route("/metrics")
+def export_metrics():
+    return Response(Metrics.render(), mimetype="text/plain; version=0.0.4")
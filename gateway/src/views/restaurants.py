@@ -33,7 +33,9 @@ def restaurant_sheet(restaurant_id):
         "Sunday",
     ]
 
-    model = RestaurantServices.get_all_restaurants_info(restaurant_id)
+    model = RestaurantServices.get_all_restaurants_info(
+        restaurant_id, with_reviews=True
+    )
     if model is None:
         render_template(
             "generic_error.html",
@@ -58,7 +60,7 @@ def restaurant_sheet(restaurant_id):
         dishes=model.dishes,
         review_form=review_form,
         book_form=book_form,
-        reviews=RestaurantServices.get_three_reviews(restaurant_id),
+        reviews=model.reviews,
         _test="visit_rest_test",
     )
 